@@ -0,0 +1,83 @@
+"""
+Per-tick CPU cost of clipboard change detection on a 4K screenshot.
+
+    python bench_clipboard.py [--ticks 20] [--width 3840 --height 2160]
+
+"before" is the old monitor loop (decode + PNG encode + full byte compare every tick);
+the other rows are ClipboardMonitor ticks where nothing changed. Runs anywhere Pillow is installed.
+"""
+import argparse
+import io
+import time
+
+from PIL import Image, ImageDraw
+
+from clipboard_backend import ClipboardMonitor, MemoryClipboard, dib_to_png
+
+
+def make_screenshot_dib(width, height) -> bytes:
+    # Something screenshot-like: flat panels, gradients and text-ish strokes
+    im = Image.new("RGB", (width, height), "#0f172a")
+    draw = ImageDraw.Draw(im)
+    for x in range(0, width, 7):
+        draw.line([(x, 0), (x, height // 3)], fill=(x % 256, 80, 160))
+    for y in range(height // 3, height, 18):
+        for x in range(40, width - 40, 90):
+            draw.text((x, y), "CrossBoard sync", fill=(200, (x + y) % 256, 220))
+    with io.BytesIO() as out:
+        im.save(out, format="BMP")
+        return out.getvalue()[14:]  # Drop the file header -> CF_DIB layout
+
+
+def per_tick_ms(tick, ticks) -> float:
+    tick()  # Warm up
+    start = time.process_time()
+    for _ in range(ticks):
+        tick()
+    return (time.process_time() - start) * 1000 / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    args = parser.parse_args()
+
+    dib = make_screenshot_dib(args.width, args.height)
+    raw = {"type": "image", "raw": dib, "format": "dib"}
+    print(f"Image: {args.width}x{args.height}, {len(dib) / 1e6:.1f} MB DIB, {args.ticks} ticks each")
+
+    # Before: re-encode and compare full PNG bytes every tick
+    last = {"type": "image", "content": dib_to_png(dib)}
+    def old_tick():
+        current = {"type": "image", "content": dib_to_png(dib)}
+        return current["content"] != last["content"]
+
+    # After, no OS counter: hash the raw bytes, encode only on change
+    class NoCounterClipboard(MemoryClipboard):
+        def sequence(self):
+            return None
+
+    hashed_clipboard = NoCounterClipboard()
+    hashed_clipboard._set(raw)
+    hashed = ClipboardMonitor(hashed_clipboard)
+    hashed.sync()
+
+    # After, with an OS counter (Windows): unchanged counter means no read at all
+    counted_clipboard = MemoryClipboard()
+    counted_clipboard._set(raw)
+    counted = ClipboardMonitor(counted_clipboard)
+    counted.sync()
+
+    rows = [
+        ("before: PNG encode + compare", per_tick_ms(old_tick, args.ticks)),
+        ("after: raw-bytes fingerprint", per_tick_ms(hashed.poll, args.ticks)),
+        ("after: OS change counter", per_tick_ms(counted.poll, args.ticks)),
+    ]
+    for label, ms in rows:
+        print(f"  {label:<32} {ms:10.3f} ms/tick")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+End-to-end load test: N WebSocket subscribers, M concurrent uploaders, mixed text and image clips.
+
+    python bench_e2e.py [--subscribers 20] [--uploaders 4] [--uploads 25] [--rate 0]
+                        [--transport http|ws] [--out result.json]
+
+Starts the server under a local uvicorn (fresh uploads/ and history DB in a temp dir) unless
+--url points at a running one. Prints one JSON document: upload-to-delivery latency
+(upload sent -> new_clip received, per subscriber) as p50/p95/p99, uploads/sec, subscribers
+the server dropped, and the server's CPU time and peak RSS including its image workers
+(needs psutil or /proc), so runs can be diffed. Every upload is preceded by an arm; when
+uploaders race for the one-shot arm the loser's 403 is counted under "rejected" and retried.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+import requests
+import websockets
+from PIL import Image
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEXT_SIZES = (100, 10_000, 200_000)                   # Characters
+IMAGE_SIZES = ((64, 64), (512, 512), (1600, 1200))  # Pixels; noise, so PNG can't shrink them much
+DRAIN_TIMEOUT = 10  # Seconds to wait for the last deliveries after the final upload
+
+
+# --- SERVER ---
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str, secret: str):
+    port = free_port()
+    env = {**os.environ, "API_SECRET": secret, "HISTORY_DB": os.path.join(workdir, "bench.db"), "PYTHONPATH": ROOT}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=sys.stderr,  # Keep stdout for the JSON result
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/status", headers={"x-api-key": secret}, timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+class ProcessSampler:
+    """CPU seconds and RSS of a process plus its children (the image worker pool)."""
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+        self.start_cpu = self.sample()
+        self.start_wall = time.perf_counter()
+
+    def _proc_stats(self):
+        if psutil is not None:
+            root = psutil.Process(self.pid)
+            stats = []
+            for p in [root] + root.children(recursive=True):
+                try:
+                    times = p.cpu_times()
+                    stats.append((times.user + times.system, p.memory_info().rss))
+                except psutil.NoSuchProcess:
+                    pass
+            return stats
+        if not os.path.isdir("/proc"):
+            return None
+        tick, page = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE")
+        stats = []
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            # fields[1] = ppid, [11]/[12] = utime/stime in ticks, [21] = rss in pages
+            if int(entry) == self.pid or int(fields[1]) == self.pid:
+                stats.append(((int(fields[11]) + int(fields[12])) / tick, int(fields[21]) * page))
+        return stats
+
+    def sample(self):
+        stats = self._proc_stats()
+        if stats is None:
+            return None
+        self.peak_rss = max(self.peak_rss, sum(rss for _, rss in stats))
+        return sum(cpu for cpu, _ in stats)
+
+    async def run(self, interval: float = 0.2):
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def report(self) -> dict:
+        """Since construction; includes the drain and any image rendering still running."""
+        end_cpu = self.sample()
+        if end_cpu is None or self.start_cpu is None:
+            return {"cpu_seconds": None, "cpu_percent": None, "rss_peak_mb": None}
+        cpu = end_cpu - self.start_cpu
+        return {
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(100 * cpu / (time.perf_counter() - self.start_wall), 1),
+            "rss_peak_mb": round(self.peak_rss / 2**20, 1),
+        }
+
+
+# --- WORKLOAD ---
+def make_sources(rng: random.Random):
+    images = []
+    for width, height in IMAGE_SIZES:
+        im = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+        with io.BytesIO() as out:
+            im.save(out, format="PNG")
+            images.append(out.getvalue())
+    words = "sync clipboard phone desktop secure arm upload image text server token".split()
+    filler = " ".join(rng.choice(words) for _ in range(max(TEXT_SIZES) // 5))
+    return images, filler
+
+
+def make_clips(rng: random.Random, count: int, image_ratio: float, images, filler: str):
+    """(kind, body, sha256) tuples; every body is unique so deliveries can be matched to uploads."""
+    clips = []
+    for _ in range(count):
+        if rng.random() < image_ratio:
+            # Bytes after IEND are ignored by decoders but make each blob distinct
+            body = rng.choice(images) + uuid.uuid4().bytes
+            clips.append(("image", body, hashlib.sha256(body).hexdigest()))
+        else:
+            body = f"{uuid.uuid4()} {filler[:rng.choice(TEXT_SIZES)]}"
+            clips.append(("text", body, hashlib.sha256(body.encode("utf-8")).hexdigest()))
+    return clips
+
+
+def http_uploader(url: str, secret: str, clips, sent: dict, stats: dict, interval: float):
+    session = requests.Session()
+    session.headers["x-api-key"] = secret
+    for kind, body, sha in clips:
+        next_at = time.time() + interval
+        while True:
+            session.post(f"{url}/arm").raise_for_status()
+            sent[sha] = time.time()  # Latency counts from the attempt that was accepted
+            if kind == "text":
+                res = session.post(f"{url}/upload", data={"type": "text", "content": body})
+            else:
+                res = session.post(f"{url}/upload", data={"type": "image"}, files={"file": ("bench.png", body, "image/png")})
+            if res.status_code == 403:
+                stats["rejected"] += 1
+                continue
+            stats["ok" if res.ok else "failed"] += 1
+            break
+        time.sleep(max(0.0, next_at - time.time()))
+    stats["finished"] = time.perf_counter()
+
+
+async def ws_uploader(ws_url: str, clips, sent: dict, stats: dict, interval: float, compression):
+    # Unbounded receive queue: broadcasts pile up unread once we're done, which would stall the close
+    async with websockets.connect(ws_url, max_size=None, max_queue=None, compression=compression) as ws:
+        await ws.recv()  # Catch-up message
+
+        async def call(op, payload=None, **fields):
+            request_id = uuid.uuid4().hex
+            await ws.send(json.dumps({"op": op, "id": request_id, **fields}))
+            if payload is not None:
+                await ws.send(payload)
+            while True:
+                msg = json.loads(await ws.recv())  # Broadcasts to this socket are skipped
+                if msg.get("event") == "response" and msg.get("id") == request_id:
+                    return msg
+
+        for kind, body, sha in clips:
+            next_at = time.time() + interval
+            while True:
+                await call("arm")
+                sent[sha] = time.time()
+                if kind == "text":
+                    res = await call("upload", type="text", content=body)
+                else:
+                    res = await call("upload", payload=body, type="image", ext="png")
+                if not res["ok"] and res.get("status") == 403:
+                    stats["rejected"] += 1
+                    continue
+                stats["ok" if res["ok"] else "failed"] += 1
+                break
+            await asyncio.sleep(max(0.0, next_at - time.time()))
+        stats["finished"] = time.perf_counter()  # Before the close handshake, which isn't upload work
+
+
+async def listen(ws, arrivals: list, counts: list, index: int):
+    try:
+        async for message in ws:
+            # Timestamp first and skip the full JSON parse
+            at = time.time()
+            if isinstance(message, str) and message.startswith('{"event":"new_clip"'):
+                start = message.index('"sha256":"') + 10
+                arrivals.append((message[start:start + 64], at))
+                counts[index] += 1
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def collect(ws_url: str, count: int, compression, conn) -> dict:
+    sockets = []
+    for _ in range(count):
+        ws = await websockets.connect(ws_url, max_size=None, compression=compression)
+        await ws.recv()  # Catch-up message
+        sockets.append(ws)
+    arrivals, counts = [], [0] * count
+    listeners = [asyncio.create_task(listen(ws, arrivals, counts, i)) for i, ws in enumerate(sockets)]
+    conn.send("ready")
+    uploaded = await asyncio.to_thread(conn.recv)  # Sent once the uploads are done
+    deadline = time.time() + DRAIN_TIMEOUT
+    while time.time() < deadline and any(
+            ws.close_code is None and counts[i] < uploaded for i, ws in enumerate(sockets)):
+        await asyncio.sleep(0.05)
+    # Closed by the server before we were done, e.g. evicted as slow consumers (1013)
+    dropped = [ws.close_code for ws in sockets if ws.close_code is not None]
+    for task in listeners:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+    return {"arrivals": arrivals, "dropped": dropped}
+
+
+def subscriber_process(ws_url: str, count: int, compression, conn):
+    """
+    Subscribers live in their own process so the uploaders (threads, big multipart
+    bodies) can't starve them; a lagging subscriber would be evicted by the server.
+    Timestamps are time.time() as they are compared across processes.
+    """
+    conn.send(asyncio.run(collect(ws_url, count, compression, conn)))
+
+
+def percentiles(seconds) -> dict:
+    if not seconds:
+        return {"count": 0}
+    ms = sorted(s * 1000 for s in seconds)
+    pick = lambda p: round(ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))], 2)
+    return {"count": len(ms), "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": round(ms[-1], 2)}
+
+
+async def run(args, url: str, secret: str, server_pid: Optional[int]):
+    ws_url = url.replace("http", "ws", 1) + f"/ws?token={secret}"
+    compression = "deflate" if args.deflate else None
+    rng = random.Random(args.seed)
+    images, filler = make_sources(rng)
+    batches = [make_clips(rng, args.uploads, args.image_ratio, images, filler) for _ in range(args.uploaders)]
+    kinds = {sha: kind for batch in batches for kind, _, sha in batch}
+
+    conn, child_conn = multiprocessing.Pipe()
+    subscribers = multiprocessing.Process(target=subscriber_process, args=(ws_url, args.subscribers, compression, child_conn))
+    subscribers.start()
+    await asyncio.to_thread(conn.recv)  # "ready": every subscriber has its catch-up message
+
+    sent = {}
+    sampler = ProcessSampler(server_pid) if server_pid else None
+    sampling = asyncio.create_task(sampler.run()) if sampler else None
+    stats = [{"ok": 0, "rejected": 0, "failed": 0, "finished": 0.0} for _ in batches]
+
+    interval = 1 / args.rate if args.rate else 0.0
+    started = time.perf_counter()
+    if args.transport == "ws":
+        await asyncio.gather(*(ws_uploader(ws_url, batch, sent, s, interval, compression) for batch, s in zip(batches, stats)))
+    else:
+        await asyncio.gather(*(asyncio.to_thread(http_uploader, url, secret, batch, sent, s, interval) for batch, s in zip(batches, stats)))
+    elapsed = max(s["finished"] for s in stats) - started
+
+    totals = {k: sum(s[k] for s in stats) for k in ("ok", "rejected", "failed")}
+    expected = totals["ok"] * args.subscribers
+    conn.send(totals["ok"])
+    collected = await asyncio.to_thread(conn.recv)
+    subscribers.join()
+    server = sampler.report() if sampler else None
+    if sampling:
+        sampling.cancel()
+    arrivals, dropped = collected["arrivals"], collected["dropped"]
+
+    latency = {"all": [], "text": [], "image": []}
+    for sha, at in arrivals:
+        if sha in sent:
+            latency["all"].append(at - sent[sha])
+            latency[kinds[sha]].append(at - sent[sha])
+
+    return {
+        "config": {k: getattr(args, k) for k in ("subscribers", "uploaders", "uploads", "image_ratio", "rate", "transport", "deflate", "seed")},
+        "uploads": {**totals, "seconds": round(elapsed, 3), "per_sec": round(totals["ok"] / elapsed, 2) if elapsed else None},
+        "deliveries": {"expected": expected, "received": len(arrivals), "subscribers_dropped": len(dropped),
+                       "close_codes": sorted(set(dropped))},
+        "latency_ms": {k: percentiles(v) for k, v in latency.items()},
+        "server": server,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=20)
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--uploads", type=int, default=25, help="Per uploader")
+    parser.add_argument("--image-ratio", type=float, default=0.3)
+    parser.add_argument("--rate", type=float, default=0, help="Max uploads/sec per uploader (0: as fast as possible)")
+    parser.add_argument("--transport", choices=("http", "ws"), default="http")
+    parser.add_argument("--deflate", action="store_true",
+                        help="Negotiate permessage-deflate like browsers (the desktop clients don't)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one")
+    parser.add_argument("--secret", default=os.getenv("API_SECRET") or "bench")
+    parser.add_argument("--out", help="Also write the JSON result here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = None
+        url = args.url
+        if url is None:
+            proc, url = start_server(workdir, args.secret)
+        try:
+            result = asyncio.run(run(args, url, args.secret, proc.pid if proc else None))
+        finally:
+            if proc:
+                proc.terminate()
+                proc.wait(10)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Bytes on the wire for text clips: full JSON events vs. compression vs. deltas.
+
+    python bench_text_transport.py
+
+The corpus mimics our usual traffic: a growing log copied again and again, a source
+file copied after small edits, and short unrelated snippets. "deflate" approximates
+permessage-deflate without context takeover (each event compressed on its own).
+"""
+import json
+import random
+import uuid
+import zlib
+
+from text_delta import apply_delta, make_delta
+
+
+def deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def log_corpus(rng, clips=20):
+    lines = [f"2026-10-17 10:{i // 60:02d}:{i % 60:02d} INFO worker-{i % 4} processed job {i} in {rng.randint(3, 900)}ms\n" for i in range(1500)]
+    for _ in range(clips):
+        for _ in range(rng.randint(10, 60)):
+            n = len(lines)
+            lines.append(f"2026-10-17 11:{n // 60 % 60:02d}:{n % 60:02d} WARN worker-{n % 4} retry {n} after {rng.randint(3, 900)}ms\n")
+        yield "".join(lines[-2000:])  # Copy the last 2000 lines of the terminal
+
+
+def code_corpus(rng, clips=20):
+    with open(__file__.replace("bench_text_transport.py", "main.py"), encoding="utf-8") as f:
+        lines = f.readlines()
+    for _ in range(clips):
+        for _ in range(rng.randint(1, 4)):
+            i = rng.randrange(len(lines))
+            lines[i] = lines[i].rstrip("\n") + f"  # edited {rng.randint(0, 999)}\n"
+        yield "".join(lines)
+
+
+def snippet_corpus(rng, clips=20):
+    words = "sync clipboard phone desktop secure arm upload image text server token".split()
+    for _ in range(clips):
+        yield " ".join(rng.choice(words) for _ in range(rng.randint(3, 40)))
+
+
+def measure(name, texts):
+    totals = {"full": 0, "deflate": 0, "delta": 0, "delta+deflate": 0}
+    previous = None
+    for text in texts:
+        data = {"id": str(uuid.uuid4()), "type": "text", "content": text, "timestamp": "2026-10-17T11:00:00"}
+        full = json.dumps({"event": "new_clip", "data": data}).encode()
+        wire = full
+        if previous is not None:
+            ops = make_delta(previous, text)
+            if ops is not None:
+                assert apply_delta(previous, ops) == text
+                wire = json.dumps({"event": "new_clip", "data": {**data, "content": ""}, "delta": {"ops": ops}}).encode()
+        totals["full"] += len(full)
+        totals["deflate"] += len(deflate(full))
+        totals["delta"] += len(wire)
+        totals["delta+deflate"] += len(deflate(wire))
+        previous = text
+    return name, totals
+
+
+def main():
+    rng = random.Random(42)
+    rows = [
+        measure("growing log", log_corpus(rng)),
+        measure("edited source", code_corpus(rng)),
+        measure("short snippets", snippet_corpus(rng)),
+    ]
+    grand = {k: sum(t[k] for _, t in rows) for k in rows[0][1]}
+    rows.append(("total", grand))
+
+    print(f"{'corpus':<16}" + "".join(f"{k:>16}" for k in grand))
+    for name, totals in rows:
+        cells = "".join(f"{v / 1024:11.1f} KB{'':1}" if k == "full" else f"{v / 1024:8.1f} KB {100 * (1 - v / totals['full']):3.0f}%" for k, v in totals.items())
+        print(f"{name:<16}{cells}")
+
+
+if __name__ == "__main__":
+    main()
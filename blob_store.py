@@ -0,0 +1,273 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, only the in-process lock applies
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB read/hash chunks
+LOCK_FILE = ".lock"  # flock'ed by every server process sharing the directory
+PLACE_GRACE = 60  # Seconds a blob another process just stored is kept from our deletes
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+def clean_ext(ext: Optional[str]) -> str:
+    # Extension comes from the client's filename; never let it carry path characters
+    return "".join(c for c in (ext or "").lower() if c.isalnum())[:8] or "png"
+
+
+def fsync_dir(path: str):
+    """Make a rename inside `path` durable (no-op where directories can't be opened, e.g. Windows)."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BlobStore:
+    """
+    Content-addressed storage for uploaded files.
+    Blobs live at {root}/{sha256}.{ext}; identical payloads share one file and
+    a reference count, so the file is only unlinked when the last clip using it goes away.
+
+    The file work (write_stream, place_file, delete_unreferenced) may run on worker
+    threads. Between placing a file and claim() taking the reference on the caller's
+    side, the name is pinned, so a concurrent deletion of an older copy leaves it alone.
+
+    Several server processes may share root (--workers, or hosts on a network share).
+    Each keeps its own refcounts, so pins can't be seen across processes: placing
+    refreshes the file's mtime and deleting happens under an flock on LOCK_FILE,
+    skipping a blob another process placed within PLACE_GRACE seconds (its clip is
+    on its way to us and will take a reference).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.refcounts: Dict[str, int] = {}
+        self.variants: Dict[str, Dict[str, str]] = {}  # blob name -> {variant: filename}
+        self._pins: Dict[str, int] = {}  # Placed on disk, reference not taken yet
+        self._placed: Dict[str, int] = {}  # Blob name -> mtime (ns) our last place_file left on it
+        self._lock = threading.Lock()  # Orders placing and deleting the same name
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def _file_lock(self):
+        """self._lock, plus the flock other processes sharing root take (where flock exists)."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path(LOCK_FILE), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def write_stream(self, src: BinaryIO, ext: str = "png", max_bytes: Optional[int] = None,
+                     fsync: bool = False) -> Tuple[str, str, int]:
+        """
+        Hash and write `src` in one pass, safe on a worker thread: (blob filename, sha256 hex, size),
+        with the name pinned until claim(). `fsync` returns only once the blob is on disk.
+        """
+        tmp_path = self.path(f".tmp-{uuid.uuid4().hex}")
+        hasher = hashlib.sha256()
+        written = 0
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if max_bytes is not None and written > max_bytes:
+                        raise BlobTooLarge(f"Upload exceeds {max_bytes} bytes")
+                    hasher.update(chunk)
+                    out.write(chunk)
+                if fsync:
+                    out.flush()
+                    os.fsync(out.fileno())
+            name, digest = self.place_file(tmp_path, hasher.hexdigest(), ext, fsync)
+            return name, digest, written
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def place_file(self, tmp_path: str, digest: str, ext: str, fsync: bool = False) -> Tuple[str, str]:
+        """Rename into place and pin the name; follow with claim()."""
+        name = f"{digest}.{clean_ext(ext)}"
+        with self._file_lock():
+            if os.path.exists(self.path(name)):
+                # Already stored: keep the existing file, skip the rename
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, self.path(name))
+            os.utime(self.path(name))  # Tells other processes it was just placed
+            self._placed[name] = os.stat(self.path(name)).st_mtime_ns
+            self._pins[name] = self._pins.get(name, 0) + 1
+        if fsync:
+            fsync_dir(self.root)
+        return name, digest
+
+    def claim(self, name: str):
+        """Turn the pin from place_file into a reference."""
+        with self._lock:
+            self.incref(name)
+            count = self._pins.get(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            else:
+                self._pins.pop(name, None)
+
+    def stored_bytes(self) -> int:
+        """Bytes on disk under root (blobs, variants and uploads in progress)."""
+        total = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass  # Deleted while we were scanning
+        return total
+
+    def incref(self, name: str):
+        self.refcounts[name] = self.refcounts.get(name, 0) + 1
+
+    def drop(self, name: str) -> List[str]:
+        """Drop one reference: the files to delete (blob and variants) if that was the last one, see delete_unreferenced."""
+        with self._lock:
+            count = self.refcounts.get(name, 0) - 1
+            if count > 0:
+                self.refcounts[name] = count
+                return []
+            self.refcounts.pop(name, None)
+        return [name, *self.variants.pop(name, {}).values()]
+
+    def delete_unreferenced(self, name: str, filenames: List[str]):
+        """Unlink a dropped blob's files, unless it was stored again in the meantime (by any process)."""
+        with self._file_lock():
+            if name in self.refcounts or name in self._pins:
+                return
+            try:
+                mtime = os.stat(self.path(name)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime != self._placed.get(name) and time.time_ns() - mtime < PLACE_GRACE * 10**9:
+                return  # Another process just stored it again
+            self._placed.pop(name, None)
+            for filename in filenames:
+                try:
+                    os.remove(self.path(filename))
+                except FileNotFoundError:
+                    pass
+
+
+class PartialBlob:
+    """
+    An upload being received in chunks, possibly out of order or in parallel.
+    Chunks are written at their offset straight into a pre-sized file inside the
+    store, which is renamed to its content address by finish() (no second copy).
+    The hash is advanced as long as data arrives in order; any remainder is
+    read back once at commit time.
+    """
+
+    def __init__(self, store: BlobStore, size: int, ext: str = "png"):
+        self.store = store
+        self.size = size
+        self.ext = clean_ext(ext)
+        self.path = store.path(f".part-{uuid.uuid4().hex}")
+        self.received: List[List[int]] = []  # Sorted, merged [start, end) ranges
+        self._hasher = hashlib.sha256()
+        self._hashed_upto = 0
+        self._lock = threading.Lock()  # Chunks may be written from several worker threads
+        self.touched = time.monotonic()  # Last activity, for expiring abandoned uploads
+        with open(self.path, "wb") as f:
+            f.truncate(size)
+
+    @property
+    def received_bytes(self) -> int:
+        return sum(end - start for start, end in self.received)
+
+    @property
+    def complete(self) -> bool:
+        return self.received == [[0, self.size]] or self.size == 0
+
+    def missing(self) -> List[List[int]]:
+        gaps, cursor = [], 0
+        for start, end in self.received:
+            if start > cursor:
+                gaps.append([cursor, start])
+            cursor = end
+        if cursor < self.size:
+            gaps.append([cursor, self.size])
+        return gaps
+
+    def write_at(self, offset: int, data: bytes):
+        end = offset + len(data)
+        if offset < 0 or end > self.size:
+            raise BlobTooLarge(f"Chunk [{offset}, {end}) is outside the declared size {self.size}")
+        if not data:
+            return
+        fd = os.open(self.path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        try:
+            if hasattr(os, "pwrite"):
+                os.pwrite(fd, data, offset)
+            else:
+                os.lseek(fd, offset, os.SEEK_SET)
+                os.write(fd, data)
+        finally:
+            os.close(fd)
+        with self._lock:
+            if offset <= self._hashed_upto < end:
+                self._hasher.update(data[self._hashed_upto - offset:])
+                self._hashed_upto = end
+            self._mark(offset, end)
+
+    def _mark(self, start: int, end: int):
+        merged = []
+        for s, e in self.received:
+            if e < start or s > end:
+                merged.append([s, e])
+            else:
+                start, end = min(s, start), max(e, end)
+        merged.append([start, end])
+        merged.sort()
+        self.received = merged
+
+    def finish(self, fsync: bool = False) -> Tuple[str, str]:
+        """Hash the rest and place the blob (pinned until claim()); safe on a worker thread."""
+        if not self.complete:
+            raise ValueError("Upload is incomplete")
+        with open(self.path, "rb+" if fsync else "rb") as f:
+            f.seek(self._hashed_upto)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._hasher.update(chunk)
+            if fsync:
+                os.fsync(f.fileno())
+        return self.store.place_file(self.path, self._hasher.hexdigest(), self.ext, fsync)
+
+    def abort(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -4,17 +4,23 @@ import os
 import websocket
 import json
 import threading
-import io
-import pyperclip
-from PIL import Image, ImageGrab
-import win32clipboard
+import functools
+import uuid
 from dotenv import load_dotenv
 
+from clip_receiver import SETTLE_SECONDS, ClipReceiver, clip_sha256
+from clipboard_backend import ClipboardMonitor, encode_content, get_backend
+from state_backend import event_clips
+from text_delta import resolve_text
+from ws_rpc import FrameTooLarge, RequestFailed, WSRequester
+
 # --- CONFIG ---
 load_dotenv()
 SERVER_URL = "http://127.0.0.1:8000"
 WS_URL = "ws://127.0.0.1:8000/ws"
 API_SECRET = os.getenv("API_SECRET")
+WS_UPLOAD_MAX = 8 * 1024 * 1024  # Encoded bytes; bigger clips go over HTTP (uvicorn caps WebSocket messages at 16 MB)
+DEVICE_ID = os.getenv("DEVICE_ID") or uuid.uuid4().hex  # The server doesn't echo our own uploads back to us
 
 if not API_SECRET:
     print("❌ ERROR: API_SECRET not set in .env")
@@ -22,163 +28,228 @@ if not API_SECRET:
 
 # Global State
 last_content = None
+held_sha = None  # sha256 of what we last put on or uploaded from the clipboard (echo suppression)
 content_lock = threading.Lock()
 pause_monitoring = False
-
-def get_clipboard_content():
-    try:
-        # Check image first
-        im = ImageGrab.grabclipboard()
-        if isinstance(im, Image.Image):
-            with io.BytesIO() as output:
-                im.save(output, format="PNG")
-                return {"type": "image", "content": output.getvalue()} # Bytes
-        
-        # Check text
-        text = pyperclip.paste()
-        if text and text.strip():
-            return {"type": "text", "content": text} # String
-    except Exception:
-        pass
-    return None
+last_ws_text = None  # Last text clip received over the socket (base for deltas)
+pending_inline = None  # new_clip event waiting for its binary payload frame
+last_event_seq = None  # Cursor of the last event seen; reconnects resume from it (/ws?since=)
+clipboard = get_backend()  # Windows, Wayland, X11... (CLIPBOARD_BACKEND to override)
+monitor = ClipboardMonitor(clipboard)  # Cheap change detection (OS counter / raw hash before any image encode)
+rpc = WSRequester()  # Uploads ride on the open socket
+receiver = ClipReceiver()  # Applies incoming clips off the socket thread, newest only
+uploader = ClipReceiver("clip-uploader")  # Encodes and uploads local copies off the monitor thread, newest only
+http = requests.Session()  # Keep-alive for downloads and the HTTP fallback
+http.headers["x-api-key"] = API_SECRET
+http.headers["x-device-id"] = DEVICE_ID
 
 def set_clipboard_content(data):
-    global last_content, pause_monitoring
+    """Runs on the receiver's worker thread, never on the socket thread."""
+    global last_content, held_sha, pause_monitoring
+    with content_lock:
+        if data.get('sha256') and data['sha256'] == held_sha:
+            print("⏭️ Already on clipboard, skipped")  # Our own upload coming back, or a repeat
+            return
     print(f"🔄 Syncing {data['type']} from server...")
-    
+
     with content_lock:
         pause_monitoring = True
-    
     try:
         if data['type'] == 'text':
-            pyperclip.copy(data['content'])
-            # Update last_content so monitor doesn't see it as "new"
-            with content_lock:
-                last_content = {"type": "text", "content": data['content']}
-                
-        elif data['type'] == 'image':
-            # Download
-            img_url = f"{SERVER_URL}/uploads/{data['content']}"
-            res = requests.get(img_url, headers={"x-api-key": API_SECRET})
-            if res.status_code == 200:
+            fetch_full_text(data)
+        else:
+            image_data = data.get('payload') # Sent inline with the event if small
+            if image_data is None:
+                # Download
+                res = http.get(f"{SERVER_URL}/uploads/{data['content']}")
+                res.raise_for_status()
                 image_data = res.content
-                
-                # Set to Clipboard (Windows)
-                image = Image.open(io.BytesIO(image_data))
-                output = io.BytesIO()
-                image.convert("RGB").save(output, "BMP")
-                bmp_data = output.getvalue()[14:] # DIB header offset
-                output.close()
-
-                win32clipboard.OpenClipboard()
-                win32clipboard.EmptyClipboard()
-                win32clipboard.SetClipboardData(win32clipboard.CF_DIB, bmp_data)
-                win32clipboard.CloseClipboard()
-                
-                # Update last_content
-                # converting back to PNG bytes to match get_clipboard_content format is expensive
-                # so we might just set it to what we think get_clipboard_content will return
-                # OR just ignore the next check.
-                # Let's try to simulate:
-                with io.BytesIO() as png_out:
-                    image.save(png_out, format="PNG")
-                    with content_lock:
-                        last_content = {"type": "image", "content": png_out.getvalue()}
-                        
+        if receiver.superseded():
+            print("⏭️ Newer clip arrived, skipped")
+            return
+
+        if data['type'] == 'text':
+            clipboard.write_text(data['content'])
+            applied = {"type": "text", "content": data['content']}
+        else:
+            clipboard.write_image(image_data)
+            applied = {"type": "image", "content": image_data}  # The bytes we applied, no re-encode
+        # Update last_content so monitor doesn't see it as "new"
+        with content_lock:
+            last_content = applied
+            held_sha = data.get('sha256') or clip_sha256(applied)
+            monitor.sync()
         print("✅ Sync applied locally")
-    except Exception as e:
-        print(f"❌ Failed to apply sync: {e}")
+        time.sleep(SETTLE_SECONDS) # Give OS time to process clipboard
     finally:
-        time.sleep(0.5) # Give OS time to process clipboard
         with content_lock:
             pause_monitoring = False
 
 def monitor_loop():
-    global last_content
+    global last_content, held_sha
     print("👀 Clipboard Monitor Started")
     
     # Initialize
     with content_lock:
-        last_content = get_clipboard_content()
+        last_content = monitor.poll()
+        held_sha = clip_sha256(last_content) if last_content else None
     
     while True:
         try:
-            time.sleep(1)
+            monitor.wait(1) # Returns early when the backend pushes a change
             
             with content_lock:
                 if pause_monitoring:
                     continue
             
-            opts = get_clipboard_content() # Read current
-            
-            # Compare
-            changed = False
-            with content_lock:
-                if opts is None and last_content is not None:
-                     # Cleared? We ignore clears usually
-                     pass
-                elif opts is not None and last_content is None:
-                    changed = True
-                elif opts and last_content:
-                    if opts['type'] != last_content['type']:
-                        changed = True
-                    elif opts['content'] != last_content['content']:
-                        changed = True
-            
-            if changed:
-                print("📤 Local Change Detected! Uploading...")
-                with content_lock:
-                    last_content = opts
-                
-                # Upload
-                if opts['type'] == 'text':
-                    res = requests.post(f"{SERVER_URL}/upload", 
-                        data={"content": opts['content'], "type": "text"},
-                        headers={"x-api-key": API_SECRET}
-                    )
-                    res.raise_for_status()
-                elif opts['type'] == 'image':
-                    files = {'file': ('clipboard.png', opts['content'], 'image/png')}
-                    res = requests.post(f"{SERVER_URL}/upload", 
-                        data={"type": "image"},
-                        files=files,
-                        headers={"x-api-key": API_SECRET}
-                    )
-                    res.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 403:
-                print("🔒 System Disarmed. Upload ignored.")
-            else:
-                print(f"⚠️ HTTP Error: {e}")
-            time.sleep(1)
+            raw = monitor.poll_raw() # None unless the clipboard actually changed
+            if raw is not None:
+                uploader.submit(functools.partial(upload_change, raw)) # Encoding a big image doesn't hold up the next check
         except Exception as e:
             print(f"⚠️ Monitor Error: {e}")
             time.sleep(1)
 
+def upload_change(raw):
+    """Runs on the uploader's worker thread: encode the local copy, then upload it unless it is stale."""
+    global last_content, held_sha, last_ws_text
+    opts = encode_content(raw)
+    with content_lock:
+        if uploader.superseded() or not monitor.is_current(raw):
+            return # Copied again, or an incoming clip replaced it, while we were encoding
+        if last_content and opts['type'] == last_content['type'] and opts['content'] == last_content['content']:
+            return
+        last_content = opts
+        held_sha = clip_sha256(opts)
+
+    print("📤 Local Change Detected! Uploading...")
+    try:
+        item = upload(opts)
+        if opts['type'] == 'text':
+            last_ws_text = opts['content']  # The server builds our next delta against our own upload
+        print(f"✅ Stored as clip {item['seq']}")  # Not echoed back to us, the ack is the confirmation
+    except RequestFailed as e:
+        if e.status == 403:
+            print("🔒 System Disarmed. Upload ignored.")
+        else:
+            print(f"⚠️ Upload Error: {e}")
+    except Exception as e:
+        print(f"⚠️ Upload Error: {e}")
+
+def upload(opts):
+    """
+    Over the open socket; HTTP only for very large clips or while reconnecting.
+    Returns the server's ack: the stored clip (id, seq, sha256).
+    """
+    if rpc.connected:
+        try:
+            if opts['type'] == 'text':
+                return rpc.request("upload", max_frame=WS_UPLOAD_MAX, type="text", content=opts['content'])["item"]
+            return rpc.request("upload", payload=opts['content'], max_frame=WS_UPLOAD_MAX,
+                                 type="image", ext=opts['ext'])["item"]
+        except FrameTooLarge:
+            pass
+    if opts['type'] == 'text':
+        res = http.post(f"{SERVER_URL}/upload", data={"content": opts['content'], "type": "text"})
+    else:
+        files = {'file': (f"clipboard.{opts['ext']}", opts['content'], f"image/{opts['ext']}")}
+        res = http.post(f"{SERVER_URL}/upload", data={"type": "image"}, files=files)
+    if not res.ok:
+        raise RequestFailed(res.status_code, res.text)
+    return res.json()["item"]
+
 # WebSocket
 def on_message(ws, message):
+    global pending_inline, last_event_seq
     try:
+        if isinstance(message, bytes):
+            # Binary frame: the payload of the new_clip event we just got
+            if pending_inline is not None:
+                data, pending_inline = pending_inline, None
+                data['payload'] = message
+                receiver.submit(lambda: set_clipboard_content(data))
+            return
+
         msg = json.loads(message)
-        if msg.get("event") == "new_clip":
-            # We received a new clip. 
-            # Check if it matches what we already have (to avoid echo if we just sent it)
-            # Implemented via 'pause_monitoring' but also double check content?
-            # Creating a hash would be better but keeping it simple.
-            set_clipboard_content(msg['data'])
+        if rpc.handle(msg):
+            return
+        had_cursor = last_event_seq is not None
+        last_event_seq = msg.get("seq", last_event_seq)
+        if msg.get("event") == "replay":
+            # Events broadcast while we were offline; only the newest clip matters for the clipboard
+            clips = [expand_clip({**e, "data": data}) for e in msg["events"] for data in event_clips(e)]
+            if clips:
+                receiver.submit(lambda: set_clipboard_content(clips[-1]))
+        elif msg.get("event") == "resync":
+            if had_cursor: # Offline for too long to replay, catch up from the server state
+                receiver.submit(sync_latest)
+        elif msg.get("event") == "new_clip":
+            # We received a new clip; echoes of our own uploads are skipped by sha256
+            data = expand_clip(msg)
+            if msg.get("inline"):
+                pending_inline = data # Payload follows in the next frame
+                return
+            receiver.submit(lambda: set_clipboard_content(data))
+        elif msg.get("event") == "new_clips":
+            # A batch upload: the clipboard takes the newest, every text still moves our delta base
+            clips = [expand_clip({"data": data}) for data in msg["data"]]
+            receiver.submit(lambda: set_clipboard_content(clips[-1]))
     except Exception as e:
         print(f"WS Error: {e}")
 
+def expand_clip(msg):
+    """Rebuild text sent as a delta against the previous clip; fetch it whole if our base is stale."""
+    global last_ws_text
+    data = msg['data']
+    if "delta" in msg:
+        text = resolve_text(msg, last_ws_text)
+        if text is None:
+            # Small and rare; fetched here since the next delta builds on it
+            res = http.get(f"{SERVER_URL}/clip/{data['id']}")
+            res.raise_for_status()
+            text = res.json()['content']
+        data['content'] = text
+    if data['type'] == 'text':
+        last_ws_text = data['content']
+    return data
+
+def fetch_full_text(data):
+    """Large text arrives as a preview; the whole text is fetched (gzipped) from uploads/."""
+    if data.get('text_file'):
+        res = http.get(f"{SERVER_URL}/uploads/{data.pop('text_file')}")
+        res.raise_for_status()
+        res.encoding = "utf-8"
+        data['content'] = res.text
+
+def sync_latest():
+    global last_ws_text
+    res = http.get(f"{SERVER_URL}/latest")
+    if res.status_code == 404:
+        return
+    res.raise_for_status()
+    data = res.json()
+    if data['type'] == 'text':
+        last_ws_text = data['content']
+    set_clipboard_content(data)
+
 def on_error(ws, error):
     print(f"❌ WebSocket logic error: {error}")
 
+def on_open(ws):
+    rpc.attach(ws)
+
 def on_close(ws, close_status_code, close_msg):
+    rpc.detach()
     print("🔌 Disconnected")
     time.sleep(2)
     start_listener() # Auto-reconnect
 
 def start_listener():
     websocket.enableTrace(False)
-    ws = websocket.WebSocketApp(f"{WS_URL}?token={API_SECRET}",
+    url = f"{WS_URL}?token={API_SECRET}&delta=1&inline=1&device={DEVICE_ID}"
+    if last_event_seq is not None:
+        url += f"&since={last_event_seq}"
+    ws = websocket.WebSocketApp(url,
+                              on_open=on_open,
                               on_message=on_message,
                               on_error=on_error,
                               on_close=on_close)
@@ -0,0 +1,62 @@
+"""
+Receive side of the desktop clients (client.py, desktop_gui.py).
+
+The WebSocket thread only parses events and hands each clip to a ClipReceiver; a
+worker thread does the slow part (download, clipboard write). Only the newest clip
+matters for a clipboard, so a clip that is superseded before the worker gets to it
+is dropped, and a burst of incoming clips costs one apply instead of a backlog.
+The send side uses a second one to encode and upload local copies, so encoding a
+large screenshot never holds up change detection.
+"""
+import hashlib
+import threading
+from typing import Callable, Optional
+
+SETTLE_SECONDS = 0.5  # Give the OS time to process a clipboard write before watching it again
+
+
+def clip_sha256(clip: dict) -> str:
+    """Same hash the server puts in `sha256` (UTF-8 text or the image bytes), for echo suppression."""
+    content = clip["content"]
+    return hashlib.sha256(content.encode("utf-8") if isinstance(content, str) else content).hexdigest()
+
+
+class ClipReceiver:
+    def __init__(self, name: str = "clip-receiver"):
+        self._pending: Optional[Callable[[], None]] = None
+        self._busy = False
+        self._cond = threading.Condition()
+        self.coalesced = 0  # Jobs dropped because a newer one replaced them
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, job: Callable[[], None]):
+        """Queue `job`, replacing one that hasn't started yet. Never blocks."""
+        with self._cond:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = job
+            self._cond.notify_all()
+
+    def superseded(self) -> bool:
+        """True when a newer job is waiting; a running job can stop before touching the clipboard."""
+        with self._cond:
+            return self._pending is not None
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                job, self._pending = self._pending, None
+                self._busy = True
+            try:
+                job()
+            except Exception as e:
+                print(f"❌ Failed to apply sync: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
@@ -0,0 +1,439 @@
+"""
+Shared clipboard access for the desktop clients (client.py, desktop_gui.py).
+
+Each platform is a ClipboardBackend. get_backend() picks one for the current
+session (or the CLIPBOARD_BACKEND env var: windows, wayland, x11, pyperclip, memory).
+
+Change detection is layered so an idle clipboard costs almost nothing per tick:
+1. Push notifications where the OS offers them (wl-paste --watch, clipnotify),
+   or a fast check of the OS change counter (Windows) - the monitor wakes up
+   within milliseconds of a copy instead of on the next 1 s tick.
+2. The change counter itself - if it hasn't moved, nothing is read at all.
+3. A hash of the raw clipboard bytes - catches writes that didn't change the content.
+4. Only then is an image encoded for upload (encode_image), on the client's upload
+   worker rather than the monitor thread.
+"""
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional, Tuple
+
+from PIL import BmpImagePlugin, Image, features
+
+try:
+    import win32clipboard
+except ImportError:  # Only available on Windows (pywin32)
+    win32clipboard = None
+
+try:
+    import pyperclip
+except ImportError:
+    pyperclip = None
+
+SUBPROCESS_TIMEOUT = 5  # Seconds to wait for xclip / wl-paste
+
+# Upload encoding of copied images: png, webp (lossless) or auto (encode both, send the smaller)
+IMAGE_FORMAT = os.getenv("CLIP_IMAGE_FORMAT", "png").lower()
+PNG_LEVEL = int(os.getenv("CLIP_PNG_LEVEL", "1"))  # zlib level; PIL's default 6 is slower for about the same size on screenshots
+MAX_IMAGE_DIMENSION = int(os.getenv("CLIP_MAX_DIMENSION", "0"))  # Downscale the longer side to this (0 = never)
+WEBP_OPTIONS = {"lossless": True, "method": 0, "quality": 50}  # Fastest lossless effort
+
+
+def fingerprint(data) -> str:
+    """Fast content hash of raw clipboard data (bytes or str)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8", "surrogatepass")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def dib_to_png(dib: bytes) -> bytes:
+    """Encode a raw CF_DIB payload (bitmap without file header) as PNG."""
+    with io.BytesIO(dib) as dib_io:
+        im = BmpImagePlugin.DibImageFile(dib_io)
+        with io.BytesIO() as out:
+            im.save(out, format="PNG")
+            return out.getvalue()
+
+
+def image_to_dib(image_data: bytes) -> bytes:
+    """Convert any image file (PNG, JPEG, ...) to a CF_DIB payload."""
+    image = Image.open(io.BytesIO(image_data))
+    with io.BytesIO() as output:
+        image.convert("RGB").save(output, "BMP")
+        return output.getvalue()[14:]  # Drop the BMP file header
+
+
+def _save(im: Image.Image, fmt: str, **options) -> bytes:
+    with io.BytesIO() as out:
+        im.save(out, format=fmt, **options)
+        return out.getvalue()
+
+
+def encode_image(raw: bytes, source_format: str = "png", target: str = IMAGE_FORMAT,
+                 png_level: int = PNG_LEVEL, max_dimension: int = MAX_IMAGE_DIMENSION) -> Tuple[bytes, str]:
+    """
+    Encode a clipboard image (PNG file or CF_DIB payload) for upload. Returns (bytes, extension).
+    A PNG that needs no resizing is sent as is; "auto" keeps whichever candidate is smaller.
+    Pillow releases the GIL while encoding, so this can run on a worker thread next to the monitor.
+    """
+    if source_format == "dib":
+        im = BmpImagePlugin.DibImageFile(io.BytesIO(raw))
+    else:
+        im = Image.open(io.BytesIO(raw))
+    resized = bool(max_dimension) and max(im.size) > max_dimension
+    if resized:
+        im.thumbnail((max_dimension, max_dimension))
+
+    webp = target in ("webp", "auto") and features.check("webp")
+    candidates = []
+    if webp:
+        mode = "RGBA" if im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info else "RGB"
+        candidates.append((_save(im.convert(mode), "WEBP", **WEBP_OPTIONS), "webp"))
+    if not webp or target == "auto":
+        if source_format == "png" and not resized:
+            candidates.append((raw, "png"))  # Already encoded, costs nothing
+        else:
+            candidates.append((_save(im, "PNG", compress_level=png_level), "png"))
+    return min(candidates, key=lambda c: len(c[0]))
+
+
+def encode_content(raw: Optional[dict]) -> Optional[dict]:
+    """Turn a raw read into the upload format ({"type", "content"}, images also get their "ext")."""
+    if raw is None:
+        return None
+    if raw["type"] == "image":
+        content, ext = encode_image(raw["raw"], raw.get("format", "png"))
+        return {"type": "image", "content": content, "ext": ext}
+    return raw
+
+
+def as_png(image_data: bytes) -> Tuple[bytes, str]:
+    """Image file bytes plus MIME type, re-encoded as PNG unless it is a format every app can paste."""
+    im = Image.open(io.BytesIO(image_data))
+    if im.format in ("PNG", "JPEG"):
+        return image_data, Image.MIME[im.format]
+    return _save(im, "PNG", compress_level=PNG_LEVEL), "image/png"
+
+
+# --- BACKENDS ---
+
+class ClipboardBackend:
+    """
+    Interface every platform implements.
+    read_raw() returns {"type": "image", "raw": bytes, "format": "png"|"dib"},
+    {"type": "text", "content": str} or None, without any decoding.
+    """
+    name = "base"
+
+    def read_raw(self) -> Optional[dict]:
+        raise NotImplementedError
+
+    def write_text(self, text: str):
+        raise NotImplementedError
+
+    def write_image(self, image_data: bytes):
+        raise NotImplementedError
+
+    def sequence(self) -> Optional[int]:
+        """OS clipboard change counter, or None when the platform has none."""
+        return None
+
+    def wait_for_change(self, timeout: float) -> bool:
+        """Block until the clipboard may have changed or `timeout` passes. True if woken by a change."""
+        time.sleep(timeout)
+        return False
+
+
+class EventClipboardBackend(ClipboardBackend):
+    """Base for backends fed by a watcher: call _notify() whenever the clipboard changes."""
+
+    def __init__(self):
+        self._changed = threading.Event()
+
+    def _notify(self):
+        self._changed.set()
+
+    def wait_for_change(self, timeout: float) -> bool:
+        fired = self._changed.wait(timeout)
+        if fired:
+            self._changed.clear()
+        return fired
+
+    def _watch(self, cmd):
+        """Run a watcher command in the background; every line it prints is a change event."""
+        def run():
+            while True:
+                try:
+                    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                    for _ in proc.stdout:
+                        self._notify()
+                    proc.wait()
+                except Exception:
+                    pass
+                time.sleep(1)  # Watcher died (e.g. compositor restart): retry, polling meanwhile
+                self._notify()
+        threading.Thread(target=run, daemon=True).start()
+
+
+class WindowsClipboard(ClipboardBackend):
+    name = "windows"
+    FAST_POLL = 0.05  # GetClipboardSequenceNumber is a cheap syscall, so check it often
+
+    def read_raw(self):
+        win32clipboard.OpenClipboard()
+        try:
+            if win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_DIB):
+                return {"type": "image", "raw": win32clipboard.GetClipboardData(win32clipboard.CF_DIB), "format": "dib"}
+            if win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_UNICODETEXT):
+                text = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
+                if text and text.strip():
+                    return {"type": "text", "content": text}
+        finally:
+            win32clipboard.CloseClipboard()
+        return None
+
+    def _set(self, fmt, data):
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardData(fmt, data)
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def write_text(self, text):
+        self._set(win32clipboard.CF_UNICODETEXT, text)
+
+    def write_image(self, image_data):
+        self._set(win32clipboard.CF_DIB, image_to_dib(image_data))
+
+    def sequence(self):
+        return win32clipboard.GetClipboardSequenceNumber()
+
+    def wait_for_change(self, timeout):
+        start = self.sequence()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.FAST_POLL)
+            if self.sequence() != start:
+                return True
+        return False
+
+
+class WaylandClipboard(EventClipboardBackend):
+    """wl-clipboard based; `wl-paste --watch` pushes a line on every clipboard change."""
+    name = "wayland"
+
+    def __init__(self):
+        super().__init__()
+        self._watch(["wl-paste", "--watch", "echo"])
+
+    def _paste(self, *args) -> bytes:
+        return subprocess.run(["wl-paste", "--no-newline", *args], capture_output=True,
+                              timeout=SUBPROCESS_TIMEOUT).stdout
+
+    def read_raw(self):
+        types = self._paste("--list-types").decode(errors="ignore").split()
+        if "image/png" in types:
+            return {"type": "image", "raw": self._paste("--type", "image/png"), "format": "png"}
+        if any(t.startswith("text/") or t in ("UTF8_STRING", "STRING") for t in types):
+            text = self._paste("--type", "text/plain;charset=utf-8").decode("utf-8", errors="replace")
+            if text.strip():
+                return {"type": "text", "content": text}
+        return None
+
+    def _copy(self, data: bytes, mime: str):
+        # wl-copy forks to serve the selection; don't hold its pipes open
+        subprocess.run(["wl-copy", "--type", mime], input=data, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, timeout=SUBPROCESS_TIMEOUT)
+
+    def write_text(self, text):
+        self._copy(text.encode("utf-8"), "text/plain;charset=utf-8")
+
+    def write_image(self, image_data):
+        self._copy(*as_png(image_data))  # e.g. WebP uploads: few apps accept image/webp
+
+
+class X11Clipboard(EventClipboardBackend):
+    """xclip based; uses `clipnotify` (XFixes selection events) when installed, else polls."""
+    name = "x11"
+
+    def __init__(self):
+        super().__init__()
+        self.has_events = shutil.which("clipnotify") is not None
+        if self.has_events:
+            # clipnotify exits on each selection change; print a line so _watch sees an event
+            self._watch(["sh", "-c", "while clipnotify; do echo; done"])
+
+    def _xclip(self, *args) -> bytes:
+        return subprocess.run(["xclip", "-selection", "clipboard", "-o", *args], capture_output=True,
+                              timeout=SUBPROCESS_TIMEOUT).stdout
+
+    def read_raw(self):
+        targets = self._xclip("-t", "TARGETS").decode(errors="ignore").split()
+        if "image/png" in targets:
+            return {"type": "image", "raw": self._xclip("-t", "image/png"), "format": "png"}
+        if "UTF8_STRING" in targets or "STRING" in targets or "text/plain" in targets:
+            text = self._xclip("-t", "UTF8_STRING").decode("utf-8", errors="replace")
+            if text.strip():
+                return {"type": "text", "content": text}
+        return None
+
+    def _copy(self, data: bytes, mime: str):
+        # xclip forks to own the selection; don't hold its pipes open
+        subprocess.run(["xclip", "-selection", "clipboard", "-t", mime, "-i"], input=data,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=SUBPROCESS_TIMEOUT)
+
+    def write_text(self, text):
+        self._copy(text.encode("utf-8"), "UTF8_STRING")
+
+    def write_image(self, image_data):
+        self._copy(*as_png(image_data))  # e.g. WebP uploads: few apps accept image/webp
+
+    def wait_for_change(self, timeout):
+        if self.has_events:
+            return super().wait_for_change(timeout)
+        time.sleep(timeout)
+        return False
+
+
+class PyperclipClipboard(ClipboardBackend):
+    """Text-only fallback (e.g. macOS) through pyperclip."""
+    name = "pyperclip"
+
+    def read_raw(self):
+        text = pyperclip.paste()
+        if text and text.strip():
+            return {"type": "text", "content": text}
+        return None
+
+    def write_text(self, text):
+        pyperclip.copy(text)
+
+    def write_image(self, image_data):
+        raise NotImplementedError("Images are not supported by the pyperclip backend")
+
+
+class MemoryClipboard(EventClipboardBackend):
+    """In-process fake for tests and benchmarks; writes notify waiters immediately."""
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._raw = None
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _set(self, raw):
+        with self._lock:
+            self._raw = raw
+            self._seq += 1
+        self._notify()
+
+    def read_raw(self):
+        with self._lock:
+            return self._raw
+
+    def write_text(self, text):
+        self._set({"type": "text", "content": text})
+
+    def write_image(self, image_data):
+        self._set({"type": "image", "raw": image_data, "format": "png"})
+
+    def sequence(self):
+        with self._lock:
+            return self._seq
+
+
+BACKENDS = {
+    "windows": WindowsClipboard,
+    "wayland": WaylandClipboard,
+    "x11": X11Clipboard,
+    "pyperclip": PyperclipClipboard,
+    "memory": MemoryClipboard,
+}
+
+
+def get_backend(name: Optional[str] = None) -> ClipboardBackend:
+    name = name or os.getenv("CLIPBOARD_BACKEND")
+    if not name:
+        if win32clipboard is not None:
+            name = "windows"
+        elif os.getenv("WAYLAND_DISPLAY") and shutil.which("wl-paste"):
+            name = "wayland"
+        elif os.getenv("DISPLAY") and shutil.which("xclip"):
+            name = "x11"
+        elif pyperclip is not None:
+            name = "pyperclip"
+        else:
+            raise RuntimeError(f"No clipboard backend available on {sys.platform}")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown clipboard backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+
+# --- CHANGE DETECTION ---
+
+class ClipboardMonitor:
+    """Per-tick change detection that only pays for encoding when the clipboard really changed."""
+
+    def __init__(self, backend: ClipboardBackend):
+        self.backend = backend
+        self._seq = None
+        self._fingerprint = None
+        self._raw = None
+
+    def _read(self):
+        seq = self.backend.sequence()
+        if seq is not None and seq == self._seq:
+            return False, None
+        raw = self.backend.read_raw()
+        self._seq = seq  # Only after a successful read, so a failed read is retried next tick
+        if raw is None:
+            return False, None
+        fp = fingerprint(raw.get("raw", raw.get("content")))
+        if fp == self._fingerprint:
+            return False, None
+        self._fingerprint = fp
+        self._raw = raw
+        return True, raw
+
+    def wait(self, timeout: float = 1.0) -> bool:
+        """Sleep until the backend reports a change (push backends) or `timeout` passes."""
+        return self.backend.wait_for_change(timeout)
+
+    def poll_raw(self) -> Optional[dict]:
+        """Like poll(), but without encoding: the backend's raw read, for encoding elsewhere."""
+        changed, raw = self._read()
+        return raw if changed else None
+
+    def poll(self) -> Optional[dict]:
+        """Return the new clipboard content if it changed since the last poll/sync, else None."""
+        return encode_content(self.poll_raw())
+
+    def is_current(self, raw: dict) -> bool:
+        """False once a later poll/sync has seen different content than `raw`."""
+        return raw is self._raw
+
+    def sync(self):
+        """Mark whatever is on the clipboard now as already seen (e.g. right after we wrote to it)."""
+        self._read()
+
+
+def get_clipboard_content(backend: ClipboardBackend) -> Optional[dict]:
+    try:
+        return encode_content(backend.read_raw())
+    except Exception:
+        return None
+
+
+def set_clipboard_content(backend: ClipboardBackend, clip_type: str, data):
+    """Write text (str) or an image file (bytes) to the clipboard."""
+    if clip_type == "image":
+        backend.write_image(data)
+    else:
+        backend.write_text(data)
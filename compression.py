@@ -0,0 +1,85 @@
+"""
+Negotiated HTTP response compression (zstd when the `zstandard` package is installed, else gzip).
+
+Only whole, compressible bodies (JSON / text) are compressed; streamed files such as
+images under /uploads pass through untouched so Range and caching keep working.
+"""
+import gzip
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+MIN_SIZE = 1024  # Below this the headers cost more than compression saves
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted[name] = q
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size: int = MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # Held back until we know what the body looks like
+                return
+            if message["type"] == "http.response.body" and start is not None:
+                pending, start = start, None
+                body = message.get("body", b"")
+                response_headers = [(k, v) for k, v in pending.get("headers", [])]
+                names = {k.lower() for k, _ in response_headers}
+                content_type = next((v for k, v in response_headers if k.lower() == b"content-type"), b"").decode("latin-1")
+                if (not message.get("more_body", False)
+                        and len(body) >= self.min_size
+                        and b"content-encoding" not in names
+                        and content_type.startswith(COMPRESSIBLE_TYPES)):
+                    body = compress(body, encoding)
+                    response_headers = [(k, v) for k, v in response_headers if k.lower() != b"content-length"]
+                    response_headers += [
+                        (b"content-encoding", encoding.encode()),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"vary", b"Accept-Encoding"),
+                    ]
+                    message = {**message, "body": body}
+                await send({**pending, "headers": response_headers})
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,29 @@
+import importlib
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+import metrics
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "channels(spec): CHANNELS for the `server` fixture, e.g. \"work:key\"")
+
+
+@pytest.fixture
+def server(request, tmp_path, monkeypatch):
+    """A fresh main.app served in-process from an empty working directory: (main module, client)."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("API_SECRET", "test")
+    monkeypatch.setenv("STATE_BACKEND", "memory")
+    marker = request.node.get_closest_marker("channels")
+    monkeypatch.setenv("CHANNELS", marker.args[0] if marker else "")
+    registered = list(metrics._registry)
+    main = importlib.reload(sys.modules["main"]) if "main" in sys.modules else importlib.import_module("main")
+    try:
+        with TestClient(main.app) as client:
+            client.headers["x-api-key"] = "test"
+            yield main, client
+    finally:
+        metrics._registry[:] = registered  # The reload registered main's gauges again
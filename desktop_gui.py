@@ -4,19 +4,25 @@ import os
 import websocket
 import json
 import threading
-import io
-import pyperclip
-from PIL import Image, ImageGrab
-import win32clipboard
+import functools
+import uuid
 from dotenv import load_dotenv
 import tkinter as tk
 from tkinter import scrolledtext
 
+from clip_receiver import SETTLE_SECONDS, ClipReceiver, clip_sha256
+from clipboard_backend import ClipboardMonitor, encode_content, get_backend, get_clipboard_content
+from state_backend import event_clips
+from text_delta import resolve_text
+from ws_rpc import FrameTooLarge, RequestFailed, WSRequester
+
 # --- CONFIG ---
 load_dotenv()
 SERVER_URL = "http://127.0.0.1:8000"
 WS_URL = "ws://127.0.0.1:8000/ws"
 API_SECRET = os.getenv("API_SECRET")
+WS_UPLOAD_MAX = 8 * 1024 * 1024  # Encoded bytes; bigger clips go over HTTP (uvicorn caps WebSocket messages at 16 MB)
+DEVICE_ID = os.getenv("DEVICE_ID") or uuid.uuid4().hex  # The server doesn't echo our own uploads back to us
 
 if not API_SECRET:
     print("❌ ERROR: API_SECRET not set in .env")
@@ -24,6 +30,7 @@ if not API_SECRET:
 
 # Global State
 last_content = None
+held_sha = None  # sha256 of what we last put on or uploaded from the clipboard (echo suppression)
 content_lock = threading.Lock()
 pause_monitoring = False
 ws_app = None
@@ -67,13 +74,21 @@ class CrossBoardApp:
         self.log_area.pack(fill="both", expand=True, padx=20, pady=(0, 20))
         
         self.log("Starting CrossBoard Client...")
+        self.last_ws_text = None  # Last text clip received over the socket (base for deltas)
+        self.pending_inline = None  # new_clip event waiting for its binary payload frame
+        self.last_event_seq = None  # Cursor of the last event seen; reconnects resume from it (/ws?since=)
+        self.clipboard = get_backend()  # Windows, Wayland, X11... (CLIPBOARD_BACKEND to override)
+        self.monitor = ClipboardMonitor(self.clipboard)  # Cheap change detection (OS counter / raw hash before any image encode)
+        self.rpc = WSRequester()  # Uploads and arm/disarm ride on the open socket
+        self.receiver = ClipReceiver()  # Applies incoming clips off the socket thread, newest only
+        self.uploader = ClipReceiver("clip-uploader")  # Encodes and uploads local copies off the monitor thread, newest only
+        self.http = requests.Session()  # Keep-alive for downloads and the HTTP fallback
+        self.http.headers["x-api-key"] = API_SECRET
+        self.http.headers["x-device-id"] = DEVICE_ID
         
-        # Start Threads
+        # Start Threads (arm state is pushed over the socket, no polling)
         threading.Thread(target=self.monitor_loop, daemon=True).start()
         threading.Thread(target=self.start_listener, daemon=True).start()
-        
-        # Start Polling initial state
-        self.root.after(1000, self.fetch_status)
 
     def log(self, msg):
         self.log_area.insert(tk.END, msg + "\n")
@@ -86,163 +101,191 @@ class CrossBoardApp:
             self.arm_status_lbl.config(text="🛡️ System Disarmed", fg="#94a3b8")
 
     def arm_system(self):
+        # Off the Tk thread: the answer arrives on the socket thread, which may itself need Tk
+        threading.Thread(target=self._arm, daemon=True).start()
+
+    def disarm_system(self):
+        threading.Thread(target=self._disarm, daemon=True).start()
+
+    def _arm(self):
         try:
-            res = requests.post(f"{SERVER_URL}/arm", headers={"x-api-key": API_SECRET})
-            if res.status_code == 200:
-                self.log("✅ Shield activated. Ready to receive.")
-            else:
-                self.log(f"⚠️ Auth failed: {res.status_code}")
+            self.set_armed(True)
+            self.log("✅ Shield activated. Ready to receive.")
+        except RequestFailed as e:
+            self.log(f"⚠️ Arm failed: {e.status}")
         except Exception as e:
             self.log("❌ Failed to contact server.")
 
-    def disarm_system(self):
+    def _disarm(self):
         try:
-            res = requests.post(f"{SERVER_URL}/disarm", headers={"x-api-key": API_SECRET})
-            if res.status_code == 200:
-                self.log("✅ Shield deactivated. System secure.")
+            self.set_armed(False)
+            self.log("✅ Shield deactivated. System secure.")
+        except RequestFailed as e:
+            self.log(f"⚠️ Disarm failed: {e.status}")
         except Exception as e:
             self.log("❌ Failed to contact server.")
 
-    def fetch_status(self):
-        try:
-            res = requests.get(f"{SERVER_URL}/status", headers={"x-api-key": API_SECRET})
-            if res.status_code == 200:
-                data = res.json()
-                self.update_ui_status(data["armed"])
-        except Exception:
-            pass
-        self.root.after(3000, self.fetch_status) # Poll occasionally
+    def set_armed(self, armed):
+        """Over the open socket; over HTTP while it is reconnecting."""
+        op = "arm" if armed else "disarm"
+        if self.rpc.connected:
+            self.rpc.request(op)
+            return
+        res = self.http.post(f"{SERVER_URL}/{op}")
+        if not res.ok:
+            raise RequestFailed(res.status_code, res.text)
+        self.update_ui_status(armed)  # No socket to push the new state to us
 
     # --- CLI LOGIC INTEGRATION ---
     def get_clipboard_content(self):
-        try:
-            win32clipboard.OpenClipboard()
-            has_image = win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_DIB)
-            has_text = win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_UNICODETEXT)
-            
-            if has_image:
-                data = win32clipboard.GetClipboardData(win32clipboard.CF_DIB)
-                win32clipboard.CloseClipboard()
-                
-                # Construct BMP header
-                import struct
-                bmp_header = struct.pack('<2sLHHL', b'BM', 14 + len(data), 0, 0, 14)
-                bmp_data = bmp_header + data
-                
-                with io.BytesIO(bmp_data) as bmp_io:
-                    im = Image.open(bmp_io)
-                    with io.BytesIO() as out:
-                        im.save(out, format="PNG")
-                        return {"type": "image", "content": out.getvalue()}
-            
-            if has_text:
-                text = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
-                win32clipboard.CloseClipboard()
-                if text and text.strip():
-                    return {"type": "text", "content": text}
-                    
-            win32clipboard.CloseClipboard()
-        except Exception as e:
-            try:
-                win32clipboard.CloseClipboard()
-            except:
-                pass
-        return None
+        return get_clipboard_content(self.clipboard)
 
     def set_clipboard_content(self, data):
-        global last_content, pause_monitoring
+        """Runs on the receiver's worker thread, never on the socket thread."""
+        global last_content, held_sha, pause_monitoring
+        with content_lock:
+            if data.get('sha256') and data['sha256'] == held_sha:
+                self.log("⏭️ Already on clipboard, skipped")  # Our own upload coming back, or a repeat
+                return
         self.log(f"🔄 Syncing {data['type']} from server...")
         with content_lock:
             pause_monitoring = True
-        
+
         try:
             if data['type'] == 'text':
-                pyperclip.copy(data['content'])
-                with content_lock:
-                    last_content = {"type": "text", "content": data['content']}
-            elif data['type'] == 'image':
-                img_url = f"{SERVER_URL}/uploads/{data['content']}"
-                res = requests.get(img_url, headers={"x-api-key": API_SECRET})
-                if res.status_code == 200:
-                    image = Image.open(io.BytesIO(res.content))
-                    output = io.BytesIO()
-                    image.convert("RGB").save(output, "BMP")
-                    bmp_data = output.getvalue()[14:]
-                    output.close()
+                self.fetch_full_text(data)
+            else:
+                image_data = data.get('payload')  # Sent inline with the event if small
+                if image_data is None:
+                    res = self.http.get(f"{SERVER_URL}/uploads/{data['content']}")
+                    res.raise_for_status()
+                    image_data = res.content
+            if self.receiver.superseded():
+                self.log("⏭️ Newer clip arrived, skipped")
+                return
 
-                    win32clipboard.OpenClipboard()
-                    win32clipboard.EmptyClipboard()
-                    win32clipboard.SetClipboardData(win32clipboard.CF_DIB, bmp_data)
-                    win32clipboard.CloseClipboard()
-                    
-                    with io.BytesIO() as png_out:
-                         image.save(png_out, format="PNG")
-                         with content_lock:
-                             last_content = {"type": "image", "content": png_out.getvalue()}
+            if data['type'] == 'text':
+                self.clipboard.write_text(data['content'])
+                applied = {"type": "text", "content": data['content']}
+            else:
+                self.clipboard.write_image(image_data)
+                applied = {"type": "image", "content": image_data}  # The bytes we applied, no re-encode
+            with content_lock:
+                last_content = applied
+                held_sha = data.get('sha256') or clip_sha256(applied)
+                self.monitor.sync()
             self.log("✅ Sync applied locally")
+            time.sleep(SETTLE_SECONDS)
         except Exception as e:
             self.log(f"❌ Failed to apply sync: {e}")
         finally:
-            time.sleep(0.5)
             with content_lock:
                 pause_monitoring = False
 
     def monitor_loop(self):
-        global last_content
+        global last_content, held_sha
         with content_lock:
-            last_content = self.get_clipboard_content()
+            last_content = self.monitor.poll()
+            held_sha = clip_sha256(last_content) if last_content else None
         
         while True:
             try:
-                time.sleep(1)
+                self.monitor.wait(1)  # Returns early when the backend pushes a change
                 with content_lock:
                     if pause_monitoring:
                          continue
                 
-                opts = self.get_clipboard_content()
-                changed = False
-                with content_lock:
-                    if opts is not None and last_content is None:
-                        changed = True
-                    elif opts and last_content:
-                        if opts['type'] != last_content['type']:
-                            changed = True
-                        elif opts['content'] != last_content['content']:
-                            changed = True
-                
-                if changed:
-                    with content_lock:
-                        last_content = opts
-                    
-                    # Upload
-                    try:
-                        if opts['type'] == 'text':
-                            res = requests.post(f"{SERVER_URL}/upload", 
-                                data={"content": opts['content'], "type": "text"},
-                                headers={"x-api-key": API_SECRET}
-                            )
-                            res.raise_for_status()
-                        elif opts['type'] == 'image':
-                            files = {'file': ('clipboard.png', opts['content'], 'image/png')}
-                            res = requests.post(f"{SERVER_URL}/upload", 
-                                data={"type": "image"}, files=files,
-                                headers={"x-api-key": API_SECRET}
-                            )
-                            res.raise_for_status()
-                        self.log("📤 Local Change Uploaded")
-                    except requests.exceptions.HTTPError as e:
-                        if e.response.status_code == 403:
-                            self.log("🔒 Disarmed. Snippet ignored.")
-                        else:
-                            self.log(f"⚠️ Upload HTTP Error: {e.response.status_code}")
+                raw = self.monitor.poll_raw()  # None unless the clipboard actually changed
+                if raw is not None:
+                    self.uploader.submit(functools.partial(self.upload_change, raw))  # Encoding a big image doesn't hold up the next check
             except Exception as e:
                 pass
 
+    def upload_change(self, raw):
+        """Runs on the uploader's worker thread: encode the local copy, then upload it unless it is stale."""
+        global last_content, held_sha
+        opts = encode_content(raw)
+        with content_lock:
+            if self.uploader.superseded() or not self.monitor.is_current(raw):
+                return  # Copied again, or an incoming clip replaced it, while we were encoding
+            if last_content and opts['type'] == last_content['type'] and opts['content'] == last_content['content']:
+                return
+            last_content = opts
+            held_sha = clip_sha256(opts)
+
+        try:
+            item = self.upload(opts)
+            if opts['type'] == 'text':
+                self.last_ws_text = opts['content']  # The server builds our next delta against our own upload
+            self.log(f"📤 Local Change Uploaded (clip {item['seq']})")
+        except RequestFailed as e:
+            if e.status == 403:
+                self.log("🔒 Disarmed. Snippet ignored.")
+            else:
+                self.log(f"⚠️ Upload Error: {e.status}")
+        except Exception as e:
+            self.log(f"⚠️ Upload Error: {e}")
+
+    def upload(self, opts):
+        """
+        Over the open socket; HTTP only for very large clips or while reconnecting.
+        Returns the server's ack: the stored clip (id, seq, sha256).
+        """
+        if self.rpc.connected:
+            try:
+                if opts['type'] == 'text':
+                    return self.rpc.request("upload", max_frame=WS_UPLOAD_MAX, type="text", content=opts['content'])["item"]
+                return self.rpc.request("upload", payload=opts['content'], max_frame=WS_UPLOAD_MAX,
+                                     type="image", ext=opts['ext'])["item"]
+            except FrameTooLarge:
+                pass
+        if opts['type'] == 'text':
+            res = self.http.post(f"{SERVER_URL}/upload", data={"content": opts['content'], "type": "text"})
+        else:
+            files = {'file': (f"clipboard.{opts['ext']}", opts['content'], f"image/{opts['ext']}")}
+            res = self.http.post(f"{SERVER_URL}/upload", data={"type": "image"}, files=files)
+        if not res.ok:
+            raise RequestFailed(res.status_code, res.text)
+        return res.json()["item"]
+
     def on_message(self, ws, message):
         try:
+            if isinstance(message, bytes):
+                # Binary frame: the payload of the new_clip event we just got
+                if self.pending_inline is not None:
+                    data, self.pending_inline = self.pending_inline, None
+                    data['payload'] = message
+                    self.receiver.submit(lambda: self.set_clipboard_content(data))
+                return
+
             msg = json.loads(message)
-            if msg.get("event") == "new_clip":
-                self.set_clipboard_content(msg['data'])
+            if self.rpc.handle(msg):
+                return
+            if "state" in msg:  # Pushed with the first message on every connection
+                self.update_ui_status(msg["state"]["armed"])
+            had_cursor = self.last_event_seq is not None
+            self.last_event_seq = msg.get("seq", self.last_event_seq)
+            if msg.get("event") == "replay":
+                # Events broadcast while we were offline; only the newest clip matters for the clipboard
+                clips = [self.expand_clip({**e, "data": data}) for e in msg["events"] for data in event_clips(e)]
+                if clips:
+                    self.receiver.submit(lambda: self.set_clipboard_content(clips[-1]))
+                for e in msg["events"]:
+                    if e.get("event") in ("system_armed", "system_disarmed"):
+                        self.update_ui_status(e["event"] == "system_armed")
+            elif msg.get("event") == "resync":
+                if had_cursor:  # Offline for too long to replay, catch up from the server state
+                    self.receiver.submit(self.sync_latest)
+            elif msg.get("event") == "new_clip":
+                data = self.expand_clip(msg)
+                if msg.get("inline"):
+                    self.pending_inline = data  # Payload follows in the next frame
+                    return
+                self.receiver.submit(lambda: self.set_clipboard_content(data))
+            elif msg.get("event") == "new_clips":
+                # A batch upload: the clipboard takes the newest, every text still moves our delta base
+                clips = [self.expand_clip({"data": data}) for data in msg["data"]]
+                self.receiver.submit(lambda: self.set_clipboard_content(clips[-1]))
             elif msg.get("event") == "system_armed":
                 self.update_ui_status(True)
             elif msg.get("event") == "system_disarmed":
@@ -250,22 +293,59 @@ class CrossBoardApp:
         except Exception as e:
             pass
 
+    def expand_clip(self, msg):
+        """Rebuild text sent as a delta against the previous clip; fetch it whole if our base is stale."""
+        data = msg['data']
+        if "delta" in msg:
+            text = resolve_text(msg, self.last_ws_text)
+            if text is None:
+                res = self.http.get(f"{SERVER_URL}/clip/{data['id']}")
+                res.raise_for_status()
+                text = res.json()['content']
+            data['content'] = text
+        if data['type'] == 'text':
+            self.last_ws_text = data['content']
+        return data
+
+    def fetch_full_text(self, data):
+        """Large text arrives as a preview; the whole text is fetched (gzipped) from uploads/."""
+        if data.get('text_file'):
+            res = self.http.get(f"{SERVER_URL}/uploads/{data.pop('text_file')}")
+            res.raise_for_status()
+            res.encoding = "utf-8"
+            data['content'] = res.text
+
+    def sync_latest(self):
+        res = self.http.get(f"{SERVER_URL}/latest")
+        if res.status_code == 404:
+            return
+        res.raise_for_status()
+        data = res.json()
+        if data['type'] == 'text':
+            self.last_ws_text = data['content']
+        self.set_clipboard_content(data)
+
     def on_error(self, ws, error):
         self.log("❌ WS Error.")
 
     def on_close(self, ws, close_status_code, close_msg):
+        self.rpc.detach()
         self.conn_status.config(text="🔴 Offline", fg="#ef4444")
         self.log("🔌 Disconnected")
         time.sleep(2)
         self.start_listener()
 
     def on_open(self, ws):
+        self.rpc.attach(ws)
         self.conn_status.config(text="🟢 Connected to Server", fg="#10b981")
         self.log("🌐 Connected via WebSocket")
 
     def start_listener(self):
         websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(f"{WS_URL}?token={API_SECRET}",
+        url = f"{WS_URL}?token={API_SECRET}&delta=1&inline=1&device={DEVICE_ID}"
+        if self.last_event_seq is not None:
+            url += f"&since={self.last_event_seq}"
+        ws = websocket.WebSocketApp(url,
                                   on_open=self.on_open,
                                   on_message=self.on_message,
                                   on_error=self.on_error,
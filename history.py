@@ -0,0 +1,133 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ClipHistory:
+    """
+    Fixed-capacity ring buffer of clips with an id -> seq index.
+    Every pushed item gets a monotonically increasing `seq` (starting at 1), so
+    appends, evictions, lookups by id and "everything after seq N" are all O(1)
+    (plus the size of the returned page), however large the capacity is.
+    Items must have writable `id` and `seq` attributes.
+
+    Besides the item count, `budgets` caps the summed `size` of held items per kind,
+    where `budget_of(item)` gives the kind (default: the item's `type`). Over-budget and expired
+    items are dropped from the oldest end, so every worker replaying the same clips
+    keeps the same history and the cost is proportional to what is evicted.
+
+    An optional `index` (e.g. a SearchIndex) is told about every item added and dropped.
+    """
+
+    def __init__(self, capacity: int = 50, budgets: Optional[Dict[str, int]] = None,
+                 budget_of: Optional[Callable[[Any], str]] = None, index: Optional[Any] = None):
+        if capacity < 1:
+            raise ValueError("History capacity must be at least 1")
+        self.capacity = capacity
+        self.budgets = {kind: limit for kind, limit in (budgets or {}).items() if limit > 0}
+        self.budget_of = budget_of or (lambda item: getattr(item, "type", None))
+        self.used: Dict[str, int] = {}  # kind -> summed size of held items
+        self.index = index
+        self._slots: List[Optional[Any]] = [None] * capacity
+        self._by_id: Dict[str, int] = {}
+        self.last_seq = 0
+        self._base_seq = 1  # First seq this ring ever held (raised as the oldest items are dropped)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @property
+    def oldest_seq(self) -> int:
+        """Seq of the oldest item still held (last_seq + 1 when empty)."""
+        if not self._by_id:
+            return self.last_seq + 1
+        return max(self._base_seq, self.last_seq - self.capacity + 1)
+
+    def push(self, item) -> Optional[Any]:
+        """Append an item, returning the item it evicted (if the ring was full)."""
+        self.last_seq += 1
+        item.seq = self.last_seq
+        slot = self.last_seq % self.capacity
+        evicted = self._slots[slot]
+        if evicted is not None:
+            self._by_id.pop(evicted.id, None)
+            self._account(evicted, -1)
+        self._slots[slot] = item
+        self._by_id[item.id] = item.seq
+        self._account(item, 1)
+        return evicted
+
+    def _account(self, item, sign: int):
+        if self.index is not None:
+            if sign > 0:
+                self.index.add(item)
+            else:
+                self.index.remove(item)
+        kind = self.budget_of(item)
+        if kind in self.budgets:
+            self.used[kind] = self.used.get(kind, 0) + sign * getattr(item, "size", 0)
+
+    def oldest(self) -> Optional[Any]:
+        for seq in range(self.oldest_seq, self.last_seq + 1):
+            item = self.get_seq(seq)
+            if item is not None:
+                return item
+        return None
+
+    def pop_oldest(self) -> Optional[Any]:
+        """Remove and return the oldest item."""
+        item = self.oldest()
+        if item is not None:
+            self._slots[item.seq % self.capacity] = None
+            self._by_id.pop(item.id, None)
+            self._account(item, -1)
+            self._base_seq = item.seq + 1
+        return item
+
+    def evict_over_budget(self) -> List[Any]:
+        """Drop the oldest items until every type is within its budget; the newest item always stays."""
+        evicted = []
+        while len(self) > 1 and any(self.used.get(kind, 0) > limit for kind, limit in self.budgets.items()):
+            evicted.append(self.pop_oldest())
+        return evicted
+
+    def expire(self, cutoff: datetime) -> List[Any]:
+        """Drop items whose `timestamp` (ISO 8601) is older than `cutoff`."""
+        evicted = []
+        while len(self) > 0 and datetime.fromisoformat(self.oldest().timestamp) < cutoff:
+            evicted.append(self.pop_oldest())
+        return evicted
+
+    def put(self, item) -> Optional[Any]:
+        """Append an item that already carries its (higher) seq, e.g. assigned by a shared backend."""
+        self.last_seq = item.seq - 1
+        return self.push(item)
+
+    def load(self, items: List[Any]):
+        """Restore items that already carry their seq (oldest first), e.g. from the database."""
+        items = items[-self.capacity:]
+        if items:
+            self._base_seq = items[0].seq
+        for item in items:
+            self.put(item)
+
+    def get(self, clip_id: str) -> Optional[Any]:
+        seq = self._by_id.get(clip_id)
+        if seq is None:
+            return None
+        return self._slots[seq % self.capacity]
+
+    def get_seq(self, seq: int) -> Optional[Any]:
+        if seq < self.oldest_seq or seq > self.last_seq:
+            return None
+        item = self._slots[seq % self.capacity]
+        # Restored history may have gaps in seq
+        return item if item is not None and item.seq == seq else None
+
+    def latest(self) -> Optional[Any]:
+        return self.get_seq(self.last_seq)
+
+    def after(self, seq: int, limit: int) -> List[Any]:
+        """Up to `limit` items with seq > `seq`, oldest first."""
+        start = max(seq + 1, self.oldest_seq)
+        end = min(start + limit, self.last_seq + 1)
+        return [item for item in map(self.get_seq, range(start, end)) if item is not None]
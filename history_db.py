@@ -0,0 +1,108 @@
+"""
+Durable clip history in SQLite (WAL mode).
+
+Writes go through a background thread that groups them into one transaction per
+batch; with WAL and synchronous=NORMAL a commit doesn't fsync, so uploads never
+wait on the disk. The in-memory ClipHistory ring stays the read path - this is
+only consulted at startup.
+"""
+import queue
+import sqlite3
+import threading
+from typing import List, Optional
+
+BATCH_SIZE = 256
+BATCH_WINDOW = 0.05  # Seconds to wait for more writes before committing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    sha256 TEXT,
+    size INTEGER,
+    text_file TEXT
+);
+"""
+
+COLUMNS = ("seq", "id", "type", "content", "timestamp", "sha256", "size", "text_file")
+ADDED_COLUMNS = (("size", "INTEGER"), ("text_file", "TEXT"))  # Missing from databases created by older versions
+
+
+def migrate(conn: sqlite3.Connection):
+    present = {row[1] for row in conn.execute("PRAGMA table_info(clips)")}
+    for column, declaration in ADDED_COLUMNS:
+        if column not in present:
+            try:
+                conn.execute(f"ALTER TABLE clips ADD COLUMN {column} {declaration}")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):  # Another worker got there first
+                    raise
+
+
+class HistoryDB:
+    def __init__(self, path: str):
+        self.path = path
+        self._ops: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._conn = self._connect()
+        self._conn.executescript(SCHEMA)
+        migrate(self._conn)
+        self._writer = threading.Thread(target=self._write_loop, name="history-db-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- reads (startup only) ---
+    def load_recent(self, limit: int) -> List[dict]:
+        """The newest `limit` clips, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM clips ORDER BY seq DESC LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(COLUMNS, row)) for row in reversed(rows)]
+
+    # --- writes (queued, batched) ---
+    def insert(self, item: dict):
+        self._ops.put((f"INSERT OR REPLACE INTO clips ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                       tuple(item.get(c) for c in COLUMNS)))
+
+    def trim(self, keep_from_seq: int):
+        """Drop rows older than `keep_from_seq` (HISTORY_LIMIT, retention); the newest row always stays."""
+        self._ops.put(("DELETE FROM clips WHERE seq < ? AND seq < (SELECT max(seq) FROM clips)", (keep_from_seq,)))
+
+    def _write_loop(self):
+        while True:
+            op = self._ops.get()
+            batch = [op]
+            try:
+                # Gather whatever else arrives within the window into the same transaction
+                while len(batch) < BATCH_SIZE and batch[-1] is not None:
+                    batch.append(self._ops.get(timeout=BATCH_WINDOW))
+            except queue.Empty:
+                pass
+            stop = batch[-1] is None
+            writes = [op for op in batch if op is not None]
+            if writes:
+                try:
+                    with self._conn:
+                        for sql, params in writes:
+                            self._conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    print(f"⚠️ History DB write failed: {e}")
+            if stop:
+                return
+
+    def close(self):
+        """Flush pending writes and close."""
+        self._ops.put(None)
+        self._writer.join()
+        self._conn.close()
@@ -0,0 +1,95 @@
+"""
+Derived image variants (thumbnail + re-compressed WebP) rendered in a process pool,
+so decoding a large photo never blocks the FastAPI event loop.
+"""
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, features
+
+THUMB_SIZE = 512  # Longest edge in px; sharp enough for the phone preview on high-DPI screens
+WEBP_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+VARIANTS = ("thumb", "webp")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _save_atomic(im: Image.Image, path: str, fmt: str, **params):
+    tmp_path = os.path.join(os.path.dirname(path), f".tmp-{uuid.uuid4().hex}")
+    try:
+        im.save(tmp_path, format=fmt, **params)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def render_variants(src_path: str) -> Dict[str, str]:
+    """
+    Worker-process entry point. Writes {name}.thumb.{ext} and, if it is smaller
+    than the original, {name}.opt.{ext} next to the source. Returns variant -> filename.
+    """
+    use_webp = features.check("webp")
+    fmt, ext = ("WEBP", "webp") if use_webp else ("JPEG", "jpg")
+    params = {"quality": WEBP_QUALITY, "method": 4} if use_webp else {"quality": WEBP_QUALITY, "optimize": True}
+    folder, name = os.path.split(src_path)
+    out = {}
+
+    with Image.open(src_path) as im:
+        im.load()
+        if fmt == "JPEG" or im.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in im.getbands() or "transparency" in im.info
+            im = im.convert("RGBA" if use_webp and has_alpha else "RGB")
+
+        thumb = im.copy()
+        thumb.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        out["thumb"] = f"{name}.thumb.{ext}"
+        _save_atomic(thumb, os.path.join(folder, out["thumb"]), fmt, **params)
+
+        opt_name = f"{name}.opt.{ext}"
+        opt_path = os.path.join(folder, opt_name)
+        _save_atomic(im, opt_path, fmt, **params)
+        if os.path.getsize(opt_path) < os.path.getsize(src_path):
+            out["webp"] = opt_name
+        else:
+            os.remove(opt_path)  # Re-compressing didn't help (e.g. already a small JPEG)
+    return out
+
+
+def existing_variants(src_path: str) -> Dict[str, str]:
+    """Variants already on disk for `src_path`, e.g. rendered by another server process."""
+    folder, name = os.path.split(src_path)
+    out = {}
+    for ext in ("webp", "jpg"):
+        for variant, infix in (("thumb", "thumb"), ("webp", "opt")):
+            filename = f"{name}.{infix}.{ext}"
+            if variant not in out and os.path.exists(os.path.join(folder, filename)):
+                out[variant] = filename
+    return out
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: a forked worker would inherit the server's sockets and keep
+        # closed WebSocket connections half-open until the client times out
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def build_variants(src_path: str) -> Dict[str, str]:
+    """Render variants for `src_path` off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), render_variants, src_path)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)  # Lets spawned workers exit cleanly
+        _pool = None
@@ -1,15 +1,34 @@
+import asyncio
+import functools
+import gzip
+import hashlib
+import re
+import io
+import json
+import mimetypes
 import os
-import shutil
+import time
 import uuid
-from typing import List, Optional
-from datetime import datetime
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
 
-from fastapi import FastAPI, HTTPException, Header, Depends, WebSocket, WebSocketDisconnect, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Header, Depends, WebSocket, WebSocketDisconnect, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from blob_store import LOCK_FILE, BlobStore, BlobTooLarge, PartialBlob
+from compression import CompressionMiddleware
+from history import ClipHistory
+from search_index import SearchIndex
+from state_backend import event_clips, get_backend
+from storage import Storage
+from text_delta import make_delta
+import image_variants
+import metrics
+
 # --- 1. LOAD ENVIRONMENT VARIABLES ---
 load_dotenv()
 API_SECRET = os.getenv("API_SECRET")
@@ -18,13 +37,39 @@ if not API_SECRET:
     print("⚠️ WARNING: API_SECRET not found in .env file! Security is disabled.")
 
 # --- APP CONFIG ---
-app = FastAPI(title="CrossClip Secure API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Only the newest HISTORY_LIMIT clips are loaded; blob cleanup happens in the background
+    storage.start()
+    for channel in channels.values():
+        snapshot = await channel.backend.start(functools.partial(apply_event, channel))
+        await restore_history(channel, snapshot["history"])
+        channel.armed = snapshot["armed"]
+        manager.resume(snapshot["seq"], snapshot["events"], room=channel.name)
+    tasks = []
+    if not SHARED_STATE:
+        # Other workers may be mid-upload in a shared uploads/, so only a sole owner sweeps it
+        tasks.append(asyncio.create_task(collect_orphaned_uploads(time.time())))
+    if HISTORY_TTL:
+        tasks.append(asyncio.create_task(expire_clips()))
+    yield
+    for task in tasks:
+        task.cancel()
+    for channel in channels.values():
+        await channel.backend.close()
+    await storage.close()
+    image_variants.shutdown()
+
+app = FastAPI(title="CrossClip Secure API", lifespan=lifespan)
 
 # Ensure uploads directory exists
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # Suggested chunk size for /upload/chunked clients
+UPLOAD_BATCH_MAX = int(os.getenv("UPLOAD_BATCH_MAX", "100"))  # Items per /upload/batch request
+UPLOAD_SESSION_TTL = 3600  # Seconds an idle chunked upload is kept around for resuming
+blobs = BlobStore(UPLOAD_DIR)
+storage = Storage(blobs)  # Uploads/ I/O runs on its thread pool, never on the event loop
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,6 +77,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip / zstd for JSON responses such as /latest and /history (WebSocket frames use permessage-deflate)
+app.add_middleware(CompressionMiddleware)
 
 # --- DATA MODELS ---
 class ClipItem(BaseModel):
@@ -39,6 +86,26 @@ class ClipItem(BaseModel):
     type: str  # "text" or "image"
     content: str  # Text content or Filename
     timestamp: str
+    sha256: Optional[str] = None  # Hash of the payload, lets clients skip blobs they already hold
+    seq: int = 0  # Position in history, assigned on insert
+    size: int = 0  # Payload bytes (UTF-8 text or the image file), counted against the retention budgets
+    text_file: Optional[str] = None  # Large text: `content` is only a preview, the full text is /uploads/{text_file}
+
+class HistoryPage(BaseModel):
+    items: List[ClipItem]
+    oldest_seq: int
+    last_seq: int
+
+class ChunkedUploadInit(BaseModel):
+    size: int
+    filename: Optional[str] = None
+
+class ChunkedUploadStatus(BaseModel):
+    upload_id: str
+    size: int
+    chunk_size: int
+    received_bytes: int
+    missing: List[List[int]]  # [start, end) byte ranges still to send
 
 class SystemStatus(BaseModel):
     armed: bool
@@ -46,36 +113,407 @@ class SystemStatus(BaseModel):
     connected_clients: int
 
 # --- GLOBAL STATE ---
-clipboard_history: List[ClipItem] = []
-system_state = {"armed": False}
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "50"))
+# Retention per channel besides the count: bytes of text held in memory, bytes of files in
+# uploads/ (0 = no limit) and a maximum age. The oldest clips go first; the newest always stays.
+HISTORY_BUDGETS = {
+    "memory": int(float(os.getenv("HISTORY_TEXT_MB", "64")) * 1024 * 1024),
+    "disk": int(float(os.getenv("HISTORY_IMAGE_MB", "2048")) * 1024 * 1024),  # Images and spilled text
+}
+HISTORY_TTL = timedelta(hours=float(os.getenv("HISTORY_TTL_HOURS", "0")))  # 0: clips don't expire
+RETENTION_SWEEP_INTERVAL = float(os.getenv("RETENTION_SWEEP_SECONDS", "60"))  # Seconds between checks for expired clips
+HISTORY_PAGE_MAX = 200
+upload_sessions: Dict[Tuple[str, str], PartialBlob] = {}  # (channel, upload id) -> upload in progress
+
+# --- PERSISTENCE ---
+# History survives restarts in SQLite (or the shared backend); with the default backend the
+# arm state deliberately does not (a restart comes up DISARMED).
+HISTORY_DB_PATH = os.getenv("HISTORY_DB", "crossclip.db")
+
+async def restore_history(channel: "Channel", rows: List[dict]):
+    items = [ClipItem(**{key: value for key, value in row.items() if value is not None}) for row in rows]
+    for item in items:
+        if not item.size:
+            item.size = await clip_size(item)  # Rows written before sizes were recorded
+    channel.history.load(items)
+    for item in items:
+        if clip_file(item):
+            blobs.incref(clip_file(item))
+        if item.type == "text":
+            channel.last_text_clip = item
+    if items:
+        print(f"📚 Restored {len(items)} clips in channel '{channel.name}'")
+    # Budgets may have been lowered (or clips expired) while we were down
+    evicted = channel.history.evict_over_budget()
+    if HISTORY_TTL:
+        evicted += channel.history.expire(datetime.now() - HISTORY_TTL)
+    await forget_clips(channel, evicted)
+
+async def clip_size(item: ClipItem) -> int:
+    if item.type != "image":
+        return len(item.content.encode("utf-8"))
+    try:
+        return await storage.run(os.path.getsize, blobs.path(item.content))
+    except OSError:
+        return 0
+
+def clip_file(item: ClipItem) -> Optional[str]:
+    """The blob in uploads/ a clip holds a reference to, if any."""
+    return item.content if item.type == "image" else item.text_file
+
+def budget_of(item: ClipItem) -> str:
+    return "disk" if clip_file(item) else "memory"
+
+async def forget_clips(channel: "Channel", evicted: List[ClipItem]):
+    """Release what retention dropped from the history and drop it from the backend too."""
+    for item in evicted:
+        release_clip(item)
+    if evicted:
+        await channel.backend.trim(channel.history.oldest_seq)
+
+async def expire_clips():
+    """Drop clips older than HISTORY_TTL_HOURS; each pass only touches the expired end of the ring."""
+    while True:
+        await asyncio.sleep(RETENTION_SWEEP_INTERVAL)
+        cutoff = datetime.now() - HISTORY_TTL
+        for channel in channels.values():
+            try:
+                await forget_clips(channel, channel.history.expire(cutoff))
+            except Exception as e:
+                print(f"⚠️ Could not expire clips in channel '{channel.name}': {e}")
+
+async def collect_orphaned_uploads(started: float):
+    """
+    Background reconcile of uploads/ against the restored history: re-attach variants
+    of live blobs and delete files nothing references (left over from before this start).
+    """
+    def scan():
+        found = []
+        for filename in os.listdir(UPLOAD_DIR):
+            try:
+                found.append((filename, os.path.getmtime(blobs.path(filename))))
+            except OSError:
+                pass
+        return found
+
+    removed = 0
+    for filename, mtime in await asyncio.to_thread(scan):
+        # Decide on the event loop, so an upload re-using this blob right now can't race us
+        parts = filename.rsplit(".", 2)
+        if filename in blobs.refcounts or filename == LOCK_FILE:
+            continue
+        if len(parts) == 3 and parts[0] in blobs.refcounts and parts[1] in ("thumb", "opt"):
+            blobs.variants.setdefault(parts[0], {})["thumb" if parts[1] == "thumb" else "webp"] = filename
+            continue
+        if mtime >= started:
+            continue  # Written by this process (upload in progress, fresh variant...)
+        try:
+            # Re-checked under the store's lock, in case an upload just stored this blob again
+            await storage.discard(parts[0] if len(parts) == 3 else filename, [filename])
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        print(f"🧹 Removed {removed} orphaned files from {UPLOAD_DIR}/")
 
 # --- WEBSOCKET MANAGER ---
+# Each client gets its own bounded outbound queue and sender task, so one slow
+# phone can never hold up the other devices (or the /upload response).
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "32"))        # Max pending events per client (lag threshold)
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # Seconds a single send may take
+WS_SLOW_POLICY = os.getenv("WS_SLOW_POLICY", "evict")        # "evict" slow clients or "drop" their oldest events
+INLINE_MAX_BYTES = int(os.getenv("INLINE_MAX_KB", "256")) * 1024  # Images up to this size ride along as a binary frame
+TEXT_SPILL_BYTES = int(os.getenv("TEXT_SPILL_KB", "64")) * 1024  # Larger text is stored in uploads/, events carry a preview
+TEXT_PREVIEW_CHARS = 1024
+EVENT_LOG_SIZE = int(os.getenv("EVENT_LOG_SIZE", "256"))      # Broadcast events kept for /ws?since= replay
+
+DEFAULT_CHANNEL = "default"
+DEVICE_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def clean_device_id(value: Optional[str]) -> Optional[str]:
+    """A client-chosen device id (?device= / X-Device-Id), or None if absent or malformed."""
+    return value if value and DEVICE_ID.fullmatch(value) else None
+
+def is_response(message) -> bool:
+    """An answer to a client's own request (see handle_ws_request), as opposed to a broadcast event."""
+    return isinstance(message, dict) and message.get("event") == "response"
+
+class ClientSession:
+    def __init__(self, websocket: WebSocket, max_queue: int, delta: bool = False, inline: bool = False,
+                 room: str = DEFAULT_CHANNEL, device: Optional[str] = None):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.delta = delta  # Client can apply text deltas (connected with ?delta=1)
+        self.last_text_sha: Optional[str] = None  # Last text clip queued to this client
+        self.inline = inline  # Client takes small payloads as a binary frame after the event (?inline=1)
+        self.catch_up: Optional[dict] = None  # replay / resync, sent ahead of the queue so it can't be dropped
+        self.room = room  # Channel this socket belongs to
+        self.device = device  # Clips this device uploads aren't echoed back to it
+
+class Room:
+    """One channel's sockets and its numbered event log."""
+    def __init__(self, log_size: int):
+        self.connections: Dict[WebSocket, ClientSession] = {}
+        # Every broadcast gets the next seq and is kept in the log for reconnecting clients.
+        # Starting from the clock puts the counter past any cursor handed out by a
+        # previous run, so stale cursors fall out of the log and resync.
+        self.event_seq = int(time.time() * 1000)
+        self.event_log: deque = deque(maxlen=log_size)
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, max_queue: int = WS_QUEUE_SIZE, send_timeout: float = WS_SEND_TIMEOUT, slow_policy: str = WS_SLOW_POLICY,
+                 log_size: int = EVENT_LOG_SIZE):
+        self.active_connections: Dict[WebSocket, ClientSession] = {}  # Every socket, whatever its room
+        self.rooms: Dict[str, Room] = {}  # A broadcast only walks its own room's sockets
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.slow_policy = slow_policy
+        self.log_size = log_size
+
+    def room(self, name: str = DEFAULT_CHANNEL) -> Room:
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(self.log_size)
+        return room
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, delta: bool = False, inline: bool = False, since: Optional[int] = None,
+                      state: Optional[dict] = None, room: str = DEFAULT_CHANNEL, device: Optional[str] = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        session = ClientSession(websocket, self.max_queue, delta, inline, room, device)
+        # Built before the session joins the fan-out (no await in between), so the
+        # catch-up batch can neither miss nor duplicate a concurrent broadcast
+        session.catch_up = self.catch_up(session, since)
+        if state is not None:
+            session.catch_up["state"] = state
+        self.active_connections[websocket] = session
+        self.room(room).connections[websocket] = session
+        session.task = asyncio.create_task(self._sender(session))
+
+    def catch_up(self, session: ClientSession, since: Optional[int]) -> dict:
+        """
+        First message on every socket. `replay` carries the events after `since`;
+        `resync` means the cursor is unknown or too old and the client should refetch state.
+        Either way "seq" is the cursor to reconnect with.
+        """
+        room = self.room(session.room)
+        oldest = room.event_log[0]["seq"] if room.event_log else room.event_seq + 1
+        if since is None or since > room.event_seq or since < oldest - 1:
+            return {"event": "resync", "seq": room.event_seq}
+        events = [event for event in room.event_log if event["seq"] > since]
+        for clip in (clip for event in events for clip in event_clips(event)):
+            if clip["type"] == "text":
+                session.last_text_sha = clip["sha256"]  # The client will hold this text
+        return {"event": "replay", "seq": room.event_seq, "events": events}
+
+    def resume(self, seq: int, events: List[dict], room: str = DEFAULT_CHANNEL):
+        """Continue a channel's shared event log at startup: its cursor and the recent events for replay."""
+        target = self.room(room)
+        target.event_seq = seq
+        target.event_log.extend(events)
+
+    def _record(self, room: Room, message: dict, seq: Optional[int] = None) -> dict:
+        # Events from the state backend arrive numbered; anything else gets the next local seq
+        room.event_seq = seq if seq is not None else room.event_seq + 1
+        message = {**message, "seq": room.event_seq}
+        room.event_log.append(message)
+        return message
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        session = self.active_connections.pop(websocket, None)
+        if session is None:
+            return
+        self.rooms[session.room].connections.pop(websocket, None)
+        if session.task and session.task is not asyncio.current_task():
+            session.task.cancel()
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                # Handle disconnected clients gracefully
-                pass
+    async def _sender(self, session: ClientSession):
+        try:
+            if session.catch_up is not None:
+                catch_up, session.catch_up = session.catch_up, None
+                await asyncio.wait_for(session.websocket.send_json(catch_up), self.send_timeout)
+            while True:
+                message = await session.queue.get()
+                if isinstance(message, tuple):
+                    # (event header, binary payload): queued together so they can't be split by drops
+                    header, payload = message
+                    await asyncio.wait_for(session.websocket.send_json(header), self.send_timeout)
+                    await asyncio.wait_for(session.websocket.send_bytes(payload), self.send_timeout)
+                else:
+                    await asyncio.wait_for(session.websocket.send_json(message), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Send failed or stalled past the timeout: the client is gone or too slow
+            metrics.SEND_FAILURES.inc()
+            self.evict(session.websocket)
+
+    def evict(self, websocket: WebSocket, code: int = 1013):
+        """Drop a client from the fan-out and close its socket in the background."""
+        if websocket not in self.active_connections:
+            return
+        metrics.EVICTIONS.inc()
+        self.disconnect(websocket)
+        asyncio.create_task(self._close_quietly(websocket, code))
+
+    async def _close_quietly(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """
+        Queue a message for one client (behind anything already pending for it).
+        Never dropped: under the "drop" policy a full queue waits up to the send timeout for room.
+        """
+        session = self.active_connections.get(websocket)
+        if session is None:
+            return
+        if self.slow_policy != "drop" or not session.queue.full():
+            self._enqueue(session, message)
+            return
+        try:
+            await asyncio.wait_for(session.queue.put(message), self.send_timeout)
+        except asyncio.TimeoutError:
+            self.evict(websocket)
+
+    def _enqueue(self, session: ClientSession, message: dict):
+        try:
+            session.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.slow_policy == "drop":
+                # Keep the newest events, discard the oldest pending one (answers to requests are never dropped)
+                pending = [session.queue.get_nowait() for _ in range(session.queue.qsize())]
+                oldest = next((i for i, m in enumerate(pending) if not is_response(m)), None)
+                if oldest is not None:
+                    del pending[oldest]
+                    pending.append(message)
+                for pending_message in pending:
+                    session.queue.put_nowait(pending_message)
+                session.dropped += 1
+                metrics.DROPPED_EVENTS.inc()
+            else:
+                self.evict(session.websocket)
+
+    async def broadcast(self, message: dict, room: str = DEFAULT_CHANNEL):
+        # Only enqueues; the per-client sender tasks do the actual (concurrent) sends
+        target = self.room(room)
+        message = self._record(target, message, message.get("seq"))
+        with metrics.BROADCAST_SECONDS.time():
+            for session in list(target.connections.values()):
+                self._enqueue(session, message)
+
+    def wants_delta(self, base_sha: str, room: str = DEFAULT_CHANNEL) -> bool:
+        return any(s.delta and s.last_text_sha == base_sha for s in self.room(room).connections.values())
+
+    def wants_inline(self, room: str = DEFAULT_CHANNEL) -> bool:
+        return any(s.inline for s in self.room(room).connections.values())
+
+    async def broadcast_clip(self, data: dict, base_sha: Optional[str] = None, ops: Optional[list] = None,
+                             payload: Optional[bytes] = None, media_type: Optional[str] = None, seq: Optional[int] = None,
+                             room: str = DEFAULT_CHANNEL, origin: Optional[str] = None):
+        """
+        Send a new_clip event. Delta-capable clients that were last sent the text
+        `base_sha` get only the ops against it (they verify the result with data["sha256"]).
+        Inline-capable clients get `payload` as a binary frame right after the event,
+        saving the GET /uploads round trip. The `origin` device already holds the clip
+        (its upload was acknowledged) and is skipped.
+        """
+        target = self.room(room)
+        full = self._record(target, {"event": "new_clip", "data": data}, seq)  # The log keeps the self-contained form
+        compact = None
+        if ops is not None:
+            compact = {**full, "data": {**data, "content": ""}, "delta": {"base": base_sha, "ops": ops}}
+        with_payload = None
+        if payload is not None:
+            with_payload = ({**full, "inline": {"size": len(payload), "type": media_type}}, payload)
+        with metrics.BROADCAST_SECONDS.time():
+            for session in list(target.connections.values()):
+                if origin is not None and session.device == origin:
+                    if data["type"] == "text":
+                        session.last_text_sha = data["sha256"]  # It holds the text it sent
+                    continue
+                use_delta = compact is not None and session.delta and session.last_text_sha == base_sha
+                if with_payload is not None and session.inline:
+                    self._enqueue(session, with_payload)
+                else:
+                    self._enqueue(session, compact if use_delta else full)
+                if data["type"] == "text":
+                    session.last_text_sha = data["sha256"]
+
+    async def broadcast_clips(self, clips: List[dict], seq: Optional[int] = None, room: str = DEFAULT_CHANNEL,
+                              origin: Optional[str] = None):
+        """Send one new_clips event for a batch upload (whole clips: no deltas, no inline payloads)."""
+        target = self.room(room)
+        message = self._record(target, {"event": "new_clips", "data": clips}, seq)
+        texts = [clip for clip in clips if clip["type"] == "text"]
+        with metrics.BROADCAST_SECONDS.time():
+            for session in list(target.connections.values()):
+                if texts:
+                    session.last_text_sha = texts[-1]["sha256"]  # The base of its next delta
+                if origin is None or session.device != origin:
+                    self._enqueue(session, message)
 
 manager = ConnectionManager()
 
+# --- CHANNELS ---
+# Each channel is a separate clipboard with its own token, arm state, history, event log and
+# sockets; the key a client presents picks its channel. API_SECRET is the "default" channel,
+# CHANNELS="work:token1,family:token2" adds more.
+# A channel's state lives in its state backend (STATE_BACKEND=memory|local|redis) so that several
+# uvicorn workers or hosts can serve it. Every change comes back to every worker through
+# apply_event, in the same order.
+CHANNEL_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class Channel:
+    def __init__(self, name: str, token: Optional[str]):
+        self.name = name
+        self.token = token
+        self.search = SearchIndex()  # Words of the text clips in `history`, kept current by it
+        self.history = ClipHistory(HISTORY_LIMIT, HISTORY_BUDGETS, budget_of, self.search)
+        self.armed = False  # This worker's copy, kept current by the arm events from the backend
+        self.last_text_clip: Optional[ClipItem] = None  # Base for text deltas
+        if name == DEFAULT_CHANNEL:
+            db_path, prefix = HISTORY_DB_PATH, "crossclip"
+        else:
+            root, ext = os.path.splitext(HISTORY_DB_PATH)
+            db_path, prefix = f"{root}.{name}{ext}", f"crossclip:{name}"
+        self.backend = get_backend(db_path, HISTORY_LIMIT, EVENT_LOG_SIZE, prefix=prefix)
+
+def load_channels() -> Dict[str, Channel]:
+    channels = {DEFAULT_CHANNEL: Channel(DEFAULT_CHANNEL, API_SECRET)}
+    for entry in filter(None, (part.strip() for part in os.getenv("CHANNELS", "").split(","))):
+        name, _, token = entry.partition(":")
+        if not CHANNEL_NAME.fullmatch(name) or not token:
+            raise ValueError(f"Invalid CHANNELS entry '{entry}' (expected name:token, name of letters, digits, - and _)")
+        if name in channels or any(channel.token == token for channel in channels.values()):
+            raise ValueError(f"Channel '{name}' repeats a name or token in CHANNELS")
+        channels[name] = Channel(name, token)
+    return channels
+
+channels = load_channels()
+channels_by_token = {channel.token: channel for channel in channels.values()}
+SHARED_STATE = any(channel.backend.shared for channel in channels.values())  # Other processes use uploads/ too
+
+# Read on scrape only
+metrics.Gauge("crossclip_connected_clients", "Open WebSocket connections.", lambda: len(manager.active_connections))
+metrics.Gauge("crossclip_history_items", "Clips held in the in-memory history (all channels).",
+              lambda: sum(len(channel.history) for channel in channels.values()))
+metrics.Gauge("crossclip_stored_bytes", "Bytes stored under uploads/.", blobs.stored_bytes)
+metrics.Gauge("crossclip_pending_deletes", "Evicted files queued for deletion.", lambda: storage.pending)
+
 # --- SECURITY ---
-async def verify_token(x_api_key: Optional[str] = Header(None)):
-    if x_api_key != API_SECRET:
+async def verify_token(x_api_key: Optional[str] = Header(None)) -> Channel:
+    """Resolve the API key to its channel."""
+    channel = channels_by_token.get(x_api_key)
+    if channel is None:
         raise HTTPException(status_code=401, detail="Invalid API Key")
-    return x_api_key
+    return channel
+
+def device_id(x_device_id: Optional[str] = Header(None)) -> Optional[str]:
+    return clean_device_id(x_device_id)
 
 async def verify_token_ws(websocket: WebSocket, x_api_key: Optional[str] = None):
     # For WebSocket, we might pass key in query param or header (headers are tricky in JS WebSocket)
@@ -85,120 +523,538 @@ async def verify_token_ws(websocket: WebSocket, x_api_key: Optional[str] = None)
 
 # --- ENDPOINTS ---
 
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+# --- HTTP CACHING ---
+IMMUTABLE = "public, max-age=31536000, immutable"  # Blob URLs are content-addressed, never rewritten
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check (weak comparison, handles lists and *)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+def cached_json(request: Request, payload: dict, etag: str) -> Response:
+    """JSON that clients must revalidate, answered with 304 when they already hold it."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
 
 @app.get("/")
 def read_root():
     # Serve the main HTML file instead of JSON
     return FileResponse("index.html")
 
-@app.get("/status", response_model=SystemStatus, dependencies=[Depends(verify_token)])
-def get_status():
+@app.get("/uploads/{filename}")
+def get_upload(filename: str, request: Request, variant: Optional[str] = None):
+    """
+    Serve a stored blob. `?variant=thumb` returns the preview thumbnail; otherwise
+    browsers that accept WebP get the re-compressed variant when one exists.
+    Falls back to the original while variants are still rendering.
+    """
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if variant is not None and variant not in image_variants.VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unknown variant '{variant}'")
+
+    available = known_variants(filename)
+    wants_webp = variant is None and "image/webp" in request.headers.get("accept", "")
+    chosen = available.get(variant) if variant else None
+    if chosen is None and wants_webp:
+        chosen = available.get("webp")
+    path = blobs.path(chosen or filename)
+    if chosen and not os.path.isfile(path):
+        path = blobs.path(filename)  # Variant went away meanwhile
+        chosen = None
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    # The answer for this URL is final once it is the file asked for: the variant itself, or the
+    # original when no variant can replace it (rendering done, WebP not accepted, or not an image).
+    # A stand-in for a variant that is still rendering must be revalidated, not kept for a year.
+    rendered = "thumb" in available or filename.endswith(".gz")
+    final = chosen is not None or (variant is None and (rendered or not wants_webp))
+
+    # Blob and variant names are derived from the content hash, so the name is a strong ETag.
+    # FileResponse answers Range / If-Range requests itself.
+    headers = {"ETag": f'"{os.path.basename(path)}"', "Cache-Control": IMMUTABLE if final else "no-cache"}
+    if variant is None:
+        headers["Vary"] = "Accept"
+    if path.endswith(".gz"):
+        return gzipped_text(path, request, headers)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+def gzipped_text(path: str, request: Request, headers: Dict[str, str]) -> Response:
+    """Spilled text is kept gzipped: sent as is with Content-Encoding, or unpacked for clients without gzip."""
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    media_type = "text/plain; charset=utf-8"
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return FileResponse(path, media_type=media_type, headers={**headers, "Content-Encoding": "gzip"})
+
+    def unpack():
+        with gzip.open(path, "rb") as f:
+            while chunk := f.read(64 * 1024):
+                yield chunk
+    return StreamingResponse(unpack(), media_type=media_type, headers=headers)
+
+DISARMED = "System is DISARMED. Please ARM to sync."
+
+def system_status(channel: Channel) -> dict:
     return {
-        "armed": system_state["armed"],
-        "item_count": len(clipboard_history),
-        "connected_clients": len(manager.active_connections)
+        "armed": channel.armed,
+        "item_count": len(channel.history),
+        "connected_clients": len(manager.room(channel.name).connections)
     }
 
-@app.post("/arm", dependencies=[Depends(verify_token)])
-async def arm_system():
-    system_state["armed"] = True
-    await manager.broadcast({"event": "system_armed"})
+async def set_armed(channel: Channel, armed: bool):
+    (metrics.ARMS if armed else metrics.DISARMS).inc()
+    await channel.backend.set_armed(armed)  # Every worker updates channel.armed and notifies its clients in apply_event
+
+async def require_armed(channel: Channel):
+    # Early check before storing anything; publish_clip re-checks atomically in the backend.
+    # Another worker may have armed a moment ago, so shared backends are asked directly.
+    armed = await channel.backend.get_armed() if channel.backend.shared else channel.armed
+    if not armed:
+        raise HTTPException(status_code=403, detail=DISARMED)
+
+async def text_clip(content: str) -> ClipItem:
+    """
+    A text clip. Above TEXT_SPILL_KB the text goes gzipped into uploads/ and the clip
+    (held in memory, sent in every event) carries only a preview plus the blob name.
+    """
+    data = content.encode("utf-8")
+    metrics.UPLOAD_BYTES.observe(len(data))
+    text_file = None
+    if len(data) > TEXT_SPILL_BYTES:
+        packed = await storage.run(functools.partial(gzip.compress, data, compresslevel=6, mtime=0))
+        text_file, _, _ = await storage.save_stream(io.BytesIO(packed), "gz")
+        content = content[:TEXT_PREVIEW_CHARS]
+    return ClipItem(
+        id=str(uuid.uuid4()),
+        type="text",
+        content=content,
+        timestamp=datetime.now().isoformat(),
+        sha256=hashlib.sha256(data).hexdigest(),
+        size=len(data),
+        text_file=text_file
+    )
+
+def image_clip(filename: str, digest: str, size: int) -> ClipItem:
+    return ClipItem(
+        id=str(uuid.uuid4()),
+        type="image",
+        content=filename, # Store filename
+        timestamp=datetime.now().isoformat(),
+        sha256=digest,
+        size=size
+    )
+
+@app.get("/status", response_model=SystemStatus)
+def get_status(request: Request, channel: Channel = Depends(verify_token)):
+    status = system_status(channel)
+    etag = f'W/"status-{int(status["armed"])}-{status["item_count"]}-{status["connected_clients"]}"'
+    return cached_json(request, status, etag)
+
+@app.get("/metrics")
+def get_metrics(channel: Channel = Depends(verify_token)):
+    if channel.name != DEFAULT_CHANNEL:
+        raise HTTPException(status_code=403, detail="Metrics cover the whole server; use the default channel's key")
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/arm")
+async def arm_system(channel: Channel = Depends(verify_token)):
+    await set_armed(channel, True)
     return {"message": "System ARMED."}
 
-@app.post("/disarm", dependencies=[Depends(verify_token)])
-async def disarm_system():
-    system_state["armed"] = False
-    await manager.broadcast({"event": "system_disarmed"})
+@app.post("/disarm")
+async def disarm_system(channel: Channel = Depends(verify_token)):
+    await set_armed(channel, False)
     return {"message": "System DISARMED."}
 
-@app.post("/upload", dependencies=[Depends(verify_token)])
+@app.post("/upload")
 async def upload_clip(
-    file: Optional[UploadFile] = File(None),
-    content: Optional[str] = Form(None),
-    type: str = Form("text") # Client should specify type explicitly
+    request: Request,
+    channel: Channel = Depends(verify_token),
+    device: Optional[str] = Depends(device_id)
 ):
     """
-    Handle both text and file uploads.
+    Handle both text (`content`) and file uploads (`file`, with `type` = "image").
     STRICT SECURITY: Only allow upload if system is ARMED.
     """
-    if not system_state["armed"]:
-        raise HTTPException(status_code=403, detail="System is DISARMED. Please ARM to sync.")
-
-    clip_id = str(uuid.uuid4())
-    timestamp = datetime.now().isoformat()
-    
-    new_item = None
-
-    if type == "image" and file:
-        # Save file
-        file_ext = file.filename.split(".")[-1] if file.filename else "png"
-        filename = f"{clip_id}.{file_ext}"
-        filepath = os.path.join(UPLOAD_DIR, filename)
-        
-        with open(filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        new_item = ClipItem(
-            id=clip_id,
-            type="image",
-            content=filename, # Store filename
-            timestamp=timestamp
-        )
-    elif content:
-        # Text content
-        new_item = ClipItem(
-            id=clip_id,
-            type="text",
-            content=content,
-            timestamp=timestamp
-        )
-    else:
-        raise HTTPException(status_code=400, detail="No content provided")
+    await require_armed(channel)
+
+    with metrics.UPLOAD_SECONDS.time():
+        # Parsed here, not by Form(): Starlette caps text fields at 1 MB unless told otherwise
+        async with request.form(max_part_size=MAX_UPLOAD_BYTES) as form:
+            file, content = form.get("file"), form.get("content")
+            if form.get("type", "text") == "image" and file is not None and not isinstance(file, str):
+                # Save file (content-addressed, hashed while it streams to disk)
+                new_item = image_clip(*await save_image(file.file, upload_ext(file)))
+            elif isinstance(content, str) and content:
+                new_item = await text_clip(content)
+            else:
+                raise HTTPException(status_code=400, detail="No content provided")
+
+        await publish_clip(channel, new_item, device)
+    return {"message": "Upload successful", "item": new_item}
+
+@app.post("/upload/batch")
+async def upload_batch(
+    request: Request,
+    channel: Channel = Depends(verify_token),
+    device: Optional[str] = Depends(device_id)
+):
+    """
+    Several clips in one multipart request: `file` parts (images) and `content` parts (text),
+    kept in request order. They take one arm and reach devices as a single new_clips event.
+    """
+    await require_armed(channel)
+
+    with metrics.UPLOAD_SECONDS.time():
+        async with request.form(max_files=UPLOAD_BATCH_MAX, max_fields=UPLOAD_BATCH_MAX + 1,
+                                max_part_size=MAX_UPLOAD_BYTES) as form:
+            parts = [(key, value) for key, value in form.multi_items() if key in ("file", "content") and value]
+            if not parts:
+                raise HTTPException(status_code=400, detail="No content provided")
+            if len(parts) > UPLOAD_BATCH_MAX:
+                raise HTTPException(status_code=413, detail=f"At most {UPLOAD_BATCH_MAX} items per batch")
+            new_items: List[ClipItem] = []
+            try:
+                for key, value in parts:
+                    if isinstance(value, str):
+                        new_items.append(await text_clip(value))
+                    else:
+                        new_items.append(image_clip(*await save_image(value.file, upload_ext(value))))
+            except BaseException:
+                for item in new_items:  # Stored before the failure, never published
+                    if clip_file(item):
+                        storage.release(clip_file(item))
+                raise
 
+        await publish_clips(channel, new_items, device)
+    return {"message": "Upload successful", "items": new_items}
+
+def upload_ext(file: UploadFile) -> str:
+    return file.filename.split(".")[-1] if file.filename else "png"
+
+async def save_image(src, ext: str):
+    """Store an uploaded image; returns only once it is durably on disk."""
+    try:
+        with metrics.DISK_WRITE_SECONDS.time():
+            filename, digest, size = await storage.save_stream(src, ext, max_bytes=MAX_UPLOAD_BYTES)
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    metrics.UPLOAD_BYTES.observe(size)
+    return filename, digest, size
+
+async def publish_clip(channel: Channel, new_item: ClipItem, origin: Optional[str] = None):
+    """Record a freshly stored clip, consume the channel's arm and notify its devices (except `origin`)."""
+    await publish_clips(channel, [new_item], origin)
+
+async def publish_clips(channel: Channel, new_items: List[ClipItem], origin: Optional[str] = None):
+    """publish_clip for one or more clips; a batch takes a single arm and goes out as one event."""
+    try:
+        event = await channel.backend.publish_clips([item.model_dump() for item in new_items], origin)
+    finally:
+        for item in new_items:
+            if clip_file(item):
+                # Drop the upload's own reference; the history took one when the event was applied
+                storage.release(clip_file(item))
+    if event is None:
+        raise HTTPException(status_code=403, detail=DISARMED)  # Another upload used up the arm first
+    for item, data in zip(new_items, event_clips(event)):
+        item.seq = data["seq"]
+    metrics.DISARMS.inc()  # Auto-Disarm (One-Shot logic)
+
+    for filename in {item.content for item in new_items if item.type == "image"}:
+        if not known_variants(filename):
+            asyncio.create_task(render_image_variants(filename))
+
+async def apply_event(channel: Channel, event: dict):
+    """Called on every worker for every change in a channel, in seq order (its own changes included)."""
+    if event["event"] == "new_clip":
+        await apply_clip(channel, event)
+        return
+    if event["event"] == "new_clips":
+        await apply_clips(channel, event)
+        return
+    if event["event"] in ("system_armed", "system_disarmed"):
+        channel.armed = event["event"] == "system_armed"
+    await manager.broadcast(event, room=channel.name)
+
+def remember_clip(channel: Channel, new_item: ClipItem):
+    """Add a clip to the channel's history; whatever falls out of the ring is released."""
+    if clip_file(new_item):
+        blobs.incref(clip_file(new_item))
+    popped_item = channel.history.put(new_item)
+    if popped_item is not None:
+        release_clip(popped_item)
+
+async def apply_clip(channel: Channel, event: dict):
+    new_item = ClipItem(**event["data"])
     # Update History
-    clipboard_history.append(new_item)
-    if len(clipboard_history) > 50:
-        popped_item = clipboard_history.pop(0)
-        # Prevent disk storage leak by deleting old image files
-        if popped_item.type == "image":
-            old_filepath = os.path.join(UPLOAD_DIR, popped_item.content)
-            if os.path.exists(old_filepath):
-                try:
-                    os.remove(old_filepath)
-                except Exception:
-                    pass
-
-    # Auto-Disarm (One-Shot logic)
-    system_state["armed"] = False
-    await manager.broadcast({"event": "system_disarmed"})
-
-    # Notify Clients
-    await manager.broadcast({
-        "event": "new_clip",
-        "data": new_item.dict()
-    })
+    remember_clip(channel, new_item)
+    # Size budgets: big clips push out as many old ones as it takes (same result on every worker)
+    await forget_clips(channel, channel.history.evict_over_budget())
+
+    # Notify Clients (text clips as a delta against the previous text where clients can take it)
+    base_sha, ops = None, None
+    if new_item.type == "text":
+        previous = channel.last_text_clip
+        # Spilled text isn't held here in full, so it goes without a delta
+        if (previous is not None and not previous.text_file and not new_item.text_file
+                and manager.wants_delta(previous.sha256, channel.name)):
+            base_sha = previous.sha256
+            ops = await asyncio.to_thread(make_delta, previous.content, new_item.content)
+        channel.last_text_clip = new_item
+
+    # Small images go out inline so devices don't each have to come back for them
+    payload, media_type = None, None
+    if new_item.type == "image" and manager.wants_inline(channel.name):
+        payload = await storage.read_if_smaller(new_item.content, INLINE_MAX_BYTES)
+        if payload is not None:
+            media_type = mimetypes.guess_type(new_item.content)[0] or "application/octet-stream"
+    await manager.broadcast_clip(new_item.model_dump(), base_sha, ops, payload, media_type, seq=event["seq"],
+                                 room=channel.name, origin=event.get("origin"))
+
+async def apply_clips(channel: Channel, event: dict):
+    """A batch upload: into the history in order, then one new_clips event for all of it."""
+    new_items = [ClipItem(**data) for data in event["data"]]
+    for item in new_items:
+        remember_clip(channel, item)
+    await forget_clips(channel, channel.history.evict_over_budget())
 
+    texts = [item for item in new_items if item.type == "text"]
+    if texts:
+        channel.last_text_clip = texts[-1]
+    await manager.broadcast_clips([item.model_dump() for item in new_items], seq=event["seq"], room=channel.name,
+                                  origin=event.get("origin"))
+
+def release_clip(item: ClipItem):
+    """Prevent disk storage leak: drop our reference, the blob goes with its last user."""
+    filename = clip_file(item)
+    if filename is None:
+        return
+    if item.type == "image":
+        variants = known_variants(filename)
+        if variants:
+            blobs.variants[filename] = variants  # So variants another worker rendered go too
+    storage.release(filename)  # Files are deleted in the background
+
+def known_variants(filename: str) -> Dict[str, str]:
+    """Rendered variants of a blob; with a shared backend another worker may have rendered them."""
+    found = blobs.variants.get(filename)
+    if found is None and SHARED_STATE and filename in blobs.refcounts:
+        return image_variants.existing_variants(blobs.path(filename))
+    return found or {}
+
+async def render_image_variants(filename: str):
+    """Build thumbnail/WebP variants in the process pool; originals are served until they're ready."""
+    try:
+        variants = await image_variants.build_variants(blobs.path(filename))
+    except Exception as e:
+        print(f"⚠️ Could not render variants for {filename}: {e}")
+        return
+    if filename in blobs.refcounts:
+        blobs.variants[filename] = variants
+    else:
+        # Evicted while rendering: don't leave the variants behind
+        await storage.discard(filename, variants.values())
+
+# --- CHUNKED UPLOADS ---
+# Large images can be sent as init -> PUT chunks (any order, in parallel, resumable) -> finalize.
+# Chunks land directly in the final blob file, which is renamed into place on finalize.
+
+def _upload_status(upload_id: str, partial: PartialBlob) -> dict:
+    return {
+        "upload_id": upload_id,
+        "size": partial.size,
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "received_bytes": partial.received_bytes,
+        "missing": partial.missing()
+    }
+
+def _get_upload_session(channel: Channel, upload_id: str) -> PartialBlob:
+    partial = upload_sessions.get((channel.name, upload_id))
+    if partial is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+    partial.touched = time.monotonic()
+    return partial
+
+def _expire_upload_sessions():
+    cutoff = time.monotonic() - UPLOAD_SESSION_TTL
+    for key, partial in list(upload_sessions.items()):
+        if partial.touched < cutoff:
+            storage.defer(upload_sessions.pop(key).abort)
+
+@app.post("/upload/chunked", response_model=ChunkedUploadStatus)
+async def init_chunked_upload(body: ChunkedUploadInit, channel: Channel = Depends(verify_token)):
+    await require_armed(channel)
+    if body.size < 1 or body.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Size must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+
+    _expire_upload_sessions()
+    file_ext = body.filename.split(".")[-1] if body.filename else "png"
+    partial = await storage.create_partial(body.size, file_ext)
+    upload_id = uuid.uuid4().hex
+    upload_sessions[(channel.name, upload_id)] = partial
+    return _upload_status(upload_id, partial)
+
+@app.get("/upload/chunked/{upload_id}", response_model=ChunkedUploadStatus)
+def get_chunked_upload(upload_id: str, channel: Channel = Depends(verify_token)):
+    # Resume: tells the client which byte ranges are still missing
+    return _upload_status(upload_id, _get_upload_session(channel, upload_id))
+
+@app.put("/upload/chunked/{upload_id}", response_model=ChunkedUploadStatus)
+async def put_chunk(upload_id: str, request: Request, offset: int = 0, channel: Channel = Depends(verify_token)):
+    partial = _get_upload_session(channel, upload_id)
+    position = offset
+    try:
+        # Stream the body straight to its place in the file; the size cap is enforced as bytes arrive
+        async for piece in request.stream():
+            with metrics.DISK_WRITE_SECONDS.time():
+                await storage.write_at(partial, position, piece)
+            position += len(piece)
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return _upload_status(upload_id, partial)
+
+@app.post("/upload/chunked/{upload_id}/finalize")
+async def finalize_chunked_upload(upload_id: str, channel: Channel = Depends(verify_token),
+                                  device: Optional[str] = Depends(device_id)):
+    partial = _get_upload_session(channel, upload_id)
+    await require_armed(channel)
+    if not partial.complete:
+        raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "missing": partial.missing()})
+
+    upload_sessions.pop((channel.name, upload_id), None)
+    with metrics.DISK_WRITE_SECONDS.time():
+        committed = await storage.commit(partial)
+    new_item = image_clip(*committed, partial.size)
+    metrics.UPLOAD_BYTES.observe(partial.size)
+    await publish_clip(channel, new_item, device)
     return {"message": "Upload successful", "item": new_item}
 
-@app.get("/latest", response_model=ClipItem, dependencies=[Depends(verify_token)])
-def get_latest():
-    if not clipboard_history:
+@app.delete("/upload/chunked/{upload_id}")
+async def abort_chunked_upload(upload_id: str, channel: Channel = Depends(verify_token)):
+    _get_upload_session(channel, upload_id)
+    await storage.run(upload_sessions.pop((channel.name, upload_id)).abort)
+    return {"message": "Upload aborted"}
+
+@app.get("/latest", response_model=ClipItem)
+def get_latest(request: Request, channel: Channel = Depends(verify_token)):
+    latest = channel.history.latest()
+    if latest is None:
         raise HTTPException(status_code=404, detail="Empty history")
-    return clipboard_history[-1]
+    # Weak: the body may be gzip/zstd encoded on the way out
+    return cached_json(request, latest.model_dump(), f'W/"{latest.id}"')
+
+@app.get("/history", response_model=HistoryPage)
+def get_history(after: int = 0, limit: int = 50, channel: Channel = Depends(verify_token)):
+    """Page through history oldest-first. Pass the last seq you hold as `after`."""
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    return {
+        "items": channel.history.after(after, limit),
+        "oldest_seq": channel.history.oldest_seq,
+        "last_seq": channel.history.last_seq
+    }
+
+@app.get("/search", response_model=List[ClipItem])
+def search_history(q: str, limit: int = 20, channel: Channel = Depends(verify_token)):
+    """Text clips in the history containing every word of `q` (any case), newest first."""
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    return [channel.history.get_seq(seq) for seq in channel.search.search(q, limit)]
+
+@app.get("/clip/{clip_id}", response_model=ClipItem)
+def get_clip(clip_id: str, request: Request, channel: Channel = Depends(verify_token)):
+    item = channel.history.get(clip_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Clip not found")
+    return cached_json(request, item.model_dump(), f'W/"{item.id}"')
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None):
-    # Simple Auth Check
-    if token != API_SECRET:
+async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None, delta: bool = False, inline: bool = False,
+                             since: Optional[int] = None, device: Optional[str] = None):
+    # Simple Auth Check (the token also picks the channel)
+    channel = channels_by_token.get(token)
+    if channel is None:
         await websocket.close(code=1008)
         return
 
-    await manager.connect(websocket)
+    device = clean_device_id(device)
+    await manager.connect(websocket, delta=delta, inline=inline, since=since, state={"armed": channel.armed},
+                          room=channel.name, device=device)
     try:
         while True:
-            # Keep the connection alive
-            # We can also listen for client messages if needed
-            await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                request = json.loads(message.get("text") or "")
+            except ValueError:
+                continue  # Keepalives and stray frames
+            if not isinstance(request, dict) or "op" not in request:
+                continue
+            payload = None
+            if request["op"] == "upload" and request.get("type") == "image":
+                # The image bytes follow their request as one binary frame
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    break
+                payload = frame.get("bytes")
+            await manager.send(websocket, await handle_ws_request(channel, request, payload, device))
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
\ No newline at end of file
+        pass
+    finally:
+        manager.disconnect(websocket)
+
+# --- WEBSOCKET REQUESTS ---
+# Clients already hold a socket open, so upload / arm / disarm / status can ride on it
+# instead of a fresh HTTP request each. A request is {"op": ..., "id": <correlation id>, ...};
+# the answer is {"event": "response", "id": ..., "ok": true, "result": ...} or
+# {"event": "response", "id": ..., "ok": false, "status": <HTTP status>, "detail": ...}.
+async def handle_ws_request(channel: Channel, request: dict, payload: Optional[bytes],
+                            device: Optional[str] = None) -> dict:
+    response = {"event": "response", "id": request.get("id")}
+    try:
+        result = await run_ws_request(channel, request, payload, device)
+    except HTTPException as e:
+        return {**response, "ok": False, "status": e.status_code, "detail": e.detail}
+    except Exception as e:
+        # The client is waiting on this id: answer it rather than leave it to time out
+        print(f"⚠️ WebSocket {request.get('op')} failed: {e}")
+        return {**response, "ok": False, "status": 500, "detail": str(e) or type(e).__name__}
+    return {**response, "ok": True, "result": result}
+
+async def run_ws_request(channel: Channel, request: dict, payload: Optional[bytes], device: Optional[str] = None) -> dict:
+    op = request["op"]
+    if op == "status":
+        return system_status(channel)
+    if op in ("arm", "disarm"):
+        await set_armed(channel, op == "arm")
+        return {"armed": channel.armed}
+    if op == "upload":
+        await require_armed(channel)
+        with metrics.UPLOAD_SECONDS.time():
+            if request.get("type") == "image":
+                if not payload:
+                    raise HTTPException(status_code=400, detail="Image data missing")
+                new_item = image_clip(*await save_image(io.BytesIO(payload), request.get("ext") or "png"))
+            elif request.get("content"):
+                new_item = await text_clip(request["content"])
+            else:
+                raise HTTPException(status_code=400, detail="No content provided")
+            await publish_clip(channel, new_item, device)
+        return {"item": new_item.model_dump()}  # The ack: stored id, seq and sha256
+    raise HTTPException(status_code=400, detail=f"Unknown op: {op}")
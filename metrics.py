@@ -0,0 +1,136 @@
+"""
+Prometheus text-format metrics for /metrics, without a client library.
+
+Updates are a few attribute additions on objects created at import time (no locks, no
+label lookups), so instrumenting the hot path costs next to nothing; gauges are callbacks
+evaluated only when scraped. METRICS=0 turns every update into a no-op.
+"""
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, List, Sequence
+
+ENABLED = os.getenv("METRICS", "1") != "0"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024**2, 10 * 1024**2, 100 * 1024**2)
+
+_registry: List["_Metric"] = []
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        if ENABLED:
+            self.value += amount
+
+    def samples(self):
+        return [f"{self.name} {_fmt(self.value)}"]
+
+
+class Gauge(_Metric):
+    """Read on scrape from `source`, so nothing is tracked in between."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, source: Callable[[], float]):
+        super().__init__(name, help)
+        self.source = source
+
+    def samples(self):
+        return [f"{self.name} {_fmt(self.source())}"]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: "Histogram"):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        if ENABLED:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """`with histogram.time():` observes the block's duration in seconds."""
+        return _Timer(self) if ENABLED else _NO_TIMER
+
+    def samples(self):
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{_fmt(bound)}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {_fmt(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# --- SERVER METRICS ---
+UPLOAD_BYTES = Histogram("crossclip_upload_bytes", "Size of uploaded clips in bytes.", SIZE_BUCKETS)
+UPLOAD_SECONDS = Histogram("crossclip_upload_seconds", "Time to accept an upload, store it and queue its events.")
+DISK_WRITE_SECONDS = Histogram("crossclip_disk_write_seconds", "Time spent writing upload data to uploads/.")
+BROADCAST_SECONDS = Histogram("crossclip_broadcast_seconds", "Time to fan one event out to every client queue.")
+SEND_FAILURES = Counter("crossclip_send_failures_total", "WebSocket sends that failed or timed out (client evicted).")
+EVICTIONS = Counter("crossclip_evictions_total", "Clients disconnected for being too slow or unreachable.")
+DROPPED_EVENTS = Counter("crossclip_dropped_events_total", "Events discarded for slow clients (WS_SLOW_POLICY=drop).")
+ARMS = Counter("crossclip_arm_total", "Times the system was armed.")
+DISARMS = Counter("crossclip_disarm_total", "Times the system was disarmed, manually or after an upload.")
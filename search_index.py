@@ -0,0 +1,57 @@
+"""
+Full-text search over a channel's clip history.
+
+An inverted index (word -> seqs of the clips containing it) that ClipHistory keeps
+current as clips come and go, so adding or evicting a clip costs its number of distinct
+words and a query costs the size of its rarest word's postings, not the history's length.
+"""
+import heapq
+import re
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set
+
+WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> Set[str]:
+    """Case-insensitive words of `text` (letters, digits and _ in any script)."""
+    return set(WORD.findall(text.casefold()))
+
+
+def clip_text(item) -> Optional[str]:
+    """What gets indexed: the content of text clips (the preview, for spilled text)."""
+    return item.content if getattr(item, "type", None) == "text" else None
+
+
+class SearchIndex:
+    def __init__(self, text_of: Callable[[Any], Optional[str]] = clip_text):
+        self.text_of = text_of
+        self._postings: Dict[str, Set[int]] = {}
+        self._words: Dict[int, FrozenSet[str]] = {}  # seq -> its words, to undo add()
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def add(self, item):
+        text = self.text_of(item)
+        if not text:
+            return
+        found = frozenset(words(text))
+        self._words[item.seq] = found
+        for word in found:
+            self._postings.setdefault(word, set()).add(item.seq)
+
+    def remove(self, item):
+        for word in self._words.pop(item.seq, ()):
+            seqs = self._postings[word]
+            seqs.discard(item.seq)
+            if not seqs:
+                del self._postings[word]
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """Seqs of up to `limit` clips containing every word of `query`, newest first."""
+        wanted = words(query)
+        if not wanted:
+            return []
+        postings = sorted((self._postings.get(word, set()) for word in wanted), key=len)
+        matches = postings[0].intersection(*postings[1:])
+        return heapq.nlargest(limit, matches)
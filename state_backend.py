@@ -0,0 +1,596 @@
+"""
+Shared server state behind one interface, so a clipboard can be served by several
+uvicorn workers or hosts: the arm flag, the clip history and the ordered event log.
+
+Every change is an event appended to a log under a global seq. Changes are atomic
+(an upload checks and consumes the arm and gets its history seq in the same step),
+and every worker - the one that made the change first - runs `on_event` for each
+event in seq order. Notifications that overtake each other or go missing are
+filled in from the log, so all workers build the same history.
+
+STATE_BACKEND picks one:
+- memory: this process only (default, a single uvicorn worker)
+- local:  the HISTORY_DB SQLite file, shared by the workers on one host (uvicorn --workers N)
+- redis:  any Redis-protocol server at REDIS_URL, for several hosts sharing uploads/
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from history_db import COLUMNS, SCHEMA, HistoryDB, migrate
+
+POLL_INTERVAL = 0.01  # Seconds between change checks of the shared SQLite file
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+def first_seq() -> int:
+    # Starting from the clock puts a fresh log past any cursor a previous run handed out
+    return int(time.time() * 1000)
+
+
+def arm_event(armed: bool, seq: int) -> dict:
+    return {"event": "system_armed" if armed else "system_disarmed", "seq": seq}
+
+
+def clip_events(clips: List[dict], clip_seq: int, seq: int, origin: Optional[str] = None) -> List[dict]:
+    """
+    New clips, numbered from `clip_seq`, and the auto-disarm (one-shot arming) that comes with them.
+    One clip is a new_clip event, a batch is a single new_clips event. `origin`: the uploading device.
+    """
+    numbered = [{**data, "seq": clip_seq + i} for i, data in enumerate(clips)]
+    if len(numbered) == 1:
+        event = {"event": "new_clip", "data": numbered[0], "seq": seq + 1}
+    else:
+        event = {"event": "new_clips", "data": numbered, "seq": seq + 1}
+    if origin:
+        event["origin"] = origin
+    return [event, arm_event(False, seq + 2)]
+
+
+def event_clips(event: dict) -> List[dict]:
+    """
+    The clips an event carries, oldest first: one for new_clip, a whole batch upload for
+    new_clips, none for anything else. Shared with the desktop clients.
+    """
+    if event.get("event") == "new_clip":
+        return [event["data"]]
+    if event.get("event") == "new_clips":
+        return event["data"]
+    return []
+
+
+class StateBackend:
+    shared = True  # Other processes use the same uploads/ as well
+
+    def __init__(self, history_limit: int = 50, log_size: int = 256):
+        self.history_limit = history_limit
+        self.log_size = log_size
+        self.applied_seq = 0  # Last event this worker has run on_event for
+        self._on_event: Optional[EventHandler] = None
+        self._apply_lock = asyncio.Lock()
+
+    async def start(self, on_event: EventHandler) -> dict:
+        """
+        Begin delivering events and return the current state:
+        {"armed", "seq" (last event), "history" (clip dicts, oldest first), "events" (log tail)}.
+        """
+        self._on_event = on_event
+        async with self._apply_lock:  # Anything arriving meanwhile waits, then applies past the snapshot
+            await self._listen()
+            snapshot = await self._snapshot()
+            self.applied_seq = snapshot["seq"]
+        return snapshot
+
+    async def close(self):
+        pass
+
+    async def set_armed(self, armed: bool) -> dict:
+        events = await self._commit_arm(armed)
+        await self._deliver(events)
+        return events[-1]
+
+    async def publish_clip(self, data: dict, origin: Optional[str] = None) -> Optional[dict]:
+        """Add a clip to the history and consume the arm in one step. None if the system wasn't armed."""
+        return await self.publish_clips([data], origin)
+
+    async def publish_clips(self, clips: List[dict], origin: Optional[str] = None) -> Optional[dict]:
+        """Like publish_clip for a batch: one arm, one transaction, one event for all of `clips`."""
+        events = await self._commit_clips(clips, origin)
+        if events is None:
+            return None
+        await self._deliver(events)
+        return events[0]
+
+    async def trim(self, keep_from_seq: int):
+        """Forget clips older than `keep_from_seq` (retention). Idempotent, every worker may call it."""
+        raise NotImplementedError
+
+    async def _deliver(self, events: List[dict]):
+        async with self._apply_lock:
+            events = [event for event in events if event["seq"] > self.applied_seq]
+            expected = range(self.applied_seq + 1, self.applied_seq + 1 + len(events))
+            if [event["seq"] for event in events] != list(expected):
+                # Notifications overtook each other (or were lost): read the gap back from the log
+                events = await self._events_after(self.applied_seq)
+            for event in events:
+                if event["seq"] <= self.applied_seq:
+                    continue
+                self.applied_seq = event["seq"]
+                try:
+                    await self._on_event(event)
+                except Exception as e:
+                    print(f"⚠️ Failed to apply event {event['seq']}: {e}")
+
+    # --- implemented per backend ---
+    async def get_armed(self) -> bool:
+        raise NotImplementedError
+
+    async def _listen(self):
+        """Start receiving other workers' events (call self._deliver with them)."""
+        raise NotImplementedError
+
+    async def _snapshot(self) -> dict:
+        raise NotImplementedError
+
+    async def _events_after(self, seq: int) -> List[dict]:
+        raise NotImplementedError
+
+    async def _commit_arm(self, armed: bool) -> List[dict]:
+        raise NotImplementedError
+
+    async def _commit_clips(self, clips: List[dict], origin: Optional[str] = None) -> Optional[List[dict]]:
+        raise NotImplementedError
+
+
+# --- MEMORY ---
+
+class MemoryBackend(StateBackend):
+    """Single process. History is persisted through HistoryDB; the arm flag is not (a restart comes up DISARMED)."""
+    shared = False
+
+    def __init__(self, db_path: str, history_limit: int = 50, log_size: int = 256):
+        super().__init__(history_limit, log_size)
+        self.db_path = db_path
+        self.db: Optional[HistoryDB] = None
+        self.armed = False
+        self.seq = first_seq()
+        self.clip_seq = 0
+        self.log: deque = deque(maxlen=log_size)
+
+    async def _listen(self):
+        pass
+
+    async def _snapshot(self) -> dict:
+        # Only the newest history_limit rows are read
+        self.db = HistoryDB(self.db_path)
+        rows = await asyncio.to_thread(self.db.load_recent, self.history_limit)
+        if rows:
+            self.clip_seq = rows[-1]["seq"]
+            self.db.trim(rows[0]["seq"])  # Rows past the ring (e.g. HISTORY_LIMIT was lowered) are gone for good
+        return {"armed": self.armed, "seq": self.seq, "history": rows, "events": []}
+
+    async def close(self):
+        if self.db is not None:
+            self.db.close()
+
+    async def get_armed(self) -> bool:
+        return self.armed
+
+    async def _events_after(self, seq: int) -> List[dict]:
+        return [event for event in self.log if event["seq"] > seq]
+
+    async def trim(self, keep_from_seq: int):
+        self.db.trim(keep_from_seq)
+
+    def _append(self, events: List[dict]) -> List[dict]:
+        self.seq = events[-1]["seq"]
+        self.log.extend(events)
+        return events
+
+    async def _commit_arm(self, armed: bool) -> List[dict]:
+        self.armed = armed
+        return self._append([arm_event(armed, self.seq + 1)])
+
+    async def _commit_clips(self, clips: List[dict], origin: Optional[str] = None) -> Optional[List[dict]]:
+        if not self.armed:
+            return None
+        self.armed = False
+        events = clip_events(clips, self.clip_seq + 1, self.seq, origin)
+        self.clip_seq += len(clips)
+        for clip in event_clips(events[0]):
+            self.db.insert(clip)
+        self.db.trim(self.clip_seq - self.history_limit + 1)
+        return self._append(events)
+
+
+# --- LOCAL (SQLite) ---
+
+LOCAL_SCHEMA = SCHEMA + """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class LocalBackend(StateBackend):
+    """
+    Workers on one host share the history database file. Each change is one
+    IMMEDIATE transaction (SQLite serializes them, so seqs are handed out in
+    commit order); workers notice other workers' commits through PRAGMA data_version,
+    which costs no I/O, and then read the new events.
+    """
+
+    def __init__(self, db_path: str, history_limit: int = 50, log_size: int = 256):
+        super().__init__(history_limit, log_size)
+        self.db_path = db_path
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._watch: Optional[sqlite3.Connection] = None  # Only asked for data_version, from the event loop
+        self._poller: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    async def start(self, on_event: EventHandler) -> dict:
+        self._conn, self._watch = self._connect(), self._connect()
+        with self._db_lock:
+            self._conn.executescript(LOCAL_SCHEMA)
+            migrate(self._conn)
+        return await super().start(on_event)
+
+    def _transaction(self, work: Callable[[sqlite3.Connection], object]):
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    async def _run(self, work: Callable[[sqlite3.Connection], object]):
+        return await asyncio.to_thread(self._transaction, work)
+
+    async def _listen(self):
+        self._poller = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        version = None
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                current = self._watch.execute("PRAGMA data_version").fetchone()[0]
+                if current != version:
+                    version = current
+                    await self._deliver(await self._events_after(self.applied_seq))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ State poll failed: {e}")
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+        self._watch.close()
+        with self._db_lock:
+            self._conn.close()
+
+    async def _snapshot(self) -> dict:
+        def read(conn):
+            recent = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM clips ORDER BY seq DESC LIMIT ?", (self.history_limit,)
+            ).fetchall()
+            history = [dict(zip(COLUMNS, row)) for row in reversed(recent)]
+            if history:
+                conn.execute("DELETE FROM clips WHERE seq < ?", (history[0]["seq"],))
+            events = [json.loads(body) for body, in conn.execute("SELECT body FROM events ORDER BY seq")]
+            # Where a fresh log starts, agreed on by every worker
+            conn.execute("INSERT OR IGNORE INTO state (key, value) VALUES ('first_seq', ?)", (str(first_seq()),))
+            return {"armed": self._armed(conn), "seq": self._last_seq(conn), "history": history, "events": events}
+        return await self._run(read)
+
+    async def _events_after(self, seq: int) -> List[dict]:
+        def read():
+            with self._db_lock:
+                rows = self._conn.execute("SELECT body FROM events WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+            return [json.loads(body) for body, in rows]
+        return await asyncio.to_thread(read)
+
+    async def get_armed(self) -> bool:
+        return await self._run(self._armed)
+
+    async def trim(self, keep_from_seq: int):
+        def delete(conn):
+            # The newest row stays, so clip seqs keep counting from it
+            conn.execute("DELETE FROM clips WHERE seq < ? AND seq < (SELECT max(seq) FROM clips)", (keep_from_seq,))
+        await self._run(delete)
+
+    @staticmethod
+    def _armed(conn: sqlite3.Connection) -> bool:
+        row = conn.execute("SELECT value FROM state WHERE key = 'armed'").fetchone()
+        return row is not None and row[0] == "1"
+
+    @staticmethod
+    def _last_seq(conn: sqlite3.Connection) -> int:
+        seq = conn.execute("SELECT max(seq) FROM events").fetchone()[0]
+        if seq is None:
+            seq = int(conn.execute("SELECT value FROM state WHERE key = 'first_seq'").fetchone()[0])
+        return seq
+
+    def _append(self, conn: sqlite3.Connection, events: List[dict]) -> List[dict]:
+        conn.executemany("INSERT INTO events (seq, body) VALUES (?, ?)", [(e["seq"], json.dumps(e)) for e in events])
+        conn.execute("DELETE FROM events WHERE seq <= ?", (events[-1]["seq"] - self.log_size,))
+        return events
+
+    def _set_armed(self, conn: sqlite3.Connection, armed: bool):
+        conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('armed', ?)", ("1" if armed else "0",))
+
+    async def _commit_arm(self, armed: bool) -> List[dict]:
+        def commit(conn):
+            self._set_armed(conn, armed)
+            return self._append(conn, [arm_event(armed, self._last_seq(conn) + 1)])
+        return await self._run(commit)
+
+    async def _commit_clips(self, clips: List[dict], origin: Optional[str] = None) -> Optional[List[dict]]:
+        def commit(conn):
+            if not self._armed(conn):
+                return None
+            self._set_armed(conn, False)
+            clip_seq = (conn.execute("SELECT max(seq) FROM clips").fetchone()[0] or 0) + 1
+            events = clip_events(clips, clip_seq, self._last_seq(conn), origin)
+            conn.executemany(f"INSERT INTO clips ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                             [tuple(clip.get(c) for c in COLUMNS) for clip in event_clips(events[0])])
+            conn.execute("DELETE FROM clips WHERE seq <= ?", (clip_seq + len(clips) - 1 - self.history_limit,))
+            return self._append(conn, events)
+        return await self._run(commit)
+
+
+# --- REDIS ---
+
+class RedisError(Exception):
+    pass
+
+
+def _encode(command: tuple) -> bytes:
+    out = [b"*%d\r\n" % len(command)]
+    for arg in command:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+class RedisConnection:
+    """Just enough of the Redis protocol (RESP2) for RedisBackend, without a client library."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, url: str) -> "RedisConnection":
+        """redis://[[user]:password@]host[:port][/db] or unix:///path/to/redis.sock[?db=N]"""
+        parts = urlsplit(url)
+        if parts.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(parts.path)
+            db = parse_qs(parts.query).get("db", ["0"])[0]
+        elif parts.scheme == "redis":
+            reader, writer = await asyncio.open_connection(parts.hostname or "127.0.0.1", parts.port or 6379)
+            db = parts.path.lstrip("/") or "0"
+        else:
+            raise ValueError(f"Unsupported REDIS_URL scheme '{parts.scheme}'")
+        conn = cls(reader, writer)
+        if parts.password:
+            await conn.execute(("AUTH", parts.username, parts.password) if parts.username else ("AUTH", parts.password))
+        if db != "0":
+            await conn.execute(("SELECT", db))
+        return conn
+
+    async def execute(self, *commands: tuple) -> list:
+        """Send the commands in one write (pipelined) and return their replies."""
+        self.writer.write(b"".join(_encode(command) for command in commands))
+        await self.writer.drain()
+        replies = [await self.read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def read(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            return None if size < 0 else (await self.reader.readexactly(size + 2))[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [await self.read() for _ in range(size)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisBackend(StateBackend):
+    """
+    State in a Redis-protocol server. Changes are optimistic transactions
+    (WATCH / MULTI / EXEC, retried if another worker got in first) that append to
+    a capped log list; the new events are then PUBLISHed to every worker.
+    """
+
+    def __init__(self, url: str, history_limit: int = 50, log_size: int = 256, prefix: str = "crossclip"):
+        super().__init__(history_limit, log_size)
+        self.url = url
+        self.armed_key, self.seq_key, self.clip_seq_key = f"{prefix}:armed", f"{prefix}:seq", f"{prefix}:clip_seq"
+        self.log_key, self.history_key, self.channel = f"{prefix}:log", f"{prefix}:history", f"{prefix}:events"
+        self._conn: Optional[RedisConnection] = None
+        self._conn_lock = asyncio.Lock()  # WATCH state is per connection, so one transaction at a time
+        self._sub: Optional[RedisConnection] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def _execute(self, *commands: tuple) -> list:
+        if self._conn is None:
+            self._conn = await RedisConnection.open(self.url)
+        try:
+            return await self._conn.execute(*commands)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            self._conn.close()
+            self._conn = None  # Reconnect on the next call
+            raise
+
+    async def _listen(self):
+        self._sub = await self._subscribe()
+        self._listener = asyncio.create_task(self._receive())
+
+    async def _subscribe(self) -> RedisConnection:
+        sub = await RedisConnection.open(self.url)
+        await sub.execute(("SUBSCRIBE", self.channel))
+        return sub
+
+    async def _receive(self):
+        while True:
+            try:
+                while True:
+                    reply = await self._sub.read()
+                    if isinstance(reply, list) and reply[0] == b"message":
+                        await self._deliver(json.loads(reply[2]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Lost the Redis subscription ({e}), reconnecting")
+                self._sub.close()
+                await asyncio.sleep(1)
+                try:
+                    self._sub = await self._subscribe()
+                    await self._deliver(await self._events_after(self.applied_seq))  # Published while we were away
+                except Exception:
+                    pass
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        for conn in (self._sub, self._conn):
+            if conn is not None:
+                conn.close()
+
+    async def _snapshot(self) -> dict:
+        async with self._conn_lock:
+            replies = await self._execute(
+                ("SET", self.seq_key, first_seq(), "NX"),  # Where a fresh log starts, agreed on by every worker
+                ("MULTI",), ("GET", self.armed_key), ("GET", self.seq_key),
+                ("LRANGE", self.history_key, 0, -1), ("LRANGE", self.log_key, 0, -1), ("EXEC",)
+            )
+        armed, seq, history, log = replies[-1]
+        return {
+            "armed": armed == b"1",
+            "seq": int(seq),
+            "history": [json.loads(clip) for clip in history],
+            "events": [json.loads(event) for event in log],
+        }
+
+    async def _events_after(self, seq: int) -> List[dict]:
+        async with self._conn_lock:
+            log, = await self._execute(("LRANGE", self.log_key, 0, -1))
+        return [event for event in map(json.loads, log) if event["seq"] > seq]
+
+    async def get_armed(self) -> bool:
+        async with self._conn_lock:
+            armed, = await self._execute(("GET", self.armed_key))
+        return armed == b"1"
+
+    async def trim(self, keep_from_seq: int):
+        async with self._conn_lock:
+            while True:
+                _, history = await self._execute(("WATCH", self.history_key), ("LRANGE", self.history_key, 0, -1))
+                stale = sum(1 for clip in history if json.loads(clip)["seq"] < keep_from_seq)
+                if not stale:
+                    await self._execute(("UNWATCH",))
+                    return
+                replies = await self._execute(("MULTI",), ("LTRIM", self.history_key, stale, -1), ("EXEC",))
+                if replies[-1] is not None:
+                    return
+
+    async def _commit(self, plan: Callable[[bool, int, int], Optional[tuple]]) -> Optional[List[dict]]:
+        """
+        `plan(armed, seq, clip_seq)` returns (events, extra writes) or None to abort.
+        The events are appended to the log and published once the transaction commits.
+        """
+        async with self._conn_lock:
+            while True:
+                _, (armed, seq, clip_seq) = await self._execute(
+                    ("WATCH", self.armed_key, self.seq_key, self.clip_seq_key),
+                    ("MGET", self.armed_key, self.seq_key, self.clip_seq_key)
+                )
+                planned = plan(armed == b"1", int(seq), int(clip_seq or 0))
+                if planned is None:
+                    await self._execute(("UNWATCH",))
+                    return None
+                events, writes = planned
+                replies = await self._execute(
+                    ("MULTI",), *writes,
+                    ("SET", self.seq_key, events[-1]["seq"]),
+                    ("RPUSH", self.log_key, *(json.dumps(event) for event in events)),
+                    ("LTRIM", self.log_key, -self.log_size, -1),
+                    ("EXEC",)
+                )
+                if replies[-1] is not None:  # None: a watched key changed, try again
+                    break
+            await self._execute(("PUBLISH", self.channel, json.dumps(events)))
+        return events
+
+    async def _commit_arm(self, armed: bool) -> List[dict]:
+        def plan(_, seq, __):
+            return [arm_event(armed, seq + 1)], [("SET", self.armed_key, int(armed))]
+        return await self._commit(plan)
+
+    async def _commit_clips(self, clips: List[dict], origin: Optional[str] = None) -> Optional[List[dict]]:
+        def plan(armed, seq, clip_seq):
+            if not armed:
+                return None
+            events = clip_events(clips, clip_seq + 1, seq, origin)
+            return events, [
+                ("SET", self.armed_key, 0),
+                ("SET", self.clip_seq_key, clip_seq + len(clips)),
+                ("RPUSH", self.history_key, *(json.dumps(clip) for clip in event_clips(events[0]))),
+                ("LTRIM", self.history_key, -self.history_limit, -1),
+            ]
+        return await self._commit(plan)
+
+
+BACKENDS = ("memory", "local", "redis")
+
+
+def get_backend(db_path: str, history_limit: int, log_size: int, name: Optional[str] = None,
+                prefix: str = "crossclip") -> StateBackend:
+    """`db_path` is used by the memory and local backends, `prefix` namespaces the Redis keys."""
+    name = name or os.getenv("STATE_BACKEND", "memory")
+    if name == "memory":
+        return MemoryBackend(db_path, history_limit, log_size)
+    if name == "local":
+        return LocalBackend(db_path, history_limit, log_size)
+    if name == "redis":
+        return RedisBackend(os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"), history_limit, log_size, prefix)
+    raise ValueError(f"Unknown state backend '{name}' (choose from {', '.join(BACKENDS)})")
@@ -0,0 +1,107 @@
+"""
+Disk I/O for uploads/ off the event loop.
+
+Writes, fsyncs, reads and deletes run in a bounded thread pool, so a slow disk delays
+only the upload that is waiting on it, never unrelated requests or WebSocket fan-out.
+Deletions of evicted blobs are write-behind: release() only updates the refcount and
+queues the unlink for a background collector.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Iterable, Optional, Tuple
+
+from blob_store import BlobStore, PartialBlob
+
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "4"))
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "1") != "0"  # 0 trades crash safety for upload latency
+
+
+class Storage:
+    def __init__(self, blobs: BlobStore, workers: int = STORAGE_WORKERS, fsync: bool = STORAGE_FSYNC):
+        self.blobs = blobs
+        self.fsync = fsync
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storage")
+        self._garbage: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+
+    # --- LIFECYCLE ---
+    def start(self):
+        self._garbage = asyncio.Queue()
+        self._collector = asyncio.create_task(self._collect())
+
+    async def close(self):
+        if self._collector is not None:
+            await self.flush()
+            self._collector.cancel()
+            self._collector = None
+        self._pool.shutdown(wait=True)
+
+    async def flush(self):
+        """Wait until every queued deletion has been carried out."""
+        if self._garbage is not None:
+            await self._garbage.join()
+
+    @property
+    def pending(self) -> int:
+        return self._garbage.qsize() if self._garbage is not None else 0
+
+    # --- POOLED CALLS ---
+    async def run(self, fn: Callable, *args):
+        """Run a blocking file operation on the storage pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def defer(self, fn: Callable, *args):
+        """Queue a file operation nobody waits for (cleanup); runs inline before start()."""
+        if self._garbage is None:
+            fn(*args)
+        else:
+            self._garbage.put_nowait((fn, args))
+
+    async def save_stream(self, src: BinaryIO, ext: str, max_bytes: Optional[int] = None) -> Tuple[str, str, int]:
+        """Store `src` and take a reference. Returns once the blob is durable: (filename, sha256, size)."""
+        name, digest, size = await self.run(self.blobs.write_stream, src, ext, max_bytes, self.fsync)
+        self.blobs.claim(name)  # On the loop, like every other refcount change
+        return name, digest, size
+
+    async def create_partial(self, size: int, ext: str) -> PartialBlob:
+        return await self.run(PartialBlob, self.blobs, size, ext)
+
+    async def write_at(self, partial: PartialBlob, offset: int, data: bytes):
+        await self.run(partial.write_at, offset, data)
+
+    async def commit(self, partial: PartialBlob) -> Tuple[str, str]:
+        name, digest = await self.run(partial.finish, self.fsync)
+        self.blobs.claim(name)
+        return name, digest
+
+    async def read_if_smaller(self, name: str, limit: int) -> Optional[bytes]:
+        """The blob's bytes if it is at most `limit` bytes, else None."""
+        return await self.run(_read_if_smaller, self.blobs.path(name), limit)
+
+    async def discard(self, name: str, filenames: Iterable[str]):
+        """Delete files belonging to blob `name`, unless the blob is (again) in use."""
+        await self.run(self.blobs.delete_unreferenced, name, list(filenames))
+
+    def release(self, name: str):
+        """Drop one reference; the files of an unreferenced blob are deleted in the background."""
+        doomed = self.blobs.drop(name)
+        if doomed:
+            self.defer(self.blobs.delete_unreferenced, name, doomed)
+
+    async def _collect(self):
+        while True:
+            fn, args = await self._garbage.get()
+            try:
+                await self.run(fn, *args)
+            except Exception as e:
+                print(f"⚠️ Storage cleanup failed: {e}")
+            finally:
+                self._garbage.task_done()
+
+
+def _read_if_smaller(path: str, limit: int) -> Optional[bytes]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > limit:
+            return None
+        return f.read()
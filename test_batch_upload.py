@@ -0,0 +1,66 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def batch(server, monkeypatch):
+    main, client = server
+
+    async def no_variants(filename):
+        pass
+
+    monkeypatch.setattr(main, "render_image_variants", no_variants)
+    client.post("/arm")
+    return main, client
+
+
+def test_batch_keeps_request_order_and_takes_one_arm(batch):
+    main, client = batch
+    parts = [("content", (None, "first")), ("file", ("a.png", b"\x89PNG a", "image/png")), ("content", (None, "last"))]
+    res = client.post("/upload/batch", files=parts)
+    assert res.status_code == 200
+    items = res.json()["items"]
+    assert [item["type"] for item in items] == ["text", "image", "text"]
+    assert items[0]["content"] == "first" and items[2]["content"] == "last"
+    assert [item["seq"] for item in items] == sorted(item["seq"] for item in items)
+    assert [item["id"] for item in client.get("/history").json()["items"]] == [item["id"] for item in items]
+
+    assert client.get("/status").json()["armed"] is False  # One arm for the whole batch
+    assert client.post("/upload/batch", files=[("content", (None, "again"))]).status_code == 403
+
+
+def test_batch_shares_identical_images(batch):
+    main, client = batch
+    same = ("file", ("a.png", b"\x89PNG same", "image/png"))
+    first, second = client.post("/upload/batch", files=[same, same]).json()["items"]
+    assert first["content"] == second["content"] and first["id"] != second["id"]
+    assert main.blobs.refcounts[first["content"]] == 2  # One file, one reference per clip
+
+
+def test_batch_over_the_limit_is_refused(batch, monkeypatch):
+    main, client = batch
+    monkeypatch.setattr(main, "UPLOAD_BATCH_MAX", 2)
+    parts = [("file", ("a.png", b"\x89PNG a", "image/png")), ("file", ("b.png", b"\x89PNG b", "image/png")),
+             ("content", (None, "one too many"))]
+    res = client.post("/upload/batch", files=parts)
+    assert res.status_code == 413
+    assert client.get("/history").json()["items"] == []
+    assert client.get("/status").json()["armed"] is True  # Nothing was published
+
+
+def test_failed_batch_releases_what_it_stored(batch, monkeypatch):
+    main, client = batch
+
+    async def full_disk(content):
+        raise HTTPException(status_code=507, detail="disk full")
+
+    monkeypatch.setattr(main, "text_clip", full_disk)
+    parts = [("file", ("a.png", b"\x89PNG stored first", "image/png")), ("content", (None, "fails"))]
+    assert client.post("/upload/batch", files=parts).status_code == 507
+
+    client.portal.call(main.storage.flush)  # Deletes are write-behind
+    assert main.blobs.refcounts == {}
+    assert not [name for name in os.listdir(main.UPLOAD_DIR) if name.endswith(".png")]
+    assert client.get("/status").json()["armed"] is True
@@ -0,0 +1,87 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from blob_store import LOCK_FILE, BlobStore, BlobTooLarge, PartialBlob
+
+
+def store_bytes(store, data, ext):
+    """What Storage.save_stream does, minus the thread pool: (blob filename, sha256 hex)."""
+    name, digest, _ = store.write_stream(io.BytesIO(data), ext)
+    store.claim(name)
+    return name, digest
+
+
+def release(store, name):
+    doomed = store.drop(name)
+    if doomed:
+        store.delete_unreferenced(name, doomed)
+
+
+def test_identical_uploads_share_one_file(tmp_path):
+    store = BlobStore(str(tmp_path))
+    name1, digest1 = store_bytes(store, b"same screenshot", "PNG")
+    name2, digest2 = store_bytes(store, b"same screenshot", "png")
+
+    assert name1 == name2 == f"{digest1}.png"
+    assert digest1 == digest2
+    assert store.refcounts[name1] == 2
+    assert [f for f in os.listdir(tmp_path) if f != LOCK_FILE] == [name1]
+
+
+def test_blob_removed_with_last_reference(tmp_path):
+    store = BlobStore(str(tmp_path))
+    name, _ = store_bytes(store, b"abc", "png")
+    store.incref(name)
+
+    release(store, name)
+    assert os.path.exists(store.path(name))
+    release(store, name)
+    assert not os.path.exists(store.path(name))
+
+
+def test_blob_another_process_just_stored_is_kept(tmp_path, monkeypatch):
+    worker1, worker2 = BlobStore(str(tmp_path)), BlobStore(str(tmp_path))  # Two processes sharing uploads/
+    name, _ = store_bytes(worker1, b"screenshot", "png")
+    doomed = worker1.drop(name)
+    store_bytes(worker2, b"screenshot", "png")  # Its clip hasn't reached worker1 yet
+
+    worker1.delete_unreferenced(name, doomed)
+    assert os.path.exists(worker1.path(name))
+
+    monkeypatch.setattr("blob_store.PLACE_GRACE", 0)  # Long after: nobody stored it again
+    worker1.delete_unreferenced(name, doomed)
+    assert not os.path.exists(worker1.path(name))
+
+
+def test_extension_cannot_escape_root(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    name, _ = store_bytes(store, b"x", "png/../../evil")
+    assert os.path.dirname(store.path(name)) == store.root
+    assert name.endswith(".pngevil")
+
+
+def test_partial_blob_accepts_out_of_order_chunks(tmp_path):
+    store = BlobStore(str(tmp_path))
+    payload = bytes(range(256)) * 40
+    partial = PartialBlob(store, len(payload), "png")
+
+    partial.write_at(4000, payload[4000:])
+    assert partial.missing() == [[0, 4000]]
+    partial.write_at(0, payload[:4000])
+    assert partial.complete
+
+    name, digest = partial.finish()
+    store.claim(name)
+    assert digest == hashlib.sha256(payload).hexdigest()
+    with open(store.path(name), "rb") as f:
+        assert f.read() == payload
+    assert not os.path.exists(partial.path)
+
+
+def test_partial_blob_rejects_bytes_past_declared_size(tmp_path):
+    partial = PartialBlob(BlobStore(str(tmp_path)), 10, "png")
+    with pytest.raises(BlobTooLarge):
+        partial.write_at(8, b"abc")
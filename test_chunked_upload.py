@@ -0,0 +1,38 @@
+import hashlib
+
+import pytest
+
+
+@pytest.mark.channels("work:work-key")
+def test_chunked_upload_endpoints(server, monkeypatch):
+    main, client = server
+
+    async def no_variants(filename):
+        pass
+
+    monkeypatch.setattr(main, "render_image_variants", no_variants)
+    data = bytes(range(256)) * 40
+    client.post("/arm")
+    status = client.post("/upload/chunked", json={"size": len(data), "filename": "big.png"}).json()
+    url = f"/upload/chunked/{status['upload_id']}"
+
+    # Chunks in any order; the session reports what is still missing
+    assert client.put(f"{url}?offset=6000", content=data[6000:]).json()["missing"] == [[0, 6000]]
+    assert client.put(f"{url}?offset=0", content=data[:2000]).json()["missing"] == [[2000, 6000]]
+    assert client.get(url).json()["received_bytes"] == len(data) - 4000
+
+    res = client.post(f"{url}/finalize")
+    assert res.status_code == 409 and res.json()["detail"]["missing"] == [[2000, 6000]]
+    assert client.get(url, headers={"x-api-key": "work-key"}).status_code == 404  # Another channel's session
+    assert client.put(f"{url}?offset={len(data) - 10}", content=b"x" * 20).status_code == 413  # Past the declared size
+
+    client.put(f"{url}?offset=2000", content=data[2000:6000])
+    item = client.post(f"{url}/finalize").json()["item"]
+    assert item["sha256"] == hashlib.sha256(data).hexdigest() and item["size"] == len(data)
+    assert client.get(f"/uploads/{item['content']}").content == data
+    assert client.get(url).status_code == 404  # Finalized sessions are gone
+
+    client.post("/arm")
+    aborted = f"/upload/chunked/{client.post('/upload/chunked', json={'size': 10}).json()['upload_id']}"
+    assert client.delete(aborted).status_code == 200
+    assert client.get(aborted).status_code == 404
@@ -0,0 +1,68 @@
+import functools
+import hashlib
+import importlib
+import sys
+import threading
+
+import pytest
+
+from text_delta import make_delta
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A fresh client module on the in-memory clipboard; the monitor loop itself is never started."""
+    monkeypatch.setenv("API_SECRET", "test")
+    monkeypatch.setenv("CLIPBOARD_BACKEND", "memory")
+    return importlib.reload(sys.modules["client"]) if "client" in sys.modules else importlib.import_module("client")
+
+
+def copy(client, text):
+    """Put `text` on the clipboard and run one monitor tick, as monitor_loop does."""
+    client.clipboard.write_text(text)
+    raw = client.monitor.poll_raw()
+    assert raw is not None
+    client.uploader.submit(functools.partial(client.upload_change, raw))
+
+
+def test_copy_during_slow_upload_is_uploaded(client, monkeypatch):
+    uploaded, started, release = [], threading.Event(), threading.Event()
+
+    def slow_upload(opts):
+        started.set()
+        release.wait(3)  # A slow network
+        uploaded.append(opts["content"])
+        return {"seq": len(uploaded)}
+
+    monkeypatch.setattr(client, "upload", slow_upload)
+    client.clipboard.write_text("already there")
+    client.monitor.poll()  # The monitor's starting point
+
+    copy(client, "first copy")
+    assert started.wait(3)
+    copy(client, "second copy")  # Queued behind the running upload
+    assert client.monitor.poll_raw() is None  # An idle tick before the upload finishes changes nothing
+    release.set()
+
+    assert client.uploader.wait_idle(3)
+    assert uploaded == ["first copy", "second copy"]
+
+
+def test_next_delta_builds_on_our_own_upload(client, monkeypatch):
+    ours = "".join(f"line {n}\n" for n in range(200))
+    theirs = ours + "one more line\n"
+    monkeypatch.setattr(client, "upload", lambda opts: {"seq": 1})
+    client.clipboard.write_text(ours)
+    client.upload_change(client.monitor.poll_raw())
+
+    def no_fetch(*args, **kwargs):
+        raise AssertionError("fell back to GET /clip")
+
+    monkeypatch.setattr(client.http, "get", no_fetch)
+    # What the server sends another device's edit as: a delta against the text we uploaded
+    msg = {
+        "event": "new_clip",
+        "data": {"id": "c2", "type": "text", "content": "", "sha256": hashlib.sha256(theirs.encode()).hexdigest()},
+        "delta": {"base": hashlib.sha256(ours.encode()).hexdigest(), "ops": make_delta(ours, theirs)},
+    }
+    assert client.expand_clip(msg)["content"] == theirs
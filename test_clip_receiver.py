@@ -0,0 +1,51 @@
+import threading
+import time
+
+from clip_receiver import ClipReceiver, clip_sha256
+
+
+def test_burst_applies_only_the_newest_clip():
+    receiver = ClipReceiver()
+    applied, running, release = [], threading.Event(), threading.Event()
+
+    def job(n):
+        def apply():
+            if n == 0:
+                running.set()
+                release.wait(2)  # A slow download / clipboard write
+            applied.append(n)
+        return apply
+
+    receiver.submit(job(0))
+    assert running.wait(2)
+    started = time.monotonic()
+    for n in range(1, 10):
+        receiver.submit(job(n))
+    assert time.monotonic() - started < 0.1  # The socket thread never waits
+    release.set()
+    assert receiver.wait_idle(2)
+    assert applied == [0, 9]
+    assert receiver.coalesced == 8
+
+
+def test_running_job_sees_it_was_superseded():
+    receiver = ClipReceiver()
+    seen, running, go = [], threading.Event(), threading.Event()
+
+    def first():
+        running.set()
+        go.wait(2)
+        seen.append(receiver.superseded())
+
+    receiver.submit(first)
+    assert running.wait(2)
+    receiver.submit(lambda: seen.append("second"))
+    go.set()
+    assert receiver.wait_idle(2)
+    assert seen == [True, "second"]
+
+
+def test_echo_hash_matches_the_server():
+    # Text hashes as UTF-8, images as their bytes, like the server's `sha256`
+    assert clip_sha256({"type": "text", "content": "abc"}) == clip_sha256({"type": "image", "content": b"abc"}) == \
+        "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
@@ -0,0 +1,91 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from clipboard_backend import ClipboardMonitor, MemoryClipboard, encode_image
+
+
+class CountingClipboard(MemoryClipboard):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def read_raw(self):
+        self.reads += 1
+        return super().read_raw()
+
+
+def test_monitor_skips_unchanged_counter_and_content():
+    clipboard = CountingClipboard()
+    clipboard.write_text("hello")
+    monitor = ClipboardMonitor(clipboard)
+
+    assert monitor.poll() == {"type": "text", "content": "hello"}
+    assert monitor.poll() is None
+    assert clipboard.reads == 1  # Counter unchanged: no read at all
+
+    clipboard.write_text("hello")  # Rewritten with identical content
+    assert monitor.poll() is None
+
+    clipboard.write_text("world")
+    assert monitor.poll()["content"] == "world"
+
+
+def test_sync_marks_our_own_write_as_seen():
+    clipboard = MemoryClipboard()
+    monitor = ClipboardMonitor(clipboard)
+    clipboard.write_text("a")
+    monitor.poll()
+
+    clipboard.write_image(b"\x89PNG from server")
+    monitor.sync()
+    assert monitor.poll() is None
+
+
+def test_memory_backend_pushes_change_notifications():
+    clipboard = MemoryClipboard()
+    monitor = ClipboardMonitor(clipboard)
+    assert monitor.wait(0.01) is False
+
+    clipboard.write_text("copied")
+    assert monitor.wait(5) is True
+
+
+def make_image(size=(64, 48), fmt="PNG") -> bytes:
+    im = Image.new("RGB", size, "#0f172a")
+    ImageDraw.Draw(im).text((4, 4), "CrossBoard", fill="white")
+    with io.BytesIO() as out:
+        im.save(out, format=fmt)
+        return out.getvalue()
+
+
+def test_encode_image_formats():
+    png = make_image()
+    assert encode_image(png, "png", target="png") == (png, "png")  # Nothing to do: sent as is
+
+    dib = make_image(fmt="BMP")[14:]
+    data, ext = encode_image(dib, "dib", target="png")
+    assert ext == "png" and Image.open(io.BytesIO(data)).size == (64, 48)
+
+    data, ext = encode_image(png, "png", target="webp")
+    assert ext == "webp" and Image.open(io.BytesIO(data)).format == "WEBP"
+
+    data, ext = encode_image(png, "png", target="auto")
+    assert len(data) <= len(png)  # Whichever is smaller
+
+
+def test_encode_image_downscales():
+    data, ext = encode_image(make_image((400, 100)), "png", target="png", max_dimension=200)
+    assert Image.open(io.BytesIO(data)).size == (200, 50)
+
+
+def test_is_current_until_the_clipboard_changes():
+    clipboard = MemoryClipboard()
+    monitor = ClipboardMonitor(clipboard)
+    clipboard.write_text("first")
+    raw = monitor.poll_raw()
+    assert monitor.is_current(raw)
+
+    clipboard.write_text("second")  # e.g. an incoming clip, written while "first" was encoding
+    monitor.sync()
+    assert not monitor.is_current(raw)
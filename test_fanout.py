@@ -0,0 +1,202 @@
+import asyncio
+
+from main import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await asyncio.sleep(self.delay)
+        self.received.append(message)
+
+    async def send_bytes(self, data):
+        await asyncio.sleep(self.delay)
+        self.received.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_slow_client_does_not_block_others():
+    async def scenario():
+        manager = ConnectionManager(max_queue=2, send_timeout=5, slow_policy="evict")
+        fast, slow = FakeSocket(), FakeSocket(delay=10)
+        await manager.connect(fast)
+        await manager.connect(slow)
+
+        for i in range(5):
+            await manager.broadcast({"event": "tick", "n": i})
+            await asyncio.sleep(0.01)
+
+        assert fast.received[0]["event"] == "resync"
+        assert [m["n"] for m in fast.received[1:]] == [0, 1, 2, 3, 4]
+        assert slow not in manager.active_connections
+        assert slow.closed_with == 1013
+        manager.disconnect(fast)
+
+    asyncio.run(scenario())
+
+
+def test_drop_policy_keeps_newest_events():
+    async def scenario():
+        manager = ConnectionManager(max_queue=2, send_timeout=5, slow_policy="drop")
+        ws = FakeSocket()
+        await manager.connect(ws)
+
+        # Nothing is sent until we yield, so the queue overflows
+        for i in range(4):
+            await manager.broadcast({"event": "tick", "n": i})
+        await asyncio.sleep(0.05)
+
+        assert [m["n"] for m in ws.received[1:]] == [2, 3]
+        assert manager.active_connections[ws].dropped == 2
+        manager.disconnect(ws)
+
+    asyncio.run(scenario())
+
+
+def test_inline_payload_follows_its_event():
+    async def scenario():
+        manager = ConnectionManager(max_queue=4, send_timeout=5, slow_policy="drop")
+        inline, plain = FakeSocket(), FakeSocket()
+        await manager.connect(inline, inline=True)
+        await manager.connect(plain)
+
+        data = {"id": "1", "type": "image", "content": "abc.png", "sha256": "abc"}
+        await manager.broadcast_clip(data, payload=b"PNG", media_type="image/png")
+        await asyncio.sleep(0.05)
+
+        seq = manager.room().event_seq
+        assert inline.received[1:] == [{"event": "new_clip", "data": data, "seq": seq, "inline": {"size": 3, "type": "image/png"}}, b"PNG"]
+        assert plain.received[1:] == [{"event": "new_clip", "data": data, "seq": seq}]
+        manager.disconnect(inline)
+        manager.disconnect(plain)
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_replays_missed_events():
+    async def scenario():
+        manager = ConnectionManager(max_queue=8, send_timeout=5, slow_policy="drop", log_size=3)
+        first = FakeSocket()
+        await manager.connect(first)
+        await asyncio.sleep(0.01)
+        cursor = first.received[0]["seq"]
+        manager.disconnect(first)
+
+        for i in range(3):
+            await manager.broadcast({"event": "tick", "n": i})
+
+        back = FakeSocket()
+        await manager.connect(back, since=cursor)
+        await manager.broadcast({"event": "tick", "n": 3})
+        await asyncio.sleep(0.01)
+        replay = back.received[0]
+        assert replay["event"] == "replay"
+        assert [m["n"] for m in replay["events"]] == [0, 1, 2]
+        assert [m["n"] for m in back.received[1:]] == [3]
+
+        # The cursor has now fallen out of the 3-event log
+        late = FakeSocket()
+        await manager.connect(late, since=cursor)
+        await asyncio.sleep(0.01)
+        assert late.received[0] == {"event": "resync", "seq": manager.room().event_seq}
+        manager.disconnect(back)
+        manager.disconnect(late)
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_stays_in_its_room():
+    async def scenario():
+        manager = ConnectionManager(max_queue=4, send_timeout=5, slow_policy="drop")
+        home, work = FakeSocket(), FakeSocket()
+        await manager.connect(home, room="home")
+        await manager.connect(work, room="work")
+
+        await manager.broadcast({"event": "tick", "n": 1}, room="home")
+        await asyncio.sleep(0.01)
+
+        assert [m.get("n") for m in home.received[1:]] == [1]
+        assert work.received[1:] == []
+        assert not manager.room("work").event_log  # Each room numbers and logs its own events
+        manager.disconnect(home)
+        manager.disconnect(work)
+        assert not manager.room("home").connections
+
+    asyncio.run(scenario())
+
+
+def test_clip_is_not_echoed_to_its_origin():
+    async def scenario():
+        manager = ConnectionManager(max_queue=4, send_timeout=5, slow_policy="drop")
+        phone, laptop, browser = FakeSocket(), FakeSocket(), FakeSocket()
+        await manager.connect(phone, device="phone")
+        await manager.connect(laptop, device="laptop")
+        await manager.connect(browser)
+
+        clip = {"id": "c1", "type": "text", "content": "hi", "sha256": "abc"}
+        await manager.broadcast_clip(clip, origin="phone")
+        await asyncio.sleep(0.01)
+
+        assert phone.received[1:] == []
+        assert [m["data"]["id"] for m in laptop.received[1:]] == ["c1"]
+        assert [m["data"]["id"] for m in browser.received[1:]] == ["c1"]
+        assert manager.active_connections[phone].last_text_sha == "abc"  # It holds what it sent
+        assert manager.room().event_log[-1]["data"]["id"] == "c1"  # Still logged for replay
+        for ws in (phone, laptop, browser):
+            manager.disconnect(ws)
+
+    asyncio.run(scenario())
+
+
+def test_batch_is_one_event():
+    async def scenario():
+        manager = ConnectionManager(max_queue=4, send_timeout=5, slow_policy="drop")
+        phone, laptop = FakeSocket(), FakeSocket()
+        await manager.connect(phone, device="phone")
+        await manager.connect(laptop, device="laptop")
+
+        clips = [{"id": f"c{i}", "type": "text", "content": str(i), "sha256": f"sha{i}"} for i in range(3)]
+        await manager.broadcast_clips(clips, origin="phone")
+        await asyncio.sleep(0.01)
+
+        assert phone.received[1:] == []
+        assert [[c["id"] for c in m["data"]] for m in laptop.received[1:]] == [["c0", "c1", "c2"]]
+        for ws in (phone, laptop):
+            assert manager.active_connections[ws].last_text_sha == "sha2"  # Deltas continue from the newest
+
+        # A reconnecting device is replayed the batch as it was sent
+        tablet = FakeSocket()
+        await manager.connect(tablet, since=manager.room().event_seq - 1)
+        assert manager.active_connections[tablet].last_text_sha == "sha2"
+        for ws in (phone, laptop, tablet):
+            manager.disconnect(ws)
+
+    asyncio.run(scenario())
+
+
+def test_drop_policy_keeps_responses():
+    async def scenario():
+        manager = ConnectionManager(max_queue=2, send_timeout=5, slow_policy="drop")
+        ws = FakeSocket()
+        await manager.connect(ws)
+
+        await manager.broadcast({"event": "tick", "n": 0})
+        await manager.send(ws, {"event": "response", "id": "r1"})
+        for i in range(1, 4):
+            await manager.broadcast({"event": "tick", "n": i})
+        await asyncio.sleep(0.05)
+
+        assert [m.get("n", m.get("id")) for m in ws.received[1:]] == ["r1", 3]
+        assert manager.active_connections[ws].dropped == 3
+        manager.disconnect(ws)
+
+    asyncio.run(scenario())
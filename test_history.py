@@ -0,0 +1,88 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from history import ClipHistory
+from search_index import SearchIndex
+
+
+def clip(n):
+    return SimpleNamespace(id=f"clip-{n}", seq=0)
+
+
+def test_ring_evicts_oldest_and_keeps_index():
+    history = ClipHistory(capacity=3)
+    evicted = [history.push(clip(n)) for n in range(5)]
+
+    assert [e.id for e in evicted if e] == ["clip-0", "clip-1"]
+    assert len(history) == 3
+    assert history.get("clip-1") is None
+    assert history.get("clip-3").seq == 4
+    assert history.latest().id == "clip-4"
+    assert (history.oldest_seq, history.last_seq) == (3, 5)
+
+
+def test_after_pages_from_cursor():
+    history = ClipHistory(capacity=10)
+    for n in range(25):
+        history.push(clip(n))
+
+    # Cursor older than the ring: start at the oldest retained item
+    assert [c.seq for c in history.after(0, 4)] == [16, 17, 18, 19]
+    assert [c.seq for c in history.after(23, 50)] == [24, 25]
+    assert history.after(25, 10) == []
+
+
+def sized(n, kind, size, timestamp="2026-10-17T10:00:00"):
+    return SimpleNamespace(id=f"clip-{n}", seq=0, type=kind, size=size, timestamp=timestamp)
+
+
+def test_byte_budget_evicts_oldest_until_it_fits():
+    history = ClipHistory(capacity=10, budgets={"image": 100})
+    for n in range(3):
+        history.push(sized(n, "image", 30))
+    history.push(sized(3, "text", 10_000))  # Text has no budget here
+    assert history.evict_over_budget() == []
+
+    history.push(sized(4, "image", 90))
+    evicted = history.evict_over_budget()
+    assert [e.id for e in evicted] == ["clip-0", "clip-1", "clip-2"]
+    assert history.used["image"] == 90
+    assert history.oldest_seq == 4
+    assert [c.id for c in history.after(0, 10)] == ["clip-3", "clip-4"]
+
+    history.push(sized(5, "image", 500))  # Bigger than the whole budget: the newest clip still stays
+    history.evict_over_budget()
+    assert [c.id for c in history.after(0, 10)] == ["clip-5"]
+
+
+def test_expire_drops_only_the_old_end():
+    history = ClipHistory(capacity=10)
+    for n, hour in enumerate((8, 9, 11)):
+        history.push(sized(n, "text", 1, f"2026-10-17T{hour:02}:00:00"))
+
+    evicted = history.expire(datetime(2026, 10, 17, 10))
+    assert [e.id for e in evicted] == ["clip-0", "clip-1"]
+    assert history.latest().id == "clip-2"
+    assert history.expire(datetime(2026, 10, 17, 10)) == []
+    assert len(history.expire(datetime(2026, 10, 18))) == 1
+    assert len(history) == 0 and history.oldest_seq == 4
+
+
+def test_search_index_follows_the_history():
+    index = SearchIndex()
+    history = ClipHistory(capacity=3, index=index)
+    texts = ["Deploy key for staging", "lunch order", "STAGING password", "deploy notes"]
+    for n, text in enumerate(texts):
+        history.push(SimpleNamespace(id=f"clip-{n}", seq=0, type="text", content=text))
+    history.push(SimpleNamespace(id="image", seq=0, type="image", content="deploy.png"))  # Not indexed
+
+    seqs = lambda query: index.search(query, 10)
+    assert seqs("staging") == [3]  # "Deploy key for staging" fell out of the ring
+    assert seqs("deploy") == [4]
+    assert seqs("Staging password") == [3]
+    assert seqs("lunch password") == []
+    assert seqs("  ") == []
+
+    history.pop_oldest()
+    assert seqs("staging") == []
+    assert len(index) == 1
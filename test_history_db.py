@@ -0,0 +1,22 @@
+from history_db import HistoryDB
+
+
+def row(seq, kind="text"):
+    return {"seq": seq, "id": f"clip-{seq}", "type": kind, "content": f"content {seq}", "timestamp": "2026-10-17T10:00:00", "sha256": None}
+
+
+def test_history_survives_reopen(tmp_path):
+    path = str(tmp_path / "history.db")
+    db = HistoryDB(path)
+    for seq in range(1, 6):
+        db.insert(row(seq))
+    db.close()
+
+    db = HistoryDB(path)
+    assert [r["seq"] for r in db.load_recent(3)] == [3, 4, 5]
+    db.trim(4)
+    db.close()
+
+    db = HistoryDB(path)
+    assert [r["id"] for r in db.load_recent(10)] == ["clip-4", "clip-5"]
+    db.close()
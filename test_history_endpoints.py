@@ -0,0 +1,55 @@
+import pytest
+
+
+def put_texts(client, *texts, key="test"):
+    client.post("/arm", headers={"x-api-key": key})
+    res = client.post("/upload/batch", files=[("content", (None, text)) for text in texts], headers={"x-api-key": key})
+    assert res.status_code == 200
+    return res.json()["items"]
+
+
+def test_history_pages_oldest_first(server):
+    main, client = server
+    items = put_texts(client, "a", "b", "c", "d", "e")
+    seqs = [item["seq"] for item in items]
+
+    page = client.get("/history", params={"after": 0, "limit": 2}).json()
+    assert [item["content"] for item in page["items"]] == ["a", "b"]
+    assert page["oldest_seq"] == seqs[0] and page["last_seq"] == seqs[-1]
+
+    page = client.get("/history", params={"after": page["items"][-1]["seq"], "limit": 2}).json()
+    assert [item["content"] for item in page["items"]] == ["c", "d"]
+    assert client.get("/history", params={"after": seqs[-1]}).json()["items"] == []
+
+    # limit is clamped to [1, HISTORY_PAGE_MAX]
+    assert len(client.get("/history", params={"limit": 0}).json()["items"]) == 1
+    assert len(client.get("/history", params={"limit": 10 ** 6}).json()["items"]) == 5
+
+
+@pytest.fixture
+def short_history(monkeypatch):
+    monkeypatch.setenv("HISTORY_LIMIT", "2")
+
+
+def test_evicted_clip_is_gone(short_history, server):
+    main, client = server
+    first, second, third = put_texts(client, "one", "two", "three")
+
+    assert client.get(f"/clip/{first['id']}").status_code == 404
+    assert client.get(f"/clip/{third['id']}").json()["content"] == "three"
+    page = client.get("/history").json()
+    assert [item["id"] for item in page["items"]] == [second["id"], third["id"]]
+    assert page["oldest_seq"] == second["seq"]
+
+
+@pytest.mark.channels("work:work-key")
+def test_channels_do_not_see_each_other(server):
+    main, client = server
+    personal, = put_texts(client, "personal")
+    work, = put_texts(client, "work", key="work-key")
+
+    assert client.get(f"/clip/{work['id']}").status_code == 404
+    assert client.get(f"/clip/{personal['id']}", headers={"x-api-key": "work-key"}).status_code == 404
+    assert [item["content"] for item in client.get("/history").json()["items"]] == ["personal"]
+    work_page = client.get("/history", headers={"x-api-key": "work-key"}).json()
+    assert [item["content"] for item in work_page["items"]] == ["work"]
@@ -0,0 +1,47 @@
+import io
+
+from PIL import Image
+from starlette.requests import Request
+
+import image_variants
+
+from main import etag_matches
+
+
+def request_with(if_none_match):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etag_matching():
+    assert etag_matches(request_with('"abc"'), '"abc"')
+    assert etag_matches(request_with('"x", W/"abc"'), '"abc"')
+    assert etag_matches(request_with('"abc"'), 'W/"abc"')
+    assert etag_matches(request_with("*"), '"abc"')
+    assert not etag_matches(request_with('"abcd"'), '"abc"')
+    assert not etag_matches(request_with(None), '"abc"')
+
+
+def test_stand_in_for_a_rendering_variant_is_not_immutable(server, monkeypatch):
+    main, client = server
+
+    async def not_yet(filename):
+        pass
+
+    monkeypatch.setattr(main, "render_image_variants", not_yet)  # Variants still rendering
+    im = Image.new("RGB", (1600, 1200), "teal")
+    with io.BytesIO() as out:
+        im.save(out, format="PNG")
+        png = out.getvalue()
+    client.post("/arm")
+    name = client.post("/upload", data={"type": "image"}, files={"file": ("photo.png", png, "image/png")}).json()["item"]["content"]
+
+    thumb = client.get(f"/uploads/{name}?variant=thumb")
+    assert thumb.content == png and thumb.headers["cache-control"] == "no-cache"  # The original, standing in
+    assert client.get(f"/uploads/{name}", headers={"Accept": "image/webp"}).headers["cache-control"] == "no-cache"
+    assert "immutable" in client.get(f"/uploads/{name}", headers={"Accept": "image/png"}).headers["cache-control"]
+
+    main.blobs.variants[name] = image_variants.render_variants(main.blobs.path(name))
+    thumb = client.get(f"/uploads/{name}?variant=thumb")
+    assert thumb.content != png and "immutable" in thumb.headers["cache-control"]
+    assert "immutable" in client.get(f"/uploads/{name}", headers={"Accept": "image/webp"}).headers["cache-control"]
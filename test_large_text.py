@@ -0,0 +1,41 @@
+import hashlib
+
+
+def test_large_text_is_stored_as_a_file(server):
+    main, client = server
+    text = "".join(f"log line {n}: something happened\n" for n in range(20000))  # ~700 KB
+    client.post("/arm")
+    res = client.post("/upload", data={"content": text, "type": "text"})
+    assert res.status_code == 200
+    item = res.json()["item"]
+    assert item["text_file"] and len(item["content"]) < len(text)
+    assert text.startswith(item["content"])
+    assert item["size"] == len(text.encode()) and item["sha256"] == hashlib.sha256(text.encode()).hexdigest()
+
+    latest = client.get("/latest").json()
+    assert latest["content"] == item["content"]  # Only the preview
+
+    packed = client.get(f"/uploads/{item['text_file']}", headers={"Accept-Encoding": "gzip"})
+    assert packed.headers["content-encoding"] == "gzip"
+    assert int(packed.headers["content-length"]) < len(text) // 10
+    assert packed.text == text  # Unpacked by the client
+    plain = client.get(f"/uploads/{item['text_file']}", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.text == text
+
+
+def test_text_over_a_megabyte_uploads_over_http(server):
+    main, client = server
+    text = "x" * (2 * 1024 * 1024)  # Past Starlette's default 1 MB per form field
+    client.post("/arm")
+    res = client.post("/upload", data={"content": text, "type": "text"})
+    assert res.status_code == 200
+    item = res.json()["item"]
+    assert item["size"] == len(text) and item["text_file"]
+    assert client.get(f"/uploads/{item['text_file']}").text == text
+
+
+def test_small_text_stays_inline(server):
+    main, client = server
+    client.post("/arm")
+    item = client.post("/upload", data={"content": "short note", "type": "text"}).json()["item"]
+    assert item["text_file"] is None and item["content"] == "short note"
@@ -0,0 +1,50 @@
+import pytest
+
+import metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1.0))
+    metrics._registry.remove(h)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        h.observe(value)
+    assert h.samples() == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 3.65",
+        "test_seconds_count 4",
+    ]
+
+
+def test_render_includes_server_metrics():
+    metrics.ARMS.inc()
+    text = metrics.render()
+    assert "# TYPE crossclip_arm_total counter" in text
+    assert "# TYPE crossclip_upload_seconds histogram" in text
+    assert text.endswith("\n")
+
+
+def scrape(client):
+    res = client.get("/metrics")
+    assert res.status_code == 200 and res.headers["content-type"].startswith("text/plain")
+    return dict(line.rsplit(" ", 1) for line in res.text.splitlines() if not line.startswith("#"))
+
+
+@pytest.mark.channels("work:work-key")
+def test_metrics_endpoint_counts_an_upload(server):
+    main, client = server
+    before = scrape(client)
+    client.post("/arm")
+    client.post("/upload", data={"content": "counted", "type": "text"})  # Uses up the arm
+    after = scrape(client)
+
+    def delta(sample):
+        return float(after[sample]) - float(before[sample])
+
+    assert delta("crossclip_arm_total") == 1 and delta("crossclip_disarm_total") == 1
+    assert delta("crossclip_upload_seconds_count") == 1
+    assert delta("crossclip_upload_bytes_count") == 1 and delta("crossclip_upload_bytes_sum") == len("counted")
+    assert after["crossclip_history_items"] == "1"
+    assert after["crossclip_connected_clients"] == "0"
+    assert client.get("/metrics", headers={"x-api-key": "work-key"}).status_code == 403  # Server-wide, default key only
@@ -0,0 +1,45 @@
+import io
+import os
+import time
+from datetime import timedelta
+
+import pytest
+from PIL import Image
+
+import image_variants
+
+
+@pytest.fixture
+def ttl_server(monkeypatch):
+    monkeypatch.setenv("HISTORY_TTL_HOURS", "1")
+    monkeypatch.setenv("RETENTION_SWEEP_SECONDS", "0.05")
+
+
+def test_expired_clips_release_their_files(ttl_server, server, monkeypatch):
+    main, client = server
+
+    async def render_now(filename):
+        main.blobs.variants[filename] = image_variants.render_variants(main.blobs.path(filename))
+
+    monkeypatch.setattr(main, "render_image_variants", render_now)  # In-process, so it's done before we go on
+    with io.BytesIO() as out:
+        Image.new("RGB", (800, 600), "teal").save(out, format="PNG")
+        png = out.getvalue()
+    client.post("/arm")
+    image = client.post("/upload", data={"type": "image"}, files={"file": ("photo.png", png, "image/png")}).json()["item"]
+    client.post("/arm")
+    text = client.post("/upload", data={"content": "spilled " * 20000, "type": "text"}).json()["item"]
+
+    files = [image["content"], *main.blobs.variants[image["content"]].values(), text["text_file"]]
+    assert len(files) == 4 and all(os.path.exists(main.blobs.path(name)) for name in files)
+
+    monkeypatch.setattr(main, "HISTORY_TTL", timedelta(microseconds=1))  # Both clips are now past their age
+    deadline = time.monotonic() + 5
+    while client.get("/history").json()["items"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get("/history").json()["items"] == []
+
+    client.portal.call(main.storage.flush)
+    assert main.blobs.refcounts == {} and main.blobs.variants == {}
+    assert not any(os.path.exists(main.blobs.path(name)) for name in files)
+    assert client.get(f"/clip/{image['id']}").status_code == 404
@@ -0,0 +1,57 @@
+import pytest
+
+
+def put_text(client, text, key="test"):
+    client.post("/arm", headers={"x-api-key": key})
+    res = client.post("/upload", data={"content": text, "type": "text"}, headers={"x-api-key": key})
+    assert res.status_code == 200
+    return res.json()["item"]
+
+
+def found(client, q, key="test", **params):
+    res = client.get("/search", params={"q": q, **params}, headers={"x-api-key": key})
+    assert res.status_code == 200
+    return [item["content"] for item in res.json()]
+
+
+def test_search_is_newest_first_and_limited(server):
+    main, client = server
+    for text in ("apple pie", "apple tart", "banana bread", "Apple crumble"):
+        put_text(client, text)
+
+    assert found(client, "APPLE") == ["Apple crumble", "apple tart", "apple pie"]
+    assert found(client, "apple", limit=2) == ["Apple crumble", "apple tart"]
+    assert found(client, "apple pie") == ["apple pie"]  # Every word must match
+    assert found(client, "cherry") == []
+
+
+def test_empty_query_finds_nothing(server):
+    main, client = server
+    put_text(client, "something")
+    assert found(client, "") == []
+    assert found(client, "  ?! ") == []
+
+
+@pytest.mark.channels("work:work-key")
+def test_search_stays_in_its_channel(server):
+    main, client = server
+    put_text(client, "personal note")
+    put_text(client, "work note", key="work-key")
+
+    assert found(client, "note") == ["personal note"]
+    assert found(client, "note", key="work-key") == ["work note"]
+    assert client.get("/search", params={"q": "note"}, headers={"x-api-key": "wrong"}).status_code == 401
+
+
+@pytest.fixture
+def short_history(monkeypatch):
+    monkeypatch.setenv("HISTORY_LIMIT", "2")
+
+
+def test_evicted_clips_leave_the_index(short_history, server):
+    main, client = server
+    for text in ("first draft", "second draft", "third draft"):
+        put_text(client, text)
+
+    assert found(client, "draft") == ["third draft", "second draft"]
+    assert found(client, "first") == []
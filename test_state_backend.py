@@ -0,0 +1,239 @@
+import asyncio
+
+import pytest
+
+from state_backend import LocalBackend, MemoryBackend, RedisBackend
+
+
+class FakeRedis:
+    """Stand-in Redis server with just the commands RedisBackend uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.versions = {}  # key -> write count, for WATCH
+        self.subscribers = {}  # channel -> writers
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/0"
+
+    async def close(self):
+        self.server.close()
+
+    async def handle(self, reader, writer):
+        watched, queued = {}, None
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    return
+                args = []
+                for _ in range(int(header[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                name = args[0].decode().upper()
+                if name == "MULTI":
+                    queued, reply = [], "OK"
+                elif name == "EXEC":
+                    if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                        reply = NULL_ARRAY
+                    else:
+                        reply = [self.run(*command) for command in queued]
+                    watched, queued = {}, None
+                elif name == "WATCH":
+                    watched.update({key: self.versions.get(key, 0) for key in args[1:]})
+                    reply = "OK"
+                elif name == "UNWATCH":
+                    watched, reply = {}, "OK"
+                elif name == "SUBSCRIBE":
+                    self.subscribers.setdefault(args[1], []).append(writer)
+                    reply = [b"subscribe", args[1], 1]
+                elif queued is not None:
+                    queued.append((name, *args[1:]))
+                    reply = "QUEUED"
+                else:
+                    reply = self.run(name, *args[1:])
+                writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+    def run(self, name, *args):
+        if name in ("AUTH", "SELECT"):
+            return "OK"
+        if name == "GET":
+            return self.data.get(args[0])
+        if name == "MGET":
+            return [self.data.get(key) for key in args]
+        if name == "SET":
+            if b"NX" in args[2:] and args[0] in self.data:
+                return None
+            self.write(args[0], args[1])
+            return "OK"
+        if name == "RPUSH":
+            self.write(args[0], self.data.get(args[0], []) + list(args[1:]))
+            return len(self.data[args[0]])
+        if name in ("LRANGE", "LTRIM"):
+            items = self.data.get(args[0], [])
+            start, stop = int(args[1]), int(args[2])
+            start = max(start + len(items), 0) if start < 0 else start
+            stop = stop + len(items) if stop < 0 else stop
+            if name == "LRANGE":
+                return items[start:stop + 1]
+            self.write(args[0], items[start:stop + 1])
+            return "OK"
+        if name == "PUBLISH":
+            for writer in self.subscribers.get(args[0], []):
+                writer.write(encode([b"message", args[0], args[1]]))
+            return len(self.subscribers.get(args[0], []))
+        raise ValueError(name)
+
+    def write(self, key, value):
+        self.data[key] = value if isinstance(value, list) else str(value.decode() if isinstance(value, bytes) else value).encode()
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+
+NULL_ARRAY = object()
+
+
+def encode(reply) -> bytes:
+    if reply is NULL_ARRAY:
+        return b"*-1\r\n"
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+def clip(clip_id):
+    return {"id": clip_id, "type": "text", "content": clip_id, "timestamp": "2026-10-17T10:00:00", "sha256": None, "seq": 0}
+
+
+async def eventually(check, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not check():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def worker_factory(kind, tmp_path):
+    if kind == "local":
+        return lambda: LocalBackend(str(tmp_path / "state.db"), history_limit=3, log_size=64), None
+    server = FakeRedis()
+    await server.start()
+    return lambda: RedisBackend(server.url, history_limit=3, log_size=64), server
+
+
+def recorder(seen):
+    async def on_event(event):
+        seen.append(event)
+    return on_event
+
+
+@pytest.mark.parametrize("kind", ["local", "redis"])
+def test_workers_share_arm_state_and_history(kind, tmp_path):
+    async def scenario():
+        make, server = await worker_factory(kind, tmp_path)
+        seen_a, seen_b = [], []
+        a, b = make(), make()
+        await a.start(recorder(seen_a))
+        await b.start(recorder(seen_b))
+
+        await a.set_armed(True)
+        assert await b.get_armed()
+        first = await b.publish_clip(clip("one"))
+        assert first["data"]["seq"] == 1
+        assert await a.publish_clip(clip("two")) is None  # The arm was used up on the other worker
+
+        await eventually(lambda: len(seen_a) == 3)
+        assert [e["event"] for e in seen_a] == ["system_armed", "new_clip", "system_disarmed"]
+        assert seen_a == seen_b
+
+        # A worker starting later picks up the same state
+        c = make()
+        snapshot = await c.start(recorder([]))
+        assert [item["id"] for item in snapshot["history"]] == ["one"]
+        assert snapshot["seq"] == seen_a[-1]["seq"]
+        assert not snapshot["armed"]
+        for backend in (a, b, c):
+            await backend.close()
+        if server:
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", ["local", "redis"])
+def test_concurrent_changes_apply_in_one_order_everywhere(kind, tmp_path):
+    async def scenario():
+        make, server = await worker_factory(kind, tmp_path)
+        seen_a, seen_b = [], []
+        a, b = make(), make()
+        await a.start(recorder(seen_a))
+        await b.start(recorder(seen_b))
+
+        await asyncio.gather(*(worker.set_armed(i % 3 == 0) for i in range(10) for worker in (a, b)))
+        await eventually(lambda: len(seen_a) == 20 and len(seen_b) == 20)
+        seqs = [e["seq"] for e in seen_a]
+        assert seqs == list(range(seqs[0], seqs[0] + 20))
+        assert seen_a == seen_b
+        for backend in (a, b):
+            await backend.close()
+        if server:
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+def test_memory_backend_keeps_the_newest_clips(tmp_path):
+    async def scenario():
+        seen = []
+        backend = MemoryBackend(str(tmp_path / "history.db"), history_limit=2)
+        await backend.start(recorder(seen))
+        assert await backend.publish_clip(clip("rejected")) is None
+        for clip_id in ("one", "two", "three"):
+            await backend.set_armed(True)
+            await backend.publish_clip(clip(clip_id))
+        await backend.close()
+
+        restarted = MemoryBackend(str(tmp_path / "history.db"), history_limit=2)
+        snapshot = await restarted.start(recorder([]))
+        assert [item["id"] for item in snapshot["history"]] == ["two", "three"]
+        assert [item["seq"] for item in snapshot["history"]] == [2, 3]
+        assert not snapshot["armed"]  # A restart comes up DISARMED
+        await restarted.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", ["local", "redis"])
+def test_batch_takes_one_arm_and_one_event(kind, tmp_path):
+    async def scenario():
+        make, server = await worker_factory(kind, tmp_path)
+        seen = []
+        a, b = make(), make()
+        await a.start(recorder([]))
+        await b.start(recorder(seen))
+
+        await a.set_armed(True)
+        event = await a.publish_clips([clip(clip_id) for clip_id in ("one", "two", "three", "four")])
+        assert event["event"] == "new_clips"
+        assert [item["seq"] for item in event["data"]] == [1, 2, 3, 4]
+        assert await a.publish_clips([clip("five")]) is None  # The whole batch used one arm
+
+        await eventually(lambda: len(seen) == 3)
+        assert [e["event"] for e in seen] == ["system_armed", "new_clips", "system_disarmed"]
+        c = make()
+        snapshot = await c.start(recorder([]))
+        assert [item["id"] for item in snapshot["history"]] == ["two", "three", "four"]  # history_limit=3
+        for backend in (a, b, c):
+            await backend.close()
+        if server:
+            await server.close()
+
+    asyncio.run(scenario())
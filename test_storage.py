@@ -0,0 +1,72 @@
+import asyncio
+import io
+import os
+import time
+
+from blob_store import BlobStore
+from storage import Storage
+
+
+class SlowReader(io.BytesIO):
+    """An upload whose bytes trickle in (slow client or slow disk)."""
+
+    def read(self, size=-1):
+        time.sleep(0.02)
+        return super().read(min(size, 1024) if size and size > 0 else 1024)
+
+
+def test_slow_write_does_not_block_the_event_loop(tmp_path):
+    async def scenario():
+        storage = Storage(BlobStore(str(tmp_path)))
+        storage.start()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        name, _, size = await storage.save_stream(SlowReader(b"x" * 10 * 1024), "png")
+        task.cancel()
+        await storage.close()
+        assert size == 10 * 1024
+        assert os.path.exists(storage.blobs.path(name))
+        assert ticks >= 10  # ~0.2s of writing, the loop kept running meanwhile
+
+    asyncio.run(scenario())
+
+
+def test_release_then_reupload_keeps_the_file(tmp_path):
+    async def scenario():
+        storage = Storage(BlobStore(str(tmp_path)))
+        storage.start()
+        name, _, _ = await storage.save_stream(io.BytesIO(b"same screenshot"), "png")
+        storage.release(name)  # Deletion only queued...
+        again, _, _ = await storage.save_stream(io.BytesIO(b"same screenshot"), "png")
+        await storage.flush()
+        assert again == name
+        assert os.path.exists(storage.blobs.path(name))  # ...and skipped, the blob is in use again
+
+        storage.release(name)
+        await storage.flush()
+        assert not os.path.exists(storage.blobs.path(name))
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_chunked_upload_through_the_pool(tmp_path):
+    async def scenario():
+        storage = Storage(BlobStore(str(tmp_path)))
+        storage.start()
+        partial = await storage.create_partial(6, "png")
+        await asyncio.gather(storage.write_at(partial, 3, b"def"), storage.write_at(partial, 0, b"abc"))
+        name, _ = await storage.commit(partial)
+        assert storage.blobs.refcounts[name] == 1
+        assert await storage.read_if_smaller(name, 6) == b"abcdef"
+        assert await storage.read_if_smaller(name, 5) is None
+        await storage.close()
+
+    asyncio.run(scenario())
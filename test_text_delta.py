@@ -0,0 +1,27 @@
+import hashlib
+
+from text_delta import apply_delta, make_delta, resolve_text
+
+
+def event(text, ops):
+    return {"data": {"sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()}, "delta": {"ops": ops}}
+
+
+def test_delta_round_trip_on_grown_log():
+    base = "".join(f"line {i}\r\n" for i in range(300))
+    new = base.replace("line 7\r\n", "line seven\r\n") + "tail\r\n"
+    ops = make_delta(base, new)
+    assert ops is not None
+    assert apply_delta(base, ops) == new
+
+
+def test_unrelated_text_is_sent_whole():
+    assert make_delta("completely different", "nothing in common here") is None
+
+
+def test_resolve_rejects_stale_base():
+    base, new = "a\nb\nc\n" * 50, "a\nb\nc\n" * 50 + "d\n"
+    ops = make_delta(base, new)
+    assert resolve_text(event(new, ops), base) == new
+    assert resolve_text(event(new, ops), "x\n" + base) is None
+    assert resolve_text(event(new, ops), None) is None
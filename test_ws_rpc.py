@@ -0,0 +1,128 @@
+import json
+import threading
+
+import pytest
+
+from ws_rpc import FrameTooLarge, RequestFailed, WSRequester
+
+
+class FakeServer:
+    """Answers each request from another thread, like the socket's receive loop would."""
+    def __init__(self, rpc, reply):
+        self.rpc = rpc
+        self.reply = reply
+        self.frames = []
+
+    def send(self, data, opcode=None):
+        self.frames.append(data)
+        if isinstance(data, str):
+            request = json.loads(data)
+            if request.get("op") != "upload" or request.get("type") != "image":
+                self._answer(request)
+        else:
+            self._answer(json.loads(self.frames[-2]))
+
+    def _answer(self, request):
+        response = {"event": "response", "id": request["id"], **self.reply(request)}
+        threading.Thread(target=self.rpc.handle, args=(response,)).start()
+
+
+def test_request_matches_response_by_id():
+    rpc = WSRequester()
+    server = FakeServer(rpc, lambda r: {"ok": True, "result": {"op": r["op"]}})
+    rpc.attach(server)
+
+    assert rpc.request("status") == {"op": "status"}
+    assert rpc.request("upload", payload=b"PNG", type="image", ext="png") == {"op": "upload"}
+    assert server.frames[-1] == b"PNG"
+
+
+def test_refused_and_disconnected_requests_raise():
+    rpc = WSRequester()
+    rpc.attach(FakeServer(rpc, lambda r: {"ok": False, "status": 403, "detail": "disarmed"}))
+    with pytest.raises(RequestFailed) as e:
+        rpc.request("upload", type="text", content="hi")
+    assert e.value.status == 403
+
+    rpc.detach()
+    with pytest.raises(ConnectionError):
+        rpc.request("arm")
+
+
+def test_frame_limit_counts_encoded_bytes():
+    rpc = WSRequester()
+    server = FakeServer(rpc, lambda r: {"ok": True, "result": {}})
+    rpc.attach(server)
+
+    text = "剪贴板" * 100  # 300 characters, 900 bytes of UTF-8
+    with pytest.raises(FrameTooLarge):
+        rpc.request("upload", max_frame=800, type="text", content=text)
+    with pytest.raises(FrameTooLarge):
+        rpc.request("upload", payload=b"x" * 801, max_frame=800, type="image", ext="png")
+    assert server.frames == []  # Nothing sent
+
+    rpc.request("upload", max_frame=1000, type="text", content=text)
+    assert len(server.frames[-1].encode()) <= 1000
+
+
+def answer(ws, request_id):
+    """Read past broadcast events to the response for `request_id`."""
+    while True:
+        message = ws.receive_json()
+        if message.get("event") == "response" and message["id"] == request_id:
+            return message
+
+
+def test_ws_ops_on_the_server(server, monkeypatch):
+    main, client = server
+
+    async def no_variants(filename):
+        pass
+
+    monkeypatch.setattr(main, "render_image_variants", no_variants)
+    with client.websocket_connect("/ws?token=test") as ws:
+        assert ws.receive_json()["state"] == {"armed": False}
+
+        ws.send_json({"op": "upload", "id": "1", "type": "text", "content": "hi"})
+        refused = answer(ws, "1")
+        assert refused["ok"] is False and refused["status"] == 403 and refused["detail"] == main.DISARMED
+
+        ws.send_json({"op": "arm", "id": "2"})
+        assert answer(ws, "2")["result"] == {"armed": True}
+        assert client.get("/status").json()["armed"] is True
+
+        ws.send_json({"op": "upload", "id": "3", "type": "text", "content": "hi"})
+        item = answer(ws, "3")["result"]["item"]
+        assert item["content"] == "hi" and client.get("/latest").json()["id"] == item["id"]
+
+        assert client.get("/status").json()["armed"] is False  # The upload used up the arm
+
+        ws.send_json({"op": "arm", "id": "4"})
+        answer(ws, "4")
+        ws.send_json({"op": "upload", "id": "5", "type": "image", "ext": "png"})
+        ws.send_bytes(b"\x89PNG over the socket")
+        item = answer(ws, "5")["result"]["item"]
+        assert client.get(f"/uploads/{item['content']}").content == b"\x89PNG over the socket"
+
+        ws.send_json({"op": "arm", "id": "6"})
+        answer(ws, "6")
+        ws.send_json({"op": "disarm", "id": "7"})
+        assert answer(ws, "7")["result"] == {"armed": False}
+        assert client.get("/status").json()["armed"] is False
+
+
+def test_ws_op_that_crashes_is_still_answered(server, monkeypatch):
+    main, client = server
+
+    async def broken(content):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(main, "text_clip", broken)
+    client.post("/arm")
+    with client.websocket_connect("/ws?token=test") as ws:
+        ws.receive_json()
+        ws.send_json({"op": "upload", "id": "1", "type": "text", "content": "hi"})
+        assert answer(ws, "1") == {"event": "response", "id": "1", "ok": False, "status": 500, "detail": "disk full"}
+
+        ws.send_json({"op": "status", "id": "2"})
+        assert answer(ws, "2")["ok"] is True  # The socket survived
@@ -0,0 +1,53 @@
+"""
+Line-based deltas between consecutive text clips (logs that grew, code that was edited).
+
+A delta is a list of ops applied in order: [start, end] copies base lines
+[start:end), a string is inserted literally. Shared by the server and the desktop clients.
+"""
+import hashlib
+from difflib import SequenceMatcher
+from typing import List, Optional, Union
+
+DeltaOp = Union[List[int], str]
+
+MAX_RATIO = 0.5  # Only worth sending when the delta is at most half the full text
+
+
+def make_delta(base: str, new: str) -> Optional[List[DeltaOp]]:
+    """Ops turning `base` into `new`, or None when a delta wouldn't save enough."""
+    base_lines = base.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = SequenceMatcher(None, base_lines, new_lines, autojunk=False)
+
+    ops: List[DeltaOp] = []
+    size = 0
+    budget = len(new) * MAX_RATIO
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+            size += 16
+        elif j2 > j1:  # replace / insert
+            literal = "".join(new_lines[j1:j2])
+            ops.append(literal)
+            size += len(literal)
+        if size > budget:
+            return None
+    return ops
+
+
+def apply_delta(base: str, ops: List[DeltaOp]) -> str:
+    base_lines = base.splitlines(keepends=True)
+    return "".join(op if isinstance(op, str) else "".join(base_lines[op[0]:op[1]]) for op in ops)
+
+
+def resolve_text(msg: dict, base_text: Optional[str]) -> Optional[str]:
+    """
+    Full text of a delta-encoded new_clip event, given the last text we received.
+    None when our base doesn't match (fetch /clip/{id} instead).
+    """
+    if base_text is None:
+        return None
+    text = apply_delta(base_text, msg["delta"]["ops"])
+    if hashlib.sha256(text.encode("utf-8")).hexdigest() != msg["data"].get("sha256"):
+        return None
+    return text
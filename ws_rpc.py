@@ -0,0 +1,90 @@
+"""
+Request/response calls (upload, arm, disarm, status) over the /ws socket the desktop
+clients already keep open, matched to their answers by correlation id.
+Shared by client.py and desktop_gui.py.
+"""
+import json
+import threading
+import uuid
+from typing import Dict, Optional
+
+import websocket
+
+REQUEST_TIMEOUT = 15  # Seconds to wait for the server's answer
+
+
+class RequestFailed(Exception):
+    """The server refused a request; `status` is the matching HTTP status code."""
+    def __init__(self, status: int, detail):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+class FrameTooLarge(ValueError):
+    """A request would not fit in one WebSocket message; send it some other way."""
+
+
+class WSRequester:
+    def __init__(self):
+        self.ws = None
+        self._pending: Dict[str, list] = {}  # correlation id -> [Event, response]
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()  # An image request and its binary frame must stay adjacent
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None
+
+    def attach(self, ws):
+        """Call from on_open."""
+        self.ws = ws
+
+    def detach(self):
+        """Call from on_close: anything still waiting fails instead of hanging."""
+        self.ws = None
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for slot in pending.values():
+            slot[0].set()
+
+    def request(self, op: str, payload: Optional[bytes] = None, timeout: float = REQUEST_TIMEOUT,
+                max_frame: Optional[int] = None, **fields) -> dict:
+        """`max_frame` caps the encoded size (bytes) of each frame; over it, FrameTooLarge is raised before sending."""
+        ws = self.ws
+        if ws is None:
+            raise ConnectionError("Not connected")
+        request_id = uuid.uuid4().hex
+        message = json.dumps({"op": op, "id": request_id, **fields}, ensure_ascii=False)
+        if max_frame is not None and max(len(message.encode()), len(payload or b"")) > max_frame:
+            raise FrameTooLarge(f"{op} request is over {max_frame} bytes")
+        slot = [threading.Event(), None]
+        with self._lock:
+            self._pending[request_id] = slot
+        try:
+            with self._send_lock:
+                ws.send(message)
+                if payload is not None:
+                    ws.send(payload, opcode=websocket.ABNF.OPCODE_BINARY)
+            if not slot[0].wait(timeout):
+                raise TimeoutError(f"No answer to {op}")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+        response = slot[1]
+        if response is None:
+            raise ConnectionError("Disconnected before the server answered")
+        if not response.get("ok"):
+            raise RequestFailed(response.get("status", 500), response.get("detail"))
+        return response.get("result") or {}
+
+    def handle(self, msg: dict) -> bool:
+        """Feed every incoming event through here; True if it was an answer to one of our requests."""
+        if msg.get("event") != "response":
+            return False
+        with self._lock:
+            slot = self._pending.get(msg.get("id"))
+        if slot is not None:
+            slot[1] = msg
+            slot[0].set()
+        return True